@@ -0,0 +1,96 @@
+"""
+Benchmark: requests per second against the local fake model server, with
+
+    1. a new connection for every request (what happens without a shared client)
+    2. the pooled keep-alive client from clients.py, called from a thread pool
+    3. the async variant of the pooled client
+
+Usage:
+    python bench_http_client.py --requests 500 --concurrency 16 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "script"))
+from clients import http_settings
+from fake_llm_server import start_server
+
+BODY = json.dumps({
+    "model": "fake",
+    "messages": [{"role": "user", "content": "Anna Hansson har nummer 070 091 929 3 och mail anna.hansson@live.se."}]
+})
+
+
+def bench_new_connection(url, requests, concurrency):
+    import httpx
+
+    def call(_):
+        # httpx.post opens and closes its own connection
+        response = httpx.post(url, content=BODY, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(call, range(requests)))
+    return time.perf_counter() - started
+
+
+def bench_pooled(url, requests, concurrency):
+    import httpx
+
+    with httpx.Client(**http_settings(max_connections=concurrency)) as client:
+        def call(_):
+            response = client.post(url, content=BODY, headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(call, range(requests)))
+        return time.perf_counter() - started
+
+
+def bench_async(url, requests, concurrency):
+    import httpx
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(**http_settings(max_connections=concurrency)) as client:
+            async def call():
+                async with limit:
+                    response = await client.post(url, content=BODY, headers={"Content-Type": "application/json"})
+                    response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(call() for _ in range(requests)))
+            return time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/second with and without connection pooling")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated model latency in seconds")
+    args = parser.parse_args()
+
+    server = start_server(port=0, latency=args.latency)
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, model latency {args.latency * 1000:.0f} ms")
+    print(f"{'client':<22}{'seconds':>10}{'req/s':>10}")
+    for name, bench in [("new connection", bench_new_connection), ("pooled keep-alive", bench_pooled), ("pooled async", bench_async)]:
+        seconds = bench(url, args.requests, args.concurrency)
+        print(f"{name:<22}{seconds:>10.2f}{args.requests / seconds:>10.1f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
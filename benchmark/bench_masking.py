@@ -0,0 +1,67 @@
+"""
+Benchmark: masking a 1 MB text with 50k entities.
+
+Compares the masking engine in flask/masking.py with the old /export loop, which rebuilt
+the whole string once per entity. The old loop is quadratic, so it is only timed on the
+first --old-entities entities and extrapolated linearly (which underestimates it).
+
+Usage:
+    python bench_masking.py --size 1000000 --entities 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+from masking import mask_text, MODES
+
+LABELS = ["NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"]
+
+
+def make_data(size, count, seed=1):
+    rng = random.Random(seed)
+    text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyzåäö  \n") for _ in range(size))
+    entities = []
+    for _ in range(count):
+        start = rng.randrange(0, size - 20)
+        end = start + rng.randint(3, 20)
+        entities.append({"label": rng.choice(LABELS), "start": start, "end": end, "text": text[start:end]})
+    return text, entities
+
+
+def old_masking(text, entities):
+    entities = sorted(entities, key=lambda x: x['start'], reverse=True)
+    masked_text = text
+    for ent in entities:
+        masked_text = masked_text[:ent['start']] + f"[{ent['label']}]" + masked_text[ent['end']:]
+    return masked_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Masking engine benchmark")
+    parser.add_argument("--size", type=int, default=1_000_000, help="Text length in characters")
+    parser.add_argument("--entities", type=int, default=50_000)
+    parser.add_argument("--old-entities", type=int, default=2_000, help="Entities to time the old loop on")
+    args = parser.parse_args()
+
+    text, entities = make_data(args.size, args.entities)
+    print(f"Text: {len(text) / 1e6:.1f} MB, {len(entities)} entities (random, many overlapping)")
+
+    for mode in MODES:
+        started = time.perf_counter()
+        mask_text(text, entities, mode)
+        print(f"  engine ({mode:<9}) {time.perf_counter() - started:8.3f}s")
+
+    sample = entities[:args.old_entities]
+    started = time.perf_counter()
+    old_masking(text, sample)
+    seconds = time.perf_counter() - started
+    estimate = seconds * len(entities) / len(sample)
+    print(f"  old loop ({len(sample)} entities) {seconds:8.3f}s -> ~{estimate:.1f}s for {len(entities)} entities")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: adaptive OCR resolution against always rendering at OCR_DPI.
+
+Every PDF is OCR'd twice with extract_text_with_ocr, once at OCR_DPI and once adaptive (all pages
+at OCR_LOW_DPI, pages below OCR_MIN_CONFIDENCE again at OCR_DPI). Reports the time per document,
+the time saved, how many pages had to be read again and the word recall of the adaptive text
+against the OCR_DPI text (1.000 = no words lost).
+
+Usage:
+    python bench_ocr_adaptive.py
+    OCR_LOW_DPI=200 OCR_MIN_CONFIDENCE=85 python bench_ocr_adaptive.py scan1.pdf scan2.pdf
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+from extraction import OCR_DPI, OCR_LOW_DPI, OCR_MIN_CONFIDENCE, extract_text_with_ocr, join_pages
+from profiling import Profiler
+from bench_ocr_preprocess import SAMPLE_PDFS, word_recall
+
+
+def run(pdf_path, adaptive):
+    profiler = Profiler("spans").start()
+    started = time.perf_counter()
+    pages_text, _, _ = extract_text_with_ocr(pdf_path, profiler, adaptive=adaptive)
+    seconds = time.perf_counter() - started
+    ocr_runs = dict(profiler.breakdown()).get("tesseract", {}).get("count", 0)
+    return join_pages(pages_text), seconds, ocr_runs - len(pages_text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive OCR DPI benchmark")
+    parser.add_argument("pdfs", nargs="*", default=SAMPLE_PDFS)
+    args = parser.parse_args()
+
+    print(f"Full: {OCR_DPI} dpi, adaptive: {OCR_LOW_DPI} dpi, re-read below confidence {OCR_MIN_CONFIDENCE:.0f}\n")
+    print(f"{'document':<32} {'full':>9} {'adaptive':>9} {'saved':>7} {'re-read':>8} {'recall':>7}")
+    total_full = total_adaptive = 0.0
+    for pdf_path in args.pdfs:
+        full_text, full_seconds, _ = run(pdf_path, adaptive=False)
+        adaptive_text, adaptive_seconds, reread = run(pdf_path, adaptive=True)
+        total_full += full_seconds
+        total_adaptive += adaptive_seconds
+        saved = 1 - adaptive_seconds / full_seconds if full_seconds else 0.0
+        print(f"{os.path.basename(pdf_path)[:32]:<32} {full_seconds:8.2f}s {adaptive_seconds:8.2f}s {saved:6.0%} "
+              f"{reread:8d} {word_recall(full_text, adaptive_text):7.3f}")
+    if total_full:
+        print(f"\nTotal: {total_full:.2f}s -> {total_adaptive:.2f}s ({1 - total_adaptive / total_full:.0%} saved)")
+
+
+if __name__ == "__main__":
+    main()
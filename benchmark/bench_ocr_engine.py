@@ -0,0 +1,68 @@
+"""
+Benchmark: OCR pages per second, tesseract subprocess per page against the tesserocr pool.
+
+The pages of the sample PDFs are rendered at OCR_DPI and preprocessed once, then every engine
+OCRs all of them with 1 thread and with --threads threads (the engine is shared, like between
+the request threads of a gunicorn worker). The first page is OCR'd once before timing, so the
+tesserocr numbers are for warm instances. Recall is the word recall against the subprocess text.
+
+Usage:
+    python bench_ocr_engine.py
+    python bench_ocr_engine.py scan1.pdf --threads 8 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+from pdf2image import convert_from_path
+from extraction import OCR_DPI, OCR_LANG, OCR_CONFIG
+from ocr_engine import ENGINES, OCR_WORKERS, create_engine
+from ocr_preprocess import preprocess
+from bench_ocr_preprocess import SAMPLE_PDFS, word_recall
+
+
+def ocr_all(engine, images, threads):
+    def words(image):
+        return " ".join(word for word in engine.image_to_data(image)["text"] if word.strip())
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(words, images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR engine benchmark")
+    parser.add_argument("pdfs", nargs="*", default=SAMPLE_PDFS)
+    parser.add_argument("--threads", type=int, default=OCR_WORKERS)
+    parser.add_argument("--repeat", type=int, default=1, help="OCR every page this many times")
+    args = parser.parse_args()
+
+    images = []
+    for pdf_path in args.pdfs:
+        images.extend(preprocess(image)[0] for image in convert_from_path(pdf_path, dpi=OCR_DPI))
+    images = images * args.repeat
+    print(f"{len(images)} pages at {OCR_DPI} dpi\n")
+    print(f"{'engine':<12} {'threads':>7} {'pages/s':>9} {'recall':>7}")
+
+    reference = None
+    for name in ENGINES:
+        engine = create_engine(OCR_LANG, OCR_CONFIG, name, args.threads)
+        if engine.name != name:
+            continue
+        engine.image_to_data(images[0])
+        for threads in sorted({1, args.threads}):
+            started = time.perf_counter()
+            texts = ocr_all(engine, images, threads)
+            seconds = time.perf_counter() - started
+            if reference is None:
+                reference = texts
+            recall = sum(word_recall(r, t) for r, t in zip(reference, texts)) / len(texts)
+            print(f"{name:<12} {threads:7d} {len(images) / seconds:9.2f} {recall:7.3f}")
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
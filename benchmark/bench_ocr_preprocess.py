@@ -0,0 +1,99 @@
+"""
+Benchmark: OCR preprocessing methods, time per page and OCR accuracy.
+
+Every page of the sample PDFs is rendered at 300 dpi and preprocessed with
+
+    old        the previous preprocess_image: lambda threshold + ImageEnhance.Contrast
+    fixed      the same threshold with a lookup table and without the contrast pass
+    otsu       global threshold from the histogram
+    sauvola    local threshold (NumPy)
+    none       greyscale only, Tesseract binarizes
+    +deskew    the same with deskew
+
+and OCR'd with Tesseract. Accuracy is the word recall against a reference text: for text-based
+PDFs the pdfplumber text (so the rendered page is a perfectly clean "scan"), for scanned PDFs
+the OCR text of the old path (then it only shows how much a method differs from before).
+
+Usage:
+    python bench_ocr_preprocess.py                       # the sample PDFs in flask/uploads
+    python bench_ocr_preprocess.py scan1.pdf --pages 3
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+import pytesseract
+from pdf2image import convert_from_path
+from PIL import ImageEnhance
+from extraction import OCR_DPI, OCR_LANG, OCR_CONFIG, MIN_TEXT_LENGTH, extract_text_with_pdfplumber, join_pages
+from ocr_preprocess import preprocess
+
+SAMPLE_PDFS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask", "uploads", "*.pdf")))
+METHODS = [("fixed", False), ("otsu", False), ("sauvola", False), ("none", False), ("fixed", True), ("otsu", True)]
+
+
+def old_preprocess(image):
+    image = image.convert("L")
+    image = image.point(lambda x: 0 if x < 140 else 255)
+    return ImageEnhance.Contrast(image).enhance(2.5)
+
+
+def word_recall(reference, text):
+    """Share of the reference words (with repeats) that are also in text."""
+    expected = Counter(reference.split())
+    found = Counter(text.split())
+    total = sum(expected.values())
+    return sum(min(count, found[word]) for word, count in expected.items()) / total if total else 1.0
+
+
+def ocr(image):
+    return pytesseract.image_to_string(image, lang=OCR_LANG, config=OCR_CONFIG)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR preprocessing benchmark")
+    parser.add_argument("pdfs", nargs="*", default=SAMPLE_PDFS)
+    parser.add_argument("--pages", type=int, default=2, help="Pages per PDF")
+    args = parser.parse_args()
+
+    rows = {}
+    for pdf_path in args.pdfs:
+        images = convert_from_path(pdf_path, dpi=OCR_DPI, last_page=args.pages)
+        pages_text, _, _ = extract_text_with_pdfplumber(pdf_path)
+        text_based = len(join_pages(pages_text)) >= MIN_TEXT_LENGTH
+        print(f"{os.path.basename(pdf_path)}: {len(images)} pages, reference: {'pdfplumber' if text_based else 'old OCR'}")
+
+        for page_number, image in enumerate(images, start=1):
+            started = time.perf_counter()
+            old_image = old_preprocess(image)
+            old_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            old_text = ocr(old_image)
+            old_ocr_seconds = time.perf_counter() - started
+            reference = pages_text.get(f"page_{page_number}", "") if text_based else old_text
+            rows.setdefault("old", []).append((old_seconds, old_ocr_seconds, word_recall(reference, old_text)))
+
+            for method, deskew in METHODS:
+                started = time.perf_counter()
+                processed, _ = preprocess(image, method, deskew)
+                seconds = time.perf_counter() - started
+                started = time.perf_counter()
+                text = ocr(processed)
+                ocr_seconds = time.perf_counter() - started
+                name = method + ("+deskew" if deskew else "")
+                rows.setdefault(name, []).append((seconds, ocr_seconds, word_recall(reference, text)))
+
+    print(f"\n{'method':<16} {'preprocess/page':>16} {'tesseract/page':>16} {'word recall':>12}")
+    for name, values in rows.items():
+        count = len(values)
+        print(f"{name:<16} {sum(v[0] for v in values) / count * 1000:13.1f} ms "
+              f"{sum(v[1] for v in values) / count * 1000:13.1f} ms {sum(v[2] for v in values) / count:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
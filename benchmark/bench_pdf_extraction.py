@@ -0,0 +1,61 @@
+"""
+Benchmark: pdfplumber extraction of text PDFs, one process against page ranges in a process pool,
+and the cost of layout=True.
+
+    sequential         one process, layout=True (what small PDFs get)
+    parallel           page ranges in --workers processes, layout=True
+    no layout          one process, layout=False
+
+Reports seconds per PDF and the speedup of the parallel run. "same" checks that the parallel result is identical
+to the sequential one, "recall" is the word recall of the layout=False text against the layout
+text (the words should all be there, only the spacing and column alignment differ).
+
+Usage:
+    python bench_pdf_extraction.py big_report.pdf --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+import extraction
+from extraction import PDF_WORKERS, extract_text_with_pdfplumber, join_pages
+from bench_ocr_preprocess import SAMPLE_PDFS, word_recall
+
+
+def timed(pdf_path, layout, workers, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = extract_text_with_pdfplumber(pdf_path, layout=layout, workers=workers)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pdfplumber extraction benchmark")
+    parser.add_argument("pdfs", nargs="*", default=SAMPLE_PDFS)
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs")
+    args = parser.parse_args()
+
+    # Parallel for every PDF here, not only the long ones
+    extraction.PDF_PARALLEL_MIN_PAGES = 1
+
+    print(f"{'document':<32} {'pages':>5} {'sequential':>11} {'parallel':>11} {'speedup':>8} {'no layout':>11} {'same':>5} {'recall':>7}")
+    for pdf_path in args.pdfs:
+        sequential, sequential_seconds = timed(pdf_path, True, 1, args.repeat)
+        parallel, parallel_seconds = timed(pdf_path, True, args.workers, args.repeat)
+        plain, plain_seconds = timed(pdf_path, False, 1, args.repeat)
+        pages = len(sequential[0])
+        same = sequential[0] == parallel[0] and sequential[1] == parallel[1]
+        recall = word_recall(join_pages(sequential[0]), join_pages(plain[0]))
+        print(f"{os.path.basename(pdf_path)[:32]:<32} {pages:5d} {sequential_seconds:10.2f}s {parallel_seconds:10.2f}s "
+              f"{sequential_seconds / parallel_seconds:7.1f}x {plain_seconds:10.2f}s {'yes' if same else 'NO':>5} {recall:7.3f}")
+
+
+if __name__ == "__main__":
+    main()
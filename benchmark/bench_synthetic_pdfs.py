@@ -0,0 +1,116 @@
+"""
+Benchmark: extraction of the synthetic PDFs from synthetic_pdfs.py against their gold text.
+
+Every PDF in the manifest is extracted the way /run does it (pdfplumber,
+OCR when there is less than MIN_TEXT_LENGTH text) and compared with the gold text:
+
+    s/page      extraction time per page
+    ocr         share of the PDFs that went to OCR
+    recall      word recall against the gold text
+    exact       share of the documents whose text is the gold text apart from whitespace
+    kept        share of the gold entities whose characters are at the same place in the
+                extracted text, whitespace not counted. For these, the gold offsets carry over
+    found       share of the gold entities that are somewhere in the extracted text
+
+Per variant, so the scan variants show what noise, skew and JPEG artifacts cost OCR.
+
+Usage:
+    python synthetic_pdfs.py ../synthetic-pdfs --count 20
+    python bench_synthetic_pdfs.py ../synthetic-pdfs
+    python bench_synthetic_pdfs.py ../synthetic-pdfs --variants text,degraded --limit 5
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask"))
+from extraction import MIN_TEXT_LENGTH, extract_text_with_pdfplumber, extract_text_with_ocr, join_pages
+from bench_ocr_preprocess import word_recall
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def extract(pdf_path):
+    """Page texts and whether OCR was used, like iter_document_pages in app.py."""
+    pages, _, _ = extract_text_with_pdfplumber(pdf_path)
+    if len("".join(pages.values()).strip()) >= MIN_TEXT_LENGTH:
+        return pages, False
+    pages, _, _ = extract_text_with_ocr(pdf_path)
+    return pages, True
+
+
+def entity_scores(gold, text):
+    """(kept, found) counts for the gold entities in the extracted text."""
+    gold_text = gold["text"]
+    # Index of every gold character among the non-whitespace characters
+    position = []
+    count = 0
+    for char in gold_text:
+        position.append(count)
+        count += not char.isspace()
+    compact_gold = WHITESPACE.sub("", gold_text)
+    compact_text = WHITESPACE.sub("", text)
+    spaced_text = WHITESPACE.sub(" ", text)
+
+    kept = found = 0
+    for entity in gold["gold_entities"]:
+        start, end = position[entity["start"]], position[entity["end"] - 1] + 1
+        kept += compact_text[start:end] == compact_gold[start:end]
+        found += WHITESPACE.sub(" ", entity["text"]) in spaced_text
+    return kept, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction benchmark on synthetic PDFs")
+    parser.add_argument("folder", help="Folder written by synthetic_pdfs.py")
+    parser.add_argument("--variants", help="Comma separated, default all in the manifest")
+    parser.add_argument("--limit", type=int, help="At most this many PDFs per variant")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.folder, "gold.json"), encoding="utf-8") as f:
+        gold_docs = {doc["id"]: doc for doc in json.load(f)}
+    with open(os.path.join(args.folder, "manifest.jsonl"), encoding="utf-8") as f:
+        manifest = [json.loads(line) for line in f if line.strip()]
+    variants = args.variants.split(",") if args.variants else list(dict.fromkeys(row["variant"] for row in manifest))
+
+    print(f"{'variant':<10} {'pdfs':>5} {'pages':>6} {'s/page':>8} {'ocr':>5} {'recall':>7} {'exact':>6} {'kept':>6} {'found':>6} {'failed':>7}")
+    for variant in variants:
+        rows = [row for row in manifest if row["variant"] == variant][:args.limit]
+        if not rows:
+            continue
+        pages = seconds = ocr_count = exact = kept = found = entities = failed = 0
+        recalls = []
+        for row in rows:
+            gold = gold_docs[row["id"]]
+            started = time.perf_counter()
+            try:
+                pages_text, used_ocr = extract(os.path.join(args.folder, row["pdf"]))
+            except Exception as e:
+                print(f"WARNING: {row['pdf']} could not be extracted: {e}")
+                failed += 1
+                continue
+            seconds += time.perf_counter() - started
+            pages += row["pages"]
+            text = join_pages(pages_text)
+            ocr_count += used_ocr
+            recalls.append(word_recall(gold["text"], text))
+            exact += WHITESPACE.sub("", text) == WHITESPACE.sub("", gold["text"])
+            doc_kept, doc_found = entity_scores(gold, text)
+            kept += doc_kept
+            found += doc_found
+            entities += len(gold["gold_entities"])
+
+        done = len(rows) - failed
+        if not done:
+            print(f"{variant:<10} {len(rows):5d} {'':>6} {'':>8} {'':>5} {'':>7} {'':>6} {'':>6} {'':>6} {failed:7d}")
+            continue
+        print(f"{variant:<10} {len(rows):5d} {pages:6d} {seconds / pages:8.3f} {ocr_count / done:5.0%} "
+              f"{sum(recalls) / done:7.3f} {exact / done:6.0%} {kept / max(entities, 1):6.1%} {found / max(entities, 1):6.1%} {failed:7d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Load test of the served app against the local fake model server.
+
+Starts fake_llm_server.py, starts the app with gunicorn (gunicorn.conf.py, WSGI or ASGI mode)
+pointed at the fake server through OPENAI_BASE_URL, and then for every concurrency level
+uploads the sample PDFs in flask/uploads to /run and exports the result with /export. Per level
+it reports throughput and p50/p95/p99 latency of each stage:
+
+    first_line  upload sent -> first LOG: line (queueing for a free worker)
+    extraction  upload sent -> first TEXT_APPEND: (first page extracted and chunked)
+    inference   first TEXT_APPEND: -> DATA_JSON: (the rest of the pages, extracted while the
+                chunks go through the model)
+    run         the whole /run request
+    export      the /export request (layout-preserving redaction)
+
+    python load_test.py --mode wsgi --concurrency 1,4,16,64 --requests 64 --latency 0.5
+    python load_test.py --mode asgi --concurrency 16,64,256 --token-delay 0.05 --error-rate 0.1
+    python load_test.py --url http://127.0.0.1:5000 --concurrency 4    # an app you started yourself
+    python load_test.py --no-export --json results.json
+
+With --url no servers are started, run fake_llm_server.py yourself and start the app with
+OPENAI_BASE_URL pointing at it.
+
+--requests is the number of documents per level (default: 4 x concurrency). The test stops
+early when less than half of the documents at a level succeed, since latency is meaningless
+once the app has collapsed.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "script"))
+from fake_llm_server import start_server
+
+STAGES = ("first_line", "extraction", "inference", "run", "export")
+
+FLASK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "flask")
+SAMPLE_PDFS = sorted(glob.glob(os.path.join(FLASK_DIR, "uploads", "*.pdf")))
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in 0-100."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode("utf-8") + data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def run_once(base_url, pdf_path, export=True, timeout=600):
+    """
+    One /run upload, followed by an /export of its result.
+    Returns {"ok", "error", <stage>: seconds or None for every stage in STAGES}.
+    """
+    with open(pdf_path, "rb") as f:
+        body, content_type = multipart("file", os.path.basename(pdf_path), f.read())
+    request = urllib.request.Request(f"{base_url}/run", data=body, headers={"Content-Type": content_type})
+
+    result = {stage: None for stage in STAGES}
+    result.update({"ok": False, "error": None})
+    started = time.perf_counter()
+    first_page_at = None
+    last_line = ""
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            for line in response:
+                now = time.perf_counter() - started
+                if result["first_line"] is None:
+                    result["first_line"] = now
+                last_line = line.decode("utf-8", "replace")
+                if first_page_at is None and last_line.startswith("TEXT_APPEND:"):
+                    first_page_at = now
+        result["run"] = time.perf_counter() - started
+    except Exception as e:
+        result["error"] = f"/run: {e}"
+        return result
+
+    # DATA_JSON: is always the last line of a finished run
+    if not last_line.startswith("DATA_JSON:"):
+        result["error"] = f"/run did not finish: {last_line[:200]}"
+        return result
+    if first_page_at is not None:
+        result["extraction"] = first_page_at
+        result["inference"] = result["run"] - first_page_at
+
+    if export:
+        data = json.loads(last_line[len("DATA_JSON:"):])
+        payload = json.dumps({"text": data["text"], "entities": data["predicted_entities"], "mode": "label",
+                              "filename": data["id"], "job": data.get("job")}).encode("utf-8")
+        request = urllib.request.Request(f"{base_url}/export", data=payload, headers={"Content-Type": "application/json"})
+        export_started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+            result["export"] = time.perf_counter() - export_started
+        except Exception as e:
+            result["error"] = f"/export: {e}"
+            return result
+
+    result["ok"] = True
+    return result
+
+
+def start_app(mode, port, llm_url, workers, threads):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": llm_url,
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "fake-key"),
+        "SERVER_MODE": mode,
+        "WEB_BIND": f"127.0.0.1:{port}",
+        "WEB_WORKERS": str(workers),
+        "WEB_THREADS": str(threads),
+        "WEB_LOG_LEVEL": "warning",
+        # The sample PDFs are uploaded over and over, with the chunk cache only the first upload of each would reach the model
+        "CHUNK_CACHE": "0",
+    })
+    target = "asgi:application" if mode == "asgi" else "app:app"
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", target],
+                               cwd=FLASK_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{base_url}/metrics", timeout=1).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("The app did not start within 60 seconds")
+
+
+def load(base_url, requests, concurrency, export=True, pdfs=SAMPLE_PDFS):
+    """Runs requests documents with concurrency parallel clients. Returns (results, wall_seconds)."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda i: run_once(base_url, pdfs[i % len(pdfs)], export), range(requests)))
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall, concurrency):
+    """Throughput and latency percentiles per stage for one concurrency level."""
+    ok = [r for r in results if r["ok"]]
+    summary = {
+        "concurrency": concurrency,
+        "documents": len(results),
+        "ok": len(ok),
+        "wall_seconds": wall,
+        "docs_per_second": len(ok) / wall if wall else 0.0,
+        "errors": sorted({r["error"] for r in results if r["error"]}),
+        "stages": {}
+    }
+    for stage in STAGES:
+        values = [r[stage] for r in results if r[stage] is not None]
+        if not values:
+            continue
+        summary["stages"][stage] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            # Completions of this stage per second of wall time
+            "per_second": len(values) / wall if wall else 0.0
+        }
+    return summary
+
+
+def report(summary):
+    def ms(value):
+        return f"{value * 1000:8.0f}" if value is not None else "       -"
+
+    print(f"concurrency {summary['concurrency']}: {summary['ok']}/{summary['documents']} ok, "
+          f"{summary['docs_per_second']:.2f} docs/s")
+    for stage, values in summary["stages"].items():
+        print(f"    {stage:<11} p50 {ms(values['p50'])} ms  p95 {ms(values['p95'])} ms  "
+              f"p99 {ms(values['p99'])} ms  {values['per_second']:7.2f}/s")
+    for error in summary["errors"][:3]:
+        print(f"    failed: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /run against the fake model server")
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--url", help="Test an already running app instead of starting gunicorn")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, help="Documents per level (default 4 x concurrency)")
+    parser.add_argument("--no-export", action="store_true", help="Only test /run")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model: seconds before the answer starts")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Fake model: seconds between streamed lines")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake model: share of 429/500 answers")
+    args = parser.parse_args()
+
+    if not SAMPLE_PDFS:
+        sys.exit(f"No sample PDFs in {os.path.join(FLASK_DIR, 'uploads')}")
+
+    fake = None
+    process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            fake = start_server(port=0, error_rate=args.error_rate, latency=args.latency, token_delay=args.token_delay)
+            process, base_url = start_app(args.mode, args.port, f"http://127.0.0.1:{fake.server_port}/v1",
+                                          args.workers, args.threads)
+        print(f"{args.mode if not args.url else base_url}: {len(SAMPLE_PDFS)} sample PDFs, fake model latency "
+              f"{args.latency}s, token delay {args.token_delay}s, error rate {args.error_rate}")
+
+        summaries = []
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            requests = args.requests or 4 * concurrency
+            results, wall = load(base_url, requests, concurrency, export=not args.no_export)
+            summary = summarize(results, wall, concurrency)
+            summaries.append(summary)
+            report(summary)
+            if summary["ok"] < summary["documents"] / 2:
+                print("Less than half of the documents succeeded, stopping")
+                break
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "levels": summaries}, f, indent=2)
+            print(f"Saved results to {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if fake is not None:
+            fake.shutdown()
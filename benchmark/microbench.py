@@ -0,0 +1,359 @@
+"""
+Micro-benchmarks for the pure-Python hot paths, with a history over commits.
+
+    index_finder       entity_index.index_finder (get_predictions*.py)
+    build_json         entity_index.build_json
+    chunking           extraction.split_text_into_chunks_with_offsets
+    clean_whitespace   normalize.normalize_whitespace against the text-only extraction.clean_whitespace
+    masking            masking.mask_text, all modes (/export)
+    eval_scoring       eval.evaluate (set-based span and label scoring)
+
+Every benchmark runs on synthetic documents from make_document(), over a grid of text size,
+entity count and duplicate density (the share of mentions that repeat an earlier entity, which
+is what makes index_finder and build_json slow). Each case is timed like timeit: the call is
+repeated until a round takes at least --min-time, and the median and best time per call over
+--rounds rounds is kept.
+
+    python microbench.py                      # run everything, append to results/history.json
+    python microbench.py -k masking --quick   # only benchmarks matching "masking", small grid
+    python microbench.py --compare            # latest run against the one before it
+    python microbench.py --compare abc1234    # latest run against the last run of commit abc1234
+
+A benchmark whose module cannot be imported (e.g. extraction without pdfplumber) is skipped.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "script"))
+sys.path.insert(0, os.path.join(ROOT, "flask"))
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "history.json")
+# Slower than the baseline by more than this and the comparison flags it
+REGRESSION_THRESHOLD = 0.10
+
+LABELS = ["NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"]
+LABEL_IDS = {label: str(i) for i, label in enumerate(LABELS, start=1)}
+FIRST_NAMES = ["Anna", "Erik", "Elin", "Mia", "Lars", "Sara", "Johan", "Karin", "Nils", "Maja"]
+LAST_NAMES = ["Rask", "Hansson", "Lindgren", "Berg", "Holm", "Ek", "Strand", "Nyström"]
+STREETS = ["Stjärnvägen", "Storgatan", "Kyrkogatan", "Björkvägen", "Sjövägen"]
+CITIES = ["Hässleholm", "Malmö", "Lund", "Umeå", "Visby"]
+FILLER = ("och det var så att handläggaren ringde om ansökan som skickats in förra veckan "
+          "men ingen svarade i telefon så ärendet fick vänta till i morgon ").split()
+
+FULL_GRID = {
+    "size": [10_000, 100_000, 1_000_000],
+    "entities": [100, 1_000, 10_000],
+    "duplicates": [0.0, 0.5, 0.9],
+}
+QUICK_GRID = {
+    "size": [10_000, 100_000],
+    "entities": [100, 1_000],
+    "duplicates": [0.0, 0.9],
+}
+
+
+# --- SYNTHETIC DATA ---
+
+def make_entity(rng, label):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    if label == "NAME":
+        return f"{first} {last}"
+    if label == "PHONE":
+        return f"07{rng.randint(0, 9)} {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}"
+    if label == "ADDRESS":
+        return f"{rng.choice(STREETS)} {rng.randint(1, 99)}, {rng.choice(CITIES)}"
+    if label == "NATIONAL_ID":
+        return f"{rng.randint(40, 99)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}-{rng.randint(0, 9999):04d}"
+    return f"{first.lower()}.{last.lower()}{rng.randint(1, 999)}@example.se"
+
+
+def make_document(size, entities, duplicates, seed=1):
+    """
+    A document of about size characters with the given number of entity mentions.
+    duplicates is the share of mentions that repeat an entity string used before.
+    Returns (text, gold) where gold is [{"label", "start", "end", "text"}, ...] in text order.
+    """
+    rng = random.Random(seed)
+    mentions = []
+    seen = []
+    for _ in range(entities):
+        if seen and rng.random() < duplicates:
+            mentions.append(rng.choice(seen))
+        else:
+            label = rng.choice(LABELS)
+            mention = (label, make_entity(rng, label))
+            seen.append(mention)
+            mentions.append(mention)
+
+    # Spread the mentions evenly and fill the gaps with words
+    entity_chars = sum(len(text) for _, text in mentions)
+    gap = max(1, (size - entity_chars) // (entities + 1))
+    parts = []
+    gold = []
+    position = 0
+
+    def filler(length):
+        words = []
+        total = 0
+        while total < length:
+            word = rng.choice(FILLER)
+            words.append(word)
+            total += len(word) + 1
+        return (" ".join(words) + ("\n\n" if rng.random() < 0.1 else " "))[:max(length, 1)]
+
+    for label, entity_text in mentions:
+        # Whitespace on both sides, so an entity never runs into the filler words
+        piece = " " + filler(gap - 2)
+        if not piece.endswith((" ", "\n")):
+            piece += " "
+        parts.append(piece)
+        position += len(piece)
+        parts.append(entity_text)
+        gold.append({"label": label, "start": position, "end": position + len(entity_text), "text": entity_text})
+        position += len(entity_text)
+    parts.append(" " + filler(gap))
+    return "".join(parts), gold
+
+
+def predictions_for(gold):
+    """The model output for a document: [(label_id, entity_text), ...] in text order."""
+    return [(LABEL_IDS[ent["label"]], ent["text"]) for ent in gold]
+
+
+def noisy_predictions(gold, seed=2):
+    """Predictions for eval: about 80% correct, the rest shifted or with the wrong label."""
+    rng = random.Random(seed)
+    predicted = []
+    for ent in gold:
+        roll = rng.random()
+        if roll < 0.8:
+            predicted.append(dict(ent))
+        elif roll < 0.9:
+            predicted.append({**ent, "end": ent["end"] + 1})
+        else:
+            predicted.append({**ent, "label": rng.choice(LABELS)})
+    return predicted
+
+
+# --- BENCHMARKS ---
+# Each setup(text, gold) imports what it needs and returns {variant: callable}
+
+def bench_index_finder(text, gold):
+    from entity_index import index_finder
+    entity_texts = [ent["text"] for ent in gold]
+    return {"": lambda: index_finder(text, entity_texts)}
+
+
+def bench_build_json(text, gold):
+    from entity_index import build_json, index_finder
+    predictions = predictions_for(gold)
+    indexed = index_finder(text, [p[1] for p in predictions])
+
+    def run():
+        # build_json pops from the lookup lists, so it gets a fresh copy every call
+        return build_json(predictions, [dict(item) for item in indexed])
+    return {"": run}
+
+
+def bench_chunking(text, gold):
+    from extraction import split_text_into_chunks_with_offsets
+    return {"": lambda: split_text_into_chunks_with_offsets(text)}
+
+
+def bench_clean_whitespace(text, gold):
+    from normalize import normalize_whitespace
+    from extraction import clean_whitespace
+    # Like a layout=True page: runs of padding spaces and empty lines
+    raw = text.replace(" ", "    ").replace("\n\n", "\n\n\n\n")
+    # The difference is what the offset map costs
+    return {"normalize": lambda: normalize_whitespace(raw), "regex": lambda: clean_whitespace(raw)}
+
+
+def bench_masking(text, gold):
+    from masking import mask_text, MODES
+    return {mode: (lambda mode=mode: mask_text(text, gold, mode)) for mode in MODES}
+
+
+def bench_eval_scoring(text, gold):
+    from eval import evaluate
+    # Split the document into 50 "docs" so doc ids take part in the sets like in the real data
+    docs = 50
+    gold_data = [{"id": f"doc-{i}", "gold_entities": gold[i::docs]} for i in range(docs)]
+    predicted = noisy_predictions(gold)
+    pred_data = [{"id": f"doc-{i}", "predicted_entities": predicted[i::docs]} for i in range(docs)]
+    return {"": lambda: evaluate(gold_data, pred_data, "bench")}
+
+
+BENCHMARKS = {
+    "index_finder": bench_index_finder,
+    "build_json": bench_build_json,
+    "chunking": bench_chunking,
+    "clean_whitespace": bench_clean_whitespace,
+    "masking": bench_masking,
+    "eval_scoring": bench_eval_scoring,
+}
+
+
+# --- TIMING ---
+
+def time_call(fn, rounds, min_time):
+    """Median and best seconds per call, timeit-style (number of calls per round grows until min_time)."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    per_call = [elapsed / number]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        per_call.append((time.perf_counter() - started) / number)
+    return statistics.median(per_call), min(per_call)
+
+
+def case_id(name, variant, size, entities, duplicates):
+    suffix = f"[{variant}]" if variant else ""
+    return f"{name}{suffix} size={size} entities={entities} dup={duplicates}"
+
+
+def cases(grid):
+    """(size, entities, duplicates) for every case in the grid that makes sense."""
+    for size in grid["size"]:
+        for entities in grid["entities"]:
+            # More entities than fit in the text makes no sense
+            if entities * 40 > size:
+                continue
+            for duplicates in grid["duplicates"]:
+                yield size, entities, duplicates
+
+
+def run(grid, pattern=None, rounds=5, min_time=0.05, log=print):
+    """Runs the benchmarks over the grid. Returns {case_id: {"median", "min"}}."""
+    results = {}
+    documents = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        try:
+            for case in cases(grid):
+                if case not in documents:
+                    documents[case] = make_document(*case)
+                for variant, fn in setup(*documents[case]).items():
+                    median, best = time_call(fn, rounds, min_time)
+                    cid = case_id(name, variant, *case)
+                    results[cid] = {"median": median, "min": best}
+                    log(f"{cid:<70} {median * 1000:10.3f} ms  (best {best * 1000:.3f})")
+        except ImportError as e:
+            log(f"{name:<28} skipped ({e})")
+    return results
+
+
+# --- HISTORY ---
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_history(path=HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_run(results, path=HISTORY_FILE):
+    history = load_history(path)
+    entry = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "results": results
+    }
+    history.append(entry)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    return entry
+
+
+def compare(history, baseline_commit=None, threshold=REGRESSION_THRESHOLD):
+    """Prints the latest run against the run before it, or the last run of baseline_commit."""
+    if len(history) < 2:
+        print("Need at least two runs in the history to compare")
+        return 0
+    current = history[-1]
+    if baseline_commit:
+        matches = [run for run in history[:-1] if run["commit"].startswith(baseline_commit)]
+        if not matches:
+            print(f"No run of commit {baseline_commit} in the history")
+            return 0
+        baseline = matches[-1]
+    else:
+        baseline = history[-2]
+
+    print(f"{current['commit']} ({current['date']}) vs {baseline['commit']} ({baseline['date']})")
+    regressions = 0
+    for cid, values in current["results"].items():
+        base = baseline["results"].get(cid)
+        if base is None:
+            print(f"  {cid:<70} {values['median'] * 1000:10.3f} ms       new")
+            continue
+        ratio = values["median"] / base["median"] if base["median"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"  {cid:<70} {base['median'] * 1000:10.3f} -> {values['median'] * 1000:10.3f} ms  x{ratio:5.2f}{flag}")
+    print(f"{regressions} regressions (slower than x{1 + threshold:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the pure-Python hot paths")
+    parser.add_argument("-k", dest="pattern", help="Only benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="Smaller grid")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum seconds per round")
+    parser.add_argument("--no-save", action="store_true", help="Do not add the run to the history")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--compare", nargs="?", const="", metavar="COMMIT",
+                        help="Only compare: latest run against the previous one or the given commit")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        regressions = compare(load_history(args.history), args.compare or None)
+        sys.exit(1 if regressions else 0)
+
+    results = run(QUICK_GRID if args.quick else FULL_GRID, args.pattern, args.rounds, args.min_time)
+    if not args.no_save:
+        entry = save_run(results, args.history)
+        print(f"Saved {len(results)} results for {entry['commit']} to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Synthetic PDFs with gold entities, for benchmarking extraction, OCR and the whole pipeline on
+more than the four sample PDFs in flask/uploads.
+
+Every document from synthetic_corpus.py is laid out into A4 pages (Helvetica 11 pt, lines never
+break inside an entity) and written as one PDF per variant:
+
+    text      a text PDF written with FPDF, what pdfplumber reads
+    scan      the same pages drawn into an image at --dpi, a clean scan (image-only PDF, so OCR)
+    noisy     scan with grey noise, specks and a slight blur
+    skewed    scan rotated by 0.5-3 degrees
+    jpeg      scan saved with heavy JPEG compression (quality 15-35)
+    degraded  all of noisy, skewed and jpeg
+
+The gold file has the text as a perfect extraction would give it: the lines of each page joined
+with "\n", pages joined with "\n" like extraction.join_pages. Entity offsets are moved from the
+synthetic text to this text, so they stay exact. The manifest (manifest.jsonl) has a row per PDF
+with its variant, page count and degradation parameters. Documents are seeded like
+synthetic_corpus.py, so a seed always gives the same pages and the same degradations.
+
+    python synthetic_pdfs.py ../synthetic-pdfs --count 50
+    python synthetic_pdfs.py ../synthetic-pdfs --count 500 --variants text,degraded --workers 4
+    python bench_synthetic_pdfs.py ../synthetic-pdfs
+
+The scans are drawn with --font, by default the first of FONT_CANDIDATES that exists. Pillow's
+built-in font is the last resort, it has no å, ä and ö.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "script"))
+from fpdf import FPDF
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont
+from json_stream import DocumentWriter
+from synthetic_corpus import generate_document
+
+VARIANTS = ["text", "scan", "noisy", "skewed", "jpeg", "degraded"]
+
+PAGE_WIDTH, PAGE_HEIGHT = 210, 297  # mm
+MARGIN = 20
+FONT_SIZE = 11  # pt
+LINE_HEIGHT = 5.5  # mm
+PARAGRAPH_GAP = 3  # mm, extra space where the text has an empty line
+MM_PER_INCH = 25.4
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+
+def break_points(text, entities):
+    """Indexes of the spaces a line may break at: all spaces that are not inside an entity."""
+    inside = bytearray(len(text))
+    for entity in entities:
+        inside[entity["start"]:entity["end"]] = b"\x01" * (entity["end"] - entity["start"])
+    return [i for i, char in enumerate(text) if char == " " and not inside[i]]
+
+
+def layout(text, entities, measure, width=PAGE_WIDTH - 2 * MARGIN):
+    """
+    Wraps text into lines that fit width (measure(string) is the width in mm) and the lines into pages.
+    Returns pages as lists of (start, end, gap_before), start:end being the line in text.
+    """
+    breaks = set(break_points(text, entities))
+    lines = []
+    gap = 0.0
+    position = 0
+    for hard_line in text.split("\n"):
+        start, end = position, position + len(hard_line)
+        position = end + 1
+        if start == end:
+            # An empty line is a paragraph gap, not a line of its own
+            gap = PARAGRAPH_GAP
+            continue
+        line_start = start
+        last_break = None
+        i = start
+        while i <= end:
+            if i == end or i in breaks:
+                if measure(text[line_start:i]) > width and last_break is not None:
+                    lines.append((line_start, last_break, gap))
+                    gap = 0.0
+                    line_start = last_break + 1
+                    last_break = None
+                    continue
+                last_break = i
+            i += 1
+        lines.append((line_start, end, gap))
+        gap = 0.0
+
+    pages = [[]]
+    y = MARGIN
+    for start, end, gap in lines:
+        y += gap + LINE_HEIGHT
+        if y > PAGE_HEIGHT - MARGIN and pages[-1]:
+            pages.append([])
+            y = MARGIN + LINE_HEIGHT
+            gap = 0.0
+        pages[-1].append((start, end, gap))
+    return pages
+
+
+def page_document(doc, pages):
+    """The gold document for the laid out pages: lines and pages joined with "\n", entity offsets moved along."""
+    parts = []
+    line_offsets = []  # (start in doc text, start in the new text)
+    position = 0
+    for page in pages:
+        for start, end, _ in page:
+            if parts:
+                parts.append("\n")
+                position += 1
+            line_offsets.append((start, position))
+            parts.append(doc["text"][start:end])
+            position += end - start
+    text = "".join(parts)
+
+    def move(offset):
+        for start, new_start in reversed(line_offsets):
+            if start <= offset:
+                return new_start + offset - start
+        return 0
+
+    entities = []
+    for entity in doc["gold_entities"]:
+        start, end = move(entity["start"]), move(entity["end"] - 1) + 1
+        # Lines never break inside an entity, so the entity text is the same
+        entities.append({**entity, "start": start, "end": end, "text": text[start:end]})
+    return {**doc, "text": text, "gold_entities": entities}
+
+
+def line_positions(pages):
+    """(x, baseline y) in mm of every line, per page."""
+    positions = []
+    for page in pages:
+        y = MARGIN
+        page_positions = []
+        for _, _, gap in page:
+            y += gap + LINE_HEIGHT
+            page_positions.append((MARGIN, y))
+        positions.append(page_positions)
+    return positions
+
+
+def text_pdf(text, pages):
+    pdf = FPDF(unit="mm", format="A4")
+    pdf.set_auto_page_break(False)
+    pdf.set_font("Helvetica", size=FONT_SIZE)
+    for page, positions in zip(pages, line_positions(pages)):
+        pdf.add_page()
+        for (start, end, _), (x, y) in zip(page, positions):
+            pdf.text(x, y, text[start:end])
+    return pdf
+
+
+def find_font():
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_font(path, size):
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+def missing_glyphs(font, chars="åäöÅÄÖé"):
+    """The chars the font draws as the placeholder box."""
+    def glyph(char):
+        mask = font.getmask(char)
+        return mask.size, bytes(mask)
+
+    missing = glyph("\uffff")
+    return [char for char in chars if glyph(char) == missing]
+
+
+def page_images(text, pages, dpi, font_path, measure):
+    """The pages drawn at dpi, greyscale, like a clean scan."""
+    scale = dpi / MM_PER_INCH
+    size = FONT_SIZE / 72 * dpi
+    # Scaled so the lines are as wide as in Helvetica (measure) and fit the page like in the text PDF
+    sample = "Hej Åsa Öberg, ring 070-123 45 67 om ärendet."
+    size *= measure(sample) * scale / load_font(font_path, round(size)).getlength(sample)
+    font = load_font(font_path, round(size))
+    images = []
+    for page, positions in zip(pages, line_positions(pages)):
+        image = Image.new("L", (round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)), 255)
+        draw = ImageDraw.Draw(image)
+        for (start, end, _), (x, y) in zip(page, positions):
+            draw.text((x * scale, y * scale), text[start:end], fill=0, font=font, anchor="ls")
+        images.append(image)
+    return images
+
+
+def add_noise(image, rng, amount):
+    """Grey noise, dark specks and a slight blur. Uses the seeded rng so the noise is the same every run."""
+    noise = Image.frombytes("L", image.size, rng.randbytes(image.width * image.height))
+    grey = noise.point(lambda v: 255 - v * amount // 255)
+    specks = noise.point(lambda v: 0 if v < 2 else 255)
+    image = ImageChops.multiply(image, grey)
+    image = ImageChops.darker(image, specks)
+    return image.filter(ImageFilter.GaussianBlur(0.7))
+
+
+def degrade(images, variant, rng):
+    """Applies the degradations of the variant. Returns the images and the parameters for the manifest."""
+    params = {}
+    if variant in ("noisy", "degraded"):
+        params["noise"] = rng.randint(40, 90)
+        images = [add_noise(image, rng, params["noise"]) for image in images]
+    if variant in ("skewed", "degraded"):
+        params["skew"] = round(rng.choice([-1, 1]) * rng.uniform(0.5, 3.0), 2)
+        images = [image.rotate(params["skew"], resample=Image.BICUBIC, fillcolor=255) for image in images]
+    params["jpeg_quality"] = rng.randint(15, 35) if variant in ("jpeg", "degraded") else 75
+    return images, params
+
+
+def image_pdf(images, folder, name, quality):
+    """An image-only PDF with one JPEG per page. FPDF 1.7 embeds images from files."""
+    pdf = FPDF(unit="mm", format="A4")
+    pdf.set_auto_page_break(False)
+    paths = []
+    try:
+        for n, image in enumerate(images):
+            path = os.path.join(folder, f".{name}-{n}.jpg")
+            image.save(path, "JPEG", quality=quality)
+            paths.append(path)
+            pdf.add_page()
+            pdf.image(path, 0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+        # The images are read when the PDF is written
+        pdf_bytes = pdf.output(dest="S")
+    finally:
+        for path in paths:
+            os.remove(path)
+    return pdf_bytes.encode("latin-1") if isinstance(pdf_bytes, str) else pdf_bytes
+
+
+def render_document(task):
+    """Writes all variants of document number index. Returns the gold document and the manifest rows."""
+    index, seed, folder, variants, dpi, font_path, min_sentences, max_sentences = task
+    doc = generate_document(index, seed, min_sentences, max_sentences)
+    measure = FPDF(unit="mm")
+    measure.set_font("Helvetica", size=FONT_SIZE)
+    pages = layout(doc["text"], doc["gold_entities"], measure.get_string_width)
+    gold = page_document(doc, pages)
+
+    rows = []
+    scans = None
+    for variant in variants:
+        name = f"{doc['id']}-{variant}"
+        path = os.path.join(folder, "pdf", f"{name}.pdf")
+        row = {"id": doc["id"], "variant": variant, "pdf": os.path.relpath(path, folder), "pages": len(pages)}
+        if variant == "text":
+            text_pdf(doc["text"], pages).output(path, "F")
+        else:
+            if scans is None:
+                scans = page_images(doc["text"], pages, dpi, font_path, measure.get_string_width)
+            rng = random.Random(f"{seed}:{index}:{variant}")
+            images, params = degrade(scans, variant, rng)
+            with open(path, "wb") as f:
+                f.write(image_pdf(images, os.path.dirname(path), name, params["jpeg_quality"]))
+            row.update(dpi=dpi, **params)
+        rows.append(row)
+    return gold, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic PDFs with gold entities")
+    parser.add_argument("folder", help="Output folder: gold.json, manifest.jsonl and pdf/")
+    parser.add_argument("--count", type=int, default=20, help="Number of documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=int, default=0, help="Number of the first document")
+    parser.add_argument("--variants", default=",".join(VARIANTS), help=f"Comma separated, of {', '.join(VARIANTS)}")
+    parser.add_argument("--dpi", type=int, default=200, help="Resolution of the scans")
+    parser.add_argument("--font", default=find_font(), help="TrueType font for the scans")
+    parser.add_argument("--min-sentences", type=int, default=30, help="About 65 sentences fill a page")
+    parser.add_argument("--max-sentences", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        parser.error(f"Unknown variants: {', '.join(unknown)}")
+    if any(v != "text" for v in variants):
+        try:
+            missing = missing_glyphs(load_font(args.font, 40))
+        except (OSError, TypeError) as e:
+            parser.error(f"No TrueType font for the scans ({e}), use --font path/to/font.ttf")
+        if missing:
+            print(f"WARNING: The font for the scans has no {' '.join(missing)}, OCR accuracy will suffer. Use --font path/to/font.ttf")
+
+    os.makedirs(os.path.join(args.folder, "pdf"), exist_ok=True)
+    tasks = [(i, args.seed, args.folder, variants, args.dpi, args.font, args.min_sentences, args.max_sentences)
+             for i in range(args.start, args.start + args.count)]
+
+    started = time.perf_counter()
+    pdfs = pages = 0
+    with DocumentWriter(os.path.join(args.folder, "gold.json")) as gold_writer, \
+            open(os.path.join(args.folder, "manifest.jsonl"), "w", encoding="utf-8") as manifest:
+        with multiprocessing.Pool(args.workers) as pool:
+            for gold, rows in pool.imap(render_document, tasks):
+                gold_writer.write(gold)
+                for row in rows:
+                    manifest.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    pages += row["pages"]
+                pdfs += len(rows)
+                print(f"{gold['id']}: {rows[0]['pages']} pages, {len(gold['gold_entities'])} entities", file=sys.stderr)
+
+    print(f"Saved {pdfs} PDFs ({pages} pages) of {args.count} documents to {args.folder} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,62 @@
 import os
+import sys
 import json
-from openai import OpenAI
 from flask import Flask, render_template, request, Response, stream_with_context, send_file
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import io
-import pdfplumber
-import re
-from pdf2image import convert_from_path
-import pytesseract
-from PIL import Image, ImageEnhance
 from fpdf import FPDF
 
+# Shared model-call helpers live in ../script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "script"))
+from llm_request import build_messages, chat_openai, stream_openai, empty_call_stats, prefix_fingerprint, CacheReport, format_call_stats
+from stream_parser import iter_lines, parse_line, IncrementalIndexFinder
+from metrics import Metrics
+from scheduler import CallScheduler, estimate_tokens
+from clients import openai_client
+from profiling import profiler_from_request, NULL_PROFILER
+from masking import mask_text, MODES as MASKING_MODES
+from redaction import redact_pdf
+from extraction import extract_text_with_pdfplumber, iter_pages_with_ocr, join_pages_with_sources, PageChunker, MIN_TEXT_LENGTH
+from offset_index import OffsetIndex
+from normalize import DocumentMap
+from pipeline import Pipeline
+from chunk_cache import ChunkCache, CHUNK_CACHE
+from storage import Janitor, UploadTooLargeError, new_job_id, is_job_id, job_folder, save_upload, MAX_UPLOAD_BYTES
+
 # --- CONFIGURATION ---
-client = OpenAI()
+# Pooled keep-alive client shared by all requests, retries are handled by the scheduler below
+client = openai_client()
 
 MODEL_NAME = "gpt-4o" 
+# Keep these a bit under the limits of the API key's usage tier
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
 UPLOAD_FOLDER = 'uploads'
 TEMP_FOLDER = 'temp'
+CACHE_FOLDER = 'cache'
 ALLOWED_EXTENSIONS = {'pdf'}
 LABEL_IDS = {"1", "2", "3", "4", "5"}
+LABEL_MAP = {'1': 'NAME', '2': 'PHONE', '3': 'ADDRESS', '4': 'NATIONAL_ID', '5': 'EMAIL'}
+# Stream the model answer and send each entity to the browser as soon as its line is parsed
+STREAM_ENTITIES = True
 
 # Create folders if they do not exist
-for folder in [UPLOAD_FOLDER, TEMP_FOLDER]:
+for folder in [UPLOAD_FOLDER, TEMP_FOLDER, CACHE_FOLDER]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+# Collects latency, tokens and cost for all runs since the app was started, served on /metrics
+metrics = Metrics()
+
+# Shared by all requests so concurrent uploads stay under the rate limits together
+scheduler = CallScheduler(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['TEMP_FOLDER'] = TEMP_FOLDER
+# Werkzeug answers larger bodies with a 413 while reading them, announced or chunked. The file itself is checked in storage.save_upload
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
 
 # --- LLM SYSTEM PROMPT ---
 SYSTEM_PROMPT = """
@@ -59,108 +88,55 @@ Rules:
 - If no entities are found, output an empty string.
 """
 
-# --- PDF EXTRACTION FUNCTIONS ---
-
-def clean_whitespace(text: str) -> str:
-    """Removes duplicated repeated whitespaces and trims excessive newlines."""
-    if not text:
-        return ""
-    # Ta bort multipla mellanslag
-    text = re.sub(r" +", " ", text)
-    # Begränsa multipla radbrytningar (mer än 2) till max 2 för att undvika stora tomrum
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return text.strip()
-
-def preprocess_image(image: Image.Image) -> Image.Image:
-    """Preprocesses images before OCR for better accuracy."""
-    image = image.convert("L")
-    image = image.point(lambda x: 0 if x < 140 else 255)
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(2.5)
-    return image
-
-def extract_text_with_pdfplumber(pdf_path: str) -> dict:
-    """Extracts text from a text-based PDF."""
-    pages_text = {}
-    with pdfplumber.open(pdf_path) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            raw_text = page.extract_text(layout=True)
-            if raw_text:
-                # Vi strippar varje sida direkt vid extraktion
-                clean_text = clean_whitespace(raw_text)
-                pages_text[f"page_{i}"] = clean_text
-            else:
-                pages_text[f"page_{i}"] = ""
-    return pages_text
-
-def extract_text_with_ocr(pdf_path: str) -> dict:
-    """Extracts text from image-based PDFs using OCR."""
-    pages_text = {}
-    images = convert_from_path(pdf_path, dpi=300)
-    for i, image in enumerate(images, start=1):
-        processed_image = preprocess_image(image)
-  
-        text = pytesseract.image_to_string(processed_image, lang="swe", config=r"--oem 3 --psm 4").strip()
-        pages_text[f"page_{i}"] = text
-    return pages_text
-
-def extract_text_from_pdf_smart(pdf_path: str) -> (dict, str):
-    """Smart extractor: Falls back to OCR if text is sparse."""
-    result = extract_text_with_pdfplumber(pdf_path)
-    all_text = "".join(result.values()).strip()
-    method = "pdfplumber (text-based)"
-    if len(all_text) < 300:
-        result = extract_text_with_ocr(pdf_path)
-        method = "Tesseract OCR (image-based)"
-    return result, method
-
-def split_text_into_chunks_with_offsets(text: str, chunk_size: int = 500) -> list:
-    """
-    Splits text into chunks using direct slicing to preserve exact character indices.
-    Returns a list of dictionaries with 'text' and 'start_offset'.
-    """
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        if end < len(text):
-            # Find the last whitespace to avoid cutting a word
-            last_space = text.rfind(' ', start, end)
-            last_newline = text.rfind('\n', start, end)
-            split_at = max(last_space, last_newline)
-            if split_at > start:
-                end = split_at
-        
-        chunks.append({
-            "text": text[start:end],
-            "offset": start
-        })
-        start = end
-    return chunks
+# Fixed instruction placed before the chunk text. Together with SYSTEM_PROMPT it forms the
+# static prefix that the provider can cache, so it must not contain anything that varies.
+USER_INSTRUCTION = "Extract entities:"
 
 # --- PREDICTION FUNCTIONS ---
 
 def prompt_model(text):
-    """Prompts the LLM to extract PII."""
+    """Prompts the LLM to extract PII. Returns (entities, error, call_stats)."""
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"Extract entities: \n\n{text}"}
-            ],
-            temperature=0.1,
+        raw_response, stats = scheduler.call(
+            lambda: chat_openai(
+                client,
+                MODEL_NAME,
+                build_messages(SYSTEM_PROMPT, USER_INSTRUCTION, text),
+                temperature=0.1,
+            ),
+            estimated_tokens=estimate_tokens(text),
+            used_tokens=lambda result: result[1]["prompt_tokens"] + result[1]["completion_tokens"]
         )
-        raw_response = response.choices[0].message.content
         lines = raw_response.splitlines()
         entities = []
         for line in lines:
             line = line.strip()
             if len(line) >= 2 and line[0] in LABEL_IDS:
                 entities.append((line[0], line[1:]))
-        return entities, None
+        return entities, None, stats
     except Exception as e:
-        return None, str(e)
+        return None, str(e), None
+
+def stream_model(text, stats):
+    """
+    Streams the LLM answer and yields (label_id, entity_text) as soon as each line is complete.
+    stats (see empty_call_stats) is filled in when the stream has ended.
+    """
+    deltas = scheduler.stream(
+        lambda: stream_openai(
+            client,
+            MODEL_NAME,
+            build_messages(SYSTEM_PROMPT, USER_INSTRUCTION, text),
+            0.1,
+            stats
+        ),
+        estimated_tokens=estimate_tokens(text),
+        used_tokens=lambda: stats["prompt_tokens"] + stats["completion_tokens"]
+    )
+    for line in iter_lines(deltas):
+        entity = parse_line(line, LABEL_IDS)
+        if entity:
+            yield entity
 
 def index_finder(text, entity_texts):
     """Finds exact start/end indices in the raw chunk text."""
@@ -181,6 +157,319 @@ def index_finder(text, entity_texts):
             search_start = end_idx
     return found_entities
 
+def locate_entities(text, predictions):
+    """
+    Places (label_id, entity_text) predictions in the chunk text with index_finder, every prediction
+    at the next free occurrence of its text. Returns {"label_id", "text", "start", "end"} dicts.
+    """
+    local_indices = index_finder(text, [p[1] for p in predictions])
+    # Match predictions to indices
+    idx_map = {}
+    for item in local_indices:
+        idx_map.setdefault(item['text'], []).append(item)
+    entities = []
+    for label_id, ent_text in predictions:
+        if ent_text in idx_map and idx_map[ent_text]:
+            loc = idx_map[ent_text].pop(0)
+            entities.append({"label_id": label_id, "text": ent_text, "start": loc['start'], "end": loc['end']})
+    return entities
+
+# --- DOCUMENT PIPELINE ---
+# Shared by /run here and the async /run in asgi.py
+
+def start_job(file):
+    """
+    Saves an upload in a new job folder. Returns (job_id, filename, pdf_path, work_folder).
+    Raises UploadTooLargeError (and removes the job) if the file is too large.
+    """
+    filename = secure_filename(file.filename) or "document.pdf"
+
+    # Every run gets its own folders, so uploads with the same name do not overwrite each other
+    job_id = new_job_id()
+    pdf_path = os.path.join(job_folder(app.config['UPLOAD_FOLDER'], job_id), filename)
+    work_folder = job_folder(app.config['TEMP_FOLDER'], job_id)
+    try:
+        save_upload(file, pdf_path)
+    except UploadTooLargeError:
+        janitor.remove(job_id)
+        raise
+    return job_id, filename, pdf_path, work_folder
+
+def iter_document_pages(pdf_path, doc_id=None, profiler=NULL_PROFILER):
+    """
+    Extracts with pdfplumber, or with OCR if the text is sparse. Yields ("method", method) and then
+    ("page", page_key, text, sources, raw_page) for every page, OCR pages as soon as they are done.
+    Messages from the OCR (pages read again at a higher DPI) come as ("log", message) before their page.
+    """
+    with metrics.stage("pdfplumber", doc_id), profiler.span("pdfplumber"):
+        result, sources, raw_pages = extract_text_with_pdfplumber(pdf_path, profiler)
+    if len("".join(result.values()).strip()) >= MIN_TEXT_LENGTH:
+        yield ("method", "pdfplumber (text-based)")
+        for key, text in result.items():
+            yield ("page", key, text, sources[key], raw_pages[key])
+        return
+
+    yield ("method", "Tesseract OCR (image-based)")
+    # Includes the time OCR waits for the model when the queue to the next stage is full
+    messages = []
+    with metrics.stage("ocr", doc_id), profiler.span("ocr"):
+        for key, text, page_sources, raw_page in iter_pages_with_ocr(pdf_path, profiler, log=messages.append):
+            for message in messages:
+                yield ("log", message)
+            messages.clear()
+            yield ("page", key, text, page_sources, raw_page)
+
+def document_events(pdf_path, job_id, profiler=NULL_PROFILER):
+    """
+    Extraction -> chunking as a pipeline (see pipeline.py), so the first chunks can go to the model
+    while later pages are still extracted. Yields the events of iter_document_pages, with the
+    offset of the page in full_text added to "page" events (None for an empty page), and a
+    ("chunk", chunk) event for every chunk right after the page it is on.
+    """
+    chunker = PageChunker()
+
+    def chunk_page(event):
+        if event[0] != "page":
+            return [event]
+        with metrics.stage("chunking", job_id), profiler.span("chunking"):
+            start, chunks = chunker.add(event[1], event[2])
+        return [event + (start,)] + [("chunk", chunk) for chunk in chunks]
+
+    # Each pipeline thread is profiled on its own, a profiler only sees the thread it runs in
+    return Pipeline(iter_document_pages(pdf_path, job_id, profiler), chunk_page, context=profiler.thread)
+
+def finish_document(page_results, page_sources, raw_pages, filename, work_folder, profiler=NULL_PROFILER):
+    """
+    Joins the extracted pages and saves the offset index, once all pages are through the pipeline.
+    Returns (full_text, document_map).
+    """
+    base_name = os.path.splitext(filename)[0]
+    with profiler.span("join_pages"):
+        full_text, sources = join_pages_with_sources(page_results, page_sources)
+        # Maps full_text offsets back to the raw page text, for the raw span file in save_results
+        document_map = DocumentMap.build(page_results, {key: offset_map for key, (_, offset_map) in raw_pages.items()})
+
+    # Where every character of full_text is on the page, used by /export to redact the original PDF
+    with profiler.span("offset_index"):
+        offset_index = OffsetIndex.from_sources(sources, full_text)
+        offset_index.save(os.path.join(work_folder, f"{base_name}_offsets.bin"))
+    return full_text, document_map
+
+def page_text_append(text, start):
+    """The TEXT_APPEND: payload for a page: its text with the page separator, appended to the text from TEXT_JSON:."""
+    return ("\n" if start else "") + text.strip()
+
+def entity_to_global(entity, offset):
+    """An entity from the IncrementalIndexFinder of a chunk, with offsets in full_text."""
+    return {
+        "label": LABEL_MAP.get(entity['label_id']),
+        "start": entity['start'] + offset,
+        "end": entity['end'] + offset,
+        "text": entity['text']
+    }
+
+def entity_line(kind, entity, offset):
+    """An ENTITY: or ENTITY_REMOVED: line for an entity of a chunk."""
+    return f"{kind}:{json.dumps(entity_to_global(entity, offset))}\n"
+
+def save_results(final_data, raw_pages, document_map, work_folder, job_id=None, profiler=NULL_PROFILER):
+    """Saves <name>_predictions.json and <name>_raw_spans.json in the job folder. Returns the predictions path."""
+    filename = final_data["id"]
+    base_name = os.path.splitext(filename)[0]
+
+    # Save JSON file with _predictions suffix
+    json_path = os.path.join(work_folder, f"{base_name}_predictions.json")
+    with metrics.stage("save_json", job_id), profiler.span("json_serialization"):
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(final_data, f, ensure_ascii=False, indent=2)
+
+    # Audit trail: every entity projected back to the raw (un-normalized) page text it came from
+    raw_spans_path = os.path.join(work_folder, f"{base_name}_raw_spans.json")
+    with profiler.span("raw_spans"):
+        raw_spans = []
+        for entity in final_data["predicted_entities"]:
+            page_key, raw_start, raw_end = document_map.span_to_raw(entity['start'], entity['end'])
+            raw_spans.append({**entity, "page": page_key, "raw_start": raw_start, "raw_end": raw_end,
+                              "raw_text": raw_pages[page_key][0][raw_start:raw_end]})
+        with open(raw_spans_path, "w", encoding="utf-8") as f:
+            json.dump({"id": filename, "entities": raw_spans}, f, ensure_ascii=False, indent=2)
+    return json_path
+
+# Entity results of earlier chunks, so a re-uploaded document only sends the changed chunks to the model
+chunk_cache = ChunkCache(CACHE_FOLDER, f"{MODEL_NAME}:{prefix_fingerprint(SYSTEM_PROMPT, USER_INSTRUCTION)}") if CHUNK_CACHE else None
+
+# Removes old job folders in uploads/ and temp/ in the background, and cache entries (entity texts are PII) as old
+janitor = Janitor([UPLOAD_FOLDER, TEMP_FOLDER], caches=[chunk_cache] if chunk_cache else []).start()
+
+def cached_chunk(chunk):
+    """The cached entities of a chunk (relative to the chunk), or None if it has to go to the model."""
+    if chunk_cache is None:
+        return None
+    return chunk_cache.get(chunk['text'])
+
+def cache_chunk(chunk, entities):
+    if chunk_cache is not None:
+        chunk_cache.put(chunk['text'], entities)
+
+def chunk_cache_summary(reused, recomputed):
+    metrics.inc("chunks_reused_total", reused)
+    metrics.inc("chunks_recomputed_total", recomputed)
+    return f"Chunk cache: {reused} chunks reused, {recomputed} sent to the model"
+
+class ChunkStream:
+    """One chunk while its model answer streams in. add() returns the ENTITY:/ENTITY_REMOVED: lines for each entity."""
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.stats = empty_call_stats()
+        self.predictions = []
+        self.finder = IncrementalIndexFinder(chunk['text'])
+
+    def add(self, label_id, ent_text):
+        self.predictions.append((label_id, ent_text))
+        added, removed = self.finder.add(label_id, ent_text)
+        return self.lines(added, removed)
+
+    def finish(self, entities):
+        """Replaces the streamed placements with the final entities. Returns the lines that correct the browser."""
+        added, removed = self.finder.replace(entities)
+        return self.lines(added, removed)
+
+    def lines(self, added, removed):
+        # Removed first, the browser removes by span and an added entity may have the same span
+        return ([entity_line("ENTITY_REMOVED", entity, self.chunk['offset']) for entity in removed]
+                + [entity_line("ENTITY", entity, self.chunk['offset']) for entity in added])
+
+class DocumentRun:
+    """
+    The state of one /run and the lines it streams to the browser, shared by the Flask /run below and
+    the async /run in asgi.py. The transports only differ in how they wait for the pipeline and the
+    model: they pass the events and answers in here and send the lines that come back.
+    """
+
+    def __init__(self, job_id, filename, work_folder, profiler=NULL_PROFILER):
+        self.job_id = job_id
+        self.filename = filename
+        self.work_folder = work_folder
+        self.profiler = profiler
+        self.page_results, self.page_sources, self.raw_pages = {}, {}, {}
+        self.all_predicted = []
+        self.cache_report = CacheReport()
+        self.reused = self.recomputed = 0
+        self.data_json = None
+
+    def start(self):
+        lines = [f"LOG: Processing {self.filename}...\n"]
+        self.profiler.start()
+        metrics.inc("documents_total")
+        lines.append(f"LOG: Prompt prefix {prefix_fingerprint(SYSTEM_PROMPT, USER_INSTRUCTION)}\n")
+        if STREAM_ENTITIES:
+            # Lets the browser show the text right away and highlight entities as they stream in.
+            # The text of every page follows in a TEXT_APPEND: line as soon as it is extracted.
+            lines.append(f"TEXT_JSON:{json.dumps({'id': self.filename, 'job': self.job_id, 'text': ''})}\n")
+        return lines
+
+    def handle(self, event):
+        """
+        Takes one event of document_events. Returns (lines, chunk) where chunk is the chunk that has to
+        go to the model next (then call chunk_done with the answer), or None.
+        """
+        if event[0] == "method":
+            return [f"LOG: Extraction method: {event[1]}\n"], None
+        if event[0] == "log":
+            return [f"LOG: {event[1]}\n"], None
+        if event[0] == "page":
+            _, key, text, sources, raw_page, start = event
+            self.page_results[key], self.page_sources[key], self.raw_pages[key] = text, sources, raw_page
+            if STREAM_ENTITIES and start is not None:
+                return [f"TEXT_APPEND:{json.dumps(page_text_append(text, start))}\n"], None
+            return [], None
+
+        chunk = event[1]
+        i = chunk['index']
+        lines = [f"LOG: Analyzing chunk {i+1} ({chunk['page']})...\n"]
+        cached = cached_chunk(chunk)
+        if cached is None:
+            self.recomputed += 1
+            return lines, chunk
+
+        # Same text as in an earlier run, only the offsets move
+        self.reused += 1
+        if STREAM_ENTITIES:
+            lines.extend(entity_line("ENTITY", entity, chunk['offset']) for entity in cached)
+        lines.append(f"LOG: Chunk {i+1}: unchanged, reused {len(cached)} entities\n")
+        self.all_predicted.extend(entity_to_global(entity, chunk['offset']) for entity in cached)
+        return lines, None
+
+    def chunk_done(self, chunk, predictions, error, stats, stream=None):
+        """
+        Takes the model answer for a chunk: predictions are (label_id, entity_text) in answer order,
+        stream is the ChunkStream if they were streamed to the browser. Returns the lines to send.
+        """
+        i = chunk['index']
+        lines = []
+        if stats and stats["latency"]:
+            self.cache_report.add(stats)
+            metrics.record_call(MODEL_NAME, stats, self.job_id)
+            lines.append(f"LOG: Chunk {i+1}: {format_call_stats(stats)}\n")
+        if error:
+            metrics.record_error(MODEL_NAME, self.job_id)
+            if stream is not None:
+                lines.append(f"LOG: ERROR: Chunk {i+1} failed, its entities may be incomplete: {error}\n")
+            else:
+                lines.append(f"LOG: ERROR: Chunk {i+1} failed after retries, its entities are missing: {error}\n")
+
+        entities = []
+        if predictions:
+            with metrics.stage("index_finder", self.job_id), self.profiler.span("index_finder"):
+                entities = locate_entities(chunk['text'], predictions)
+        if stream is not None:
+            # The streamed placements can differ from index_finder, correct what the browser has
+            lines.extend(stream.finish(entities))
+        if not error:
+            cache_chunk(chunk, entities)
+        self.all_predicted.extend(entity_to_global(entity, chunk['offset']) for entity in entities)
+        return lines
+
+    def finish(self):
+        """Joins the pages and saves the results once the pipeline is done. Returns the lines to send."""
+        # The async /run calls this in a worker thread
+        with self.profiler.thread():
+            return self._finish()
+
+    def _finish(self):
+        full_text, document_map = finish_document(self.page_results, self.page_sources, self.raw_pages,
+                                                  self.filename, self.work_folder, self.profiler)
+        lines = [f"LOG: {self.cache_report.summary()}\n",
+                 f"LOG: {chunk_cache_summary(self.reused, self.recomputed)}\n"]
+
+        final_data = {"id": self.filename, "text": full_text, "predicted_entities": self.all_predicted}
+        json_path = save_results(final_data, self.raw_pages, document_map, self.work_folder, self.job_id, self.profiler)
+        lines.append(f"LOG: Saved predictions to {json_path}\n")
+        lines.append(f"LOG: Totals: {metrics.document_summary(self.job_id)}\n")
+
+        with self.profiler.span("json_serialization"):
+            # The browser sends the job id back to /export to find the PDF and offset index
+            self.data_json = json.dumps({**final_data, "job": self.job_id})
+        return lines
+
+    def stop_profiler(self):
+        """Stops the profiler (in the thread that started it) and returns its breakdown, if profiling is on."""
+        if not self.profiler.enabled:
+            return []
+        self.profiler.stop()
+        return [f"LOG: {line}\n" for line in self.profiler.log_lines()]
+
+    def save_profile(self):
+        if not self.profiler.enabled:
+            return []
+        base_name = os.path.splitext(self.filename)[0]
+        return [f"LOG: Saved profile to {path}\n" for path in self.profiler.save(self.work_folder, base_name)]
+
+    def data_line(self):
+        """The last line, without a newline."""
+        return f"DATA_JSON:{self.data_json}"
+
 # --- FLASK ROUTES ---
 
 @app.route('/')
@@ -192,54 +481,59 @@ def run_script():
     file = request.files.get('file')
     if not file: return "No file", 400
     
-    filename = secure_filename(file.filename)
-    base_name = os.path.splitext(filename)[0]
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(pdf_path)
+    try:
+        job_id, filename, pdf_path, work_folder = start_job(file)
+    except UploadTooLargeError as e:
+        return str(e), 413
+
+    # Opt-in profiling: header "X-Profile: spans|cprofile|pyinstrument" or ?profile=...
+    profiler = profiler_from_request(request)
 
     def generate():
-        yield f"LOG: Processing {filename}...\n"
-        page_results, method = extract_text_from_pdf_smart(pdf_path)
-        
-        full_text = "\n".join([p.strip() for p in page_results.values() if p.strip()]).strip()
-        
-        yield f"LOG: Extraction method: {method}\n"
-        
-        chunks = split_text_into_chunks_with_offsets(full_text)
-        all_predicted = []
-        label_map = {'1': 'NAME', '2': 'PHONE', '3': 'ADDRESS', '4': 'NATIONAL_ID', '5': 'EMAIL'}
-
-        for i, chunk in enumerate(chunks):
-            yield f"LOG: Analyzing chunk {i+1}/{len(chunks)}...\n"
-            predictions, error = prompt_model(chunk['text'])
-            if predictions:
-                local_indices = index_finder(chunk['text'], [p[1] for p in predictions])
-                # Match predictions to indices and apply global offset
-                idx_map = {}
-                for item in local_indices:
-                    idx_map.setdefault(item['text'], []).append(item)
-                
-                for label_id, ent_text in predictions:
-                    if ent_text in idx_map and idx_map[ent_text]:
-                        loc = idx_map[ent_text].pop(0)
-                        all_predicted.append({
-                            "label": label_map.get(label_id),
-                            "start": loc['start'] + chunk['offset'],
-                            "end": loc['end'] + chunk['offset'],
-                            "text": ent_text
-                        })
-
-        final_data = {"id": filename, "text": full_text, "predicted_entities": all_predicted}
-        
-        # Save JSON file with _predictions suffix
-        json_path = os.path.join(app.config['TEMP_FOLDER'], f"{base_name}_predictions.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(final_data, f, ensure_ascii=False, indent=2)
-        
-        yield f"LOG: Saved predictions to {json_path}\n"
-        yield f"DATA_JSON:{json.dumps(final_data)}"
+        run = DocumentRun(job_id, filename, work_folder, profiler)
+        yield from run.start()
+
+        # Pages are extracted and chunked in the background while the chunks are sent to the model here
+        for event in document_events(pdf_path, job_id, profiler):
+            lines, chunk = run.handle(event)
+            yield from lines
+            if chunk is None:
+                continue
 
-    return Response(stream_with_context(generate()), mimetype='text/plain')
+            if STREAM_ENTITIES:
+                stream = ChunkStream(chunk)
+                error = None
+                try:
+                    # Note: this span includes the time spent sending ENTITY lines to the browser
+                    with profiler.span("llm_stream"):
+                        for label_id, ent_text in stream_model(chunk['text'], stream.stats):
+                            yield from stream.add(label_id, ent_text)
+                except Exception as e:
+                    error = str(e)
+                yield from run.chunk_done(chunk, stream.predictions, error, stream.stats, stream)
+            else:
+                with profiler.span("llm_wait"):
+                    predictions, error, stats = prompt_model(chunk['text'])
+                yield from run.chunk_done(chunk, predictions, error, stats)
+
+        yield from run.finish()
+        yield from run.stop_profiler()
+        yield from run.save_profile()
+        yield run.data_line()
+
+    def tracked():
+        # The janitor must not remove the job folders while the run is still using them
+        janitor.begin(job_id)
+        try:
+            yield from generate()
+        finally:
+            janitor.end(job_id)
+            # Frees the profiler for the next run if this one was cut short (a no-op otherwise)
+            profiler.stop()
+            # The per-document totals are only needed for the Totals: line
+            metrics.forget_document(job_id)
+
+    return Response(stream_with_context(tracked()), mimetype='text/plain')
 
 @app.route('/export', methods=['POST'])
 def export_pdf():
@@ -247,13 +541,36 @@ def export_pdf():
     text = data.get('text', '')
     entities = data.get('entities', [])
     filename = data.get('filename', 'document.pdf')
+    mode = data.get('mode', 'label')
     base_name = os.path.splitext(filename)[0]
 
-    # Mask text in reverse to preserve indices
-    entities.sort(key=lambda x: x['start'], reverse=True)
-    masked_text = text
-    for ent in entities:
-        masked_text = masked_text[:ent['start']] + f"[{ent['label']}]" + masked_text[ent['end']:]
+    if mode not in MASKING_MODES:
+        return f"Unknown masking mode, use one of: {', '.join(MASKING_MODES)}", 400
+
+    # Redact the original PDF if its job folder is still there, so the layout is kept
+    job_id = data.get('job')
+    pdf_path = None
+    if is_job_id(job_id):
+        pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], job_id, secure_filename(filename))
+    if data.get('layout', True) and pdf_path and os.path.exists(pdf_path):
+        janitor.touch(job_id)
+        work_folder = job_folder(app.config['TEMP_FOLDER'], job_id)
+        out_path = os.path.join(work_folder, f"{base_name}_masked.pdf")
+        index_path = os.path.join(work_folder, f"{base_name}_offsets.bin")
+        try:
+            index = OffsetIndex.load(index_path) if os.path.exists(index_path) else None
+        except ValueError:
+            index = None  # Written by an older version, redact_pdf extracts the document again
+        try:
+            with metrics.stage("redact_pdf"):
+                redact_pdf(pdf_path, text, entities, out_path, mode, index)
+            return send_file(out_path, as_attachment=True, download_name=f"{base_name}_masked.pdf")
+        except Exception as e:
+            # Text mismatch, poppler missing, a broken render worker... fall back to re-typesetting the masked text below
+            print(f"WARNING: Layout-preserving redaction not possible for {filename}, exporting the masked text instead: {type(e).__name__}: {e}")
+
+    # Single pass, overlapping spans are merged
+    masked_text = mask_text(text, entities, mode)
 
     # FIX UNICODE: Replace characters outside Latin-1 range to prevent FPDF crash
     clean_text = masked_text.encode("latin-1", "replace").decode("latin-1")
@@ -269,5 +586,14 @@ def export_pdf():
     
     return send_file(output, as_attachment=True, download_name=f"{base_name}_masked.pdf")
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return f"Upload is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB", 413
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format."""
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
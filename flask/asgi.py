@@ -0,0 +1,248 @@
+"""
+ASGI entry point: the Flask app plus an async version of /run.
+
+Under WSGI every /run holds a worker thread for the whole stream, and most of that time it is
+only waiting for the model. Here /run is a coroutine: the model answer is streamed with the
+async OpenAI client and the scheduler waits with asyncio.sleep, so one worker process can keep
+hundreds of streams open. The blocking parts (upload parsing, pdfplumber/OCR, saving) run in
+the default thread pool with asyncio.to_thread, except the extraction pipeline, which is read by
+one thread per request (thread_events). All other routes are the normal Flask views, run in
+threads by asgiref's WsgiToAsgi.
+
+    uvicorn asgi:application --workers 4
+    gunicorn -c gunicorn.conf.py asgi:application      (with SERVER_MODE=asgi)
+
+The lines are built by app.DocumentRun, so the stream is the same as for the Flask /run.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+
+import app as web
+from llm_request import build_messages, stream_openai_async
+from stream_parser import parse_line
+from scheduler import estimate_tokens
+from clients import async_openai_client
+from profiling import profiler_from_request
+from storage import UploadTooLargeError
+from pipeline import DONE, Failed, PIPELINE_QUEUE_SIZE, POLL_SECONDS
+
+flask_asgi = WsgiToAsgi(web.app)
+SPOOL_IN_MEMORY = 1024 * 1024
+
+
+def stream_model_async(text, stats):
+    """Async stream_model: yields (label_id, entity_text) as soon as each line of the answer is complete."""
+    client = async_openai_client()
+
+    async def entities():
+        buffer = ""
+        deltas = web.scheduler.astream(
+            lambda: stream_openai_async(
+                client,
+                web.MODEL_NAME,
+                build_messages(web.SYSTEM_PROMPT, web.USER_INSTRUCTION, text),
+                0.1,
+                stats
+            ),
+            estimated_tokens=estimate_tokens(text),
+            used_tokens=lambda: stats["prompt_tokens"] + stats["completion_tokens"]
+        )
+        # Same as stream_parser.iter_lines, for an async stream
+        async for delta in deltas:
+            buffer += delta
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                entity = parse_line(line, web.LABEL_IDS)
+                if entity:
+                    yield entity
+        entity = parse_line(buffer, web.LABEL_IDS)
+        if entity:
+            yield entity
+
+    return entities()
+
+
+async def read_request(scope, receive):
+    """Reads the request body into a spooled temp file and returns a werkzeug Request for it."""
+    body = SpooledTemporaryFile(max_size=SPOOL_IN_MEMORY)
+    size = 0
+    more = True
+    while more:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > web.app.config['MAX_CONTENT_LENGTH']:
+            body.close()
+            raise UploadTooLargeError(f"Upload is larger than {web.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        body.write(chunk)
+        more = message.get("more_body", False)
+    body.seek(0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "PATH_INFO": unquote(scope["path"]),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": "asgi",
+        "SERVER_PORT": "0",
+        "CONTENT_LENGTH": str(size),
+        "wsgi.input": body,
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key == "CONTENT_TYPE":
+            environ[key] = value.decode("latin-1")
+        elif key != "CONTENT_LENGTH":
+            environ[f"HTTP_{key}"] = value.decode("latin-1")
+    return Request(environ), body
+
+
+async def thread_events(pipeline):
+    """
+    Iterates the pipeline in one thread of its own, which hands the events to the event loop
+    through a bounded asyncio.Queue, and yields them. Closing this generator closes the pipeline.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put(item):
+        # Same as Pipeline.put: a full queue is waited on until the consumer is gone
+        future = asyncio.run_coroutine_threadsafe(events.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=POLL_SECONDS)
+                return True
+            except FutureTimeout:
+                pass
+        future.cancel()
+        return False
+
+    def forward():
+        try:
+            for event in pipeline:
+                if not put(event):
+                    return
+        except Exception as e:
+            put(Failed(e))
+            return
+        put(DONE)
+
+    threading.Thread(target=forward, daemon=True).start()
+    try:
+        while (item := await events.get()) is not DONE:
+            if isinstance(item, Failed):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        # Waits for the source to be closed, not on the event loop
+        await asyncio.to_thread(pipeline.close)
+
+
+async def send_text(send, status, text):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def run_async(scope, receive, send):
+    try:
+        request, body = await read_request(scope, receive)
+    except UploadTooLargeError as e:
+        return await send_text(send, 413, str(e))
+
+    try:
+        file = request.files.get('file')
+        if not file:
+            return await send_text(send, 400, "No file")
+        try:
+            job_id, filename, pdf_path, work_folder = await asyncio.to_thread(web.start_job, file)
+        except UploadTooLargeError as e:
+            return await send_text(send, 413, str(e))
+    finally:
+        body.close()
+
+    profiler = profiler_from_request(request)
+
+    async def generate():
+        run = web.DocumentRun(job_id, filename, work_folder, profiler)
+        for line in run.start():
+            yield line
+
+        # The pipeline threads extract and chunk, waiting for their next event must not block the loop
+        events = thread_events(web.document_events(pdf_path, job_id, profiler))
+        try:
+            async for event in events:
+                lines, chunk = run.handle(event)
+                for line in lines:
+                    yield line
+                if chunk is None:
+                    continue
+
+                if web.STREAM_ENTITIES:
+                    stream = web.ChunkStream(chunk)
+                    error = None
+                    try:
+                        with profiler.span("llm_stream"):
+                            async for label_id, ent_text in stream_model_async(chunk['text'], stream.stats):
+                                for line in stream.add(label_id, ent_text):
+                                    yield line
+                    except Exception as e:
+                        error = str(e)
+                    lines = run.chunk_done(chunk, stream.predictions, error, stream.stats, stream)
+                else:
+                    with profiler.span("llm_wait"):
+                        predictions, error, stats = await asyncio.to_thread(web.prompt_model, chunk['text'])
+                    lines = run.chunk_done(chunk, predictions, error, stats)
+                for line in lines:
+                    yield line
+        finally:
+            await events.aclose()
+
+        for line in await asyncio.to_thread(run.finish):
+            yield line
+        for line in run.stop_profiler():
+            yield line
+        for line in await asyncio.to_thread(run.save_profile):
+            yield line
+        yield run.data_line()
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+    web.janitor.begin(job_id)
+    try:
+        async for part in generate():
+            await send({"type": "http.response.body", "body": part.encode("utf-8"), "more_body": True})
+    except Exception as e:
+        # The status line is already sent, so report the error in the stream like the LOG lines
+        await send({"type": "http.response.body", "body": f"LOG: CRITICAL ERROR: {e}\n".encode("utf-8"), "more_body": True})
+    finally:
+        web.janitor.end(job_id)
+        profiler.stop()
+        web.metrics.forget_document(job_id)
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/run" and scope["method"] == "POST":
+        return await run_async(scope, receive, send)
+    return await flask_asgi(scope, receive, send)
@@ -0,0 +1,113 @@
+"""
+Entity results per chunk, keyed by a hash of the chunk text.
+
+When a reviewer uploads a corrected version of a PDF, most chunks have exactly the same text as
+before. Their entities are looked up here instead of asking the model again, and since the
+cached offsets are relative to the chunk, they only have to be shifted by the chunk's offset in
+the new document (entity_to_global). Chunks never cross a page break (extraction.PageChunker),
+so an edit only changes the chunks of its own page from the edit onwards.
+
+The key also contains the model and the prompt fingerprint, a new prompt or model never reuses
+old results. Every entry is a small JSON file in cache/<2 hex>/<hash>.json, so all server worker
+processes share the cache. Files are written to a unique temp file and renamed, so a reader never
+sees half a file. A cache entry that cannot be written is logged and skipped, it never fails a run. When more than CHUNK_CACHE_MAX_ENTRIES files have been written, the least recently
+used ones are removed (the access time of a file is its last use). The entity texts are
+personal data, so the janitor also removes entries written longer ago than the uploads are
+kept (the modification time, see expire).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+CHUNK_CACHE = os.environ.get("CHUNK_CACHE", "1") != "0"
+CHUNK_CACHE_MAX_ENTRIES = int(os.environ.get("CHUNK_CACHE_MAX_ENTRIES", "50000"))
+# Count the files only every this many writes
+PRUNE_EVERY = 500
+
+
+class ChunkCache:
+
+    def __init__(self, folder, namespace, max_entries=CHUNK_CACHE_MAX_ENTRIES, log=print):
+        self.folder = folder
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.log = log
+        self.writes = 0
+
+    def path(self, text):
+        digest = hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, digest[:2], f"{digest}.json")
+
+    def get(self, text):
+        """The cached entities (label_id, text, start, end relative to the chunk) or None."""
+        path = self.path(text)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entities = json.load(f)
+            # The access time is the last use, for prune(). The modification time stays the time of writing, for expire()
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return entities
+        except (OSError, ValueError):
+            return None
+
+    def put(self, text, entities):
+        """Stores the entities of a chunk. Returns False (and logs) if the entry could not be written."""
+        path = self.path(text)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A temp file of its own, two threads caching the same chunk must not write to the same file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump([{key: e[key] for key in ("label_id", "text", "start", "end")} for e in entities], f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            if self.log:
+                self.log(f"WARNING: Chunk cache entry not written: {e}")
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            return False
+        self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def prune(self):
+        """Removes the least recently used entries above max_entries."""
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getatime(path), path))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def expire(self, max_age):
+        """Removes the entries (and left over temp files) written more than max_age seconds ago. Returns (removed, bytes freed)."""
+        cutoff = time.time() - max_age
+        removed = freed = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+                except OSError:
+                    pass
+        return removed, freed
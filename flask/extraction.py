@@ -0,0 +1,301 @@
+"""
+Text extraction from PDFs: pdfplumber for text-based PDFs, Tesseract OCR for scanned ones,
+and splitting of the extracted text into chunks for the model.
+
+Besides the text, extraction keeps a "source" for every character: (page_index, (x0, top, x1, bottom))
+in PDF points from the top-left of the page, or None for characters that are not on the page
+(layout padding, paragraph breaks, page joins). See offset_index.py.
+
+The extractors also return the raw text of every page with an OffsetMap from the cleaned page
+text back to it (see normalize.py), so entity spans can be projected back to the raw page text.
+
+Adaptive OCR (OCR_ADAPTIVE=1) renders all pages at OCR_LOW_DPI first, which is less than half the
+pixels of OCR_DPI, and only renders and OCRs a page again at OCR_DPI when the mean word confidence
+Tesseract reports for it is below OCR_MIN_CONFIDENCE. Clean scans are read fine at 150 dpi.
+
+Tesseract runs as a subprocess per page or in a pool of warm instances, see ocr_engine.py (OCR_ENGINE).
+
+Layout analysis (get_textmap(layout=True)) is pure Python and the slowest part of extracting a text
+PDF. PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page ranges that are extracted
+in PDF_WORKERS processes, each opening the PDF itself. PDF_LAYOUT=0 turns the layout analysis off,
+which is faster but loses the column alignment the text (and the model) gets from it.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+from profiling import NULL_PROFILER
+from ocr_preprocess import preprocess, unrotate_box
+from ocr_engine import create_engine
+from normalize import normalize_whitespace, OffsetMap
+
+OCR_DPI = 300
+OCR_LANG = "swe"
+OCR_CONFIG = r"--oem 3 --psm 4"
+# Less extracted text than this and the PDF is treated as scanned
+MIN_TEXT_LENGTH = 300
+
+OCR_ADAPTIVE = os.environ.get("OCR_ADAPTIVE", "0") == "1"
+OCR_LOW_DPI = int(os.environ.get("OCR_LOW_DPI", "150"))
+# Mean word confidence (0-100) a low DPI page needs to be kept
+OCR_MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "80"))
+
+engine = create_engine(OCR_LANG, OCR_CONFIG)
+
+PDF_LAYOUT = os.environ.get("PDF_LAYOUT", "1") != "0"
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+# Ranges per worker, more than one so a worker with heavy pages does not hold up the rest
+PDF_SHARDS_PER_WORKER = 2
+
+def clean_whitespace(text: str) -> str:
+    """
+    Removes duplicated repeated whitespaces and trims excessive newlines.
+    Same text as normalize_whitespace(text)[0], which is what to use when the offsets back to text are needed.
+    """
+    if not text: return ""
+    # Ta bort multipla mellanslag
+    text = re.sub(r" +", " ", text)
+    # Begränsa multipla radbrytningar (mer än 2) till max 2
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    """Preprocesses images before OCR for better accuracy. See ocr_preprocess.py for the methods."""
+    return preprocess(image)[0]
+
+def pdfplumber_page(page, page_index: int, layout: bool = PDF_LAYOUT) -> (str, list, str, OffsetMap):
+    """
+    Text of one page (same as clean_whitespace(page.extract_text(layout=layout))), its character sources,
+    the raw layout text and the OffsetMap from the cleaned text back to the raw text.
+    """
+    # extract_text(layout=True) is get_textmap(layout=True).as_string, the textmap also has the char objects
+    textmap = page.get_textmap(layout=layout)
+    x_offset, y_offset = page.bbox[0], page.bbox[1]
+
+    raw = textmap.as_string
+    text, offset_map = normalize_whitespace(raw)
+
+    # Only the characters that survive the cleaning need a source, most of the layout padding is dropped
+    sources = []
+    for obj in offset_map.project([obj for _, obj in textmap.tuples]):
+        if obj is None:
+            sources.append(None)
+        else:
+            sources.append((page_index, (obj["x0"] - x_offset, obj["top"] - y_offset, obj["x1"] - x_offset, obj["bottom"] - y_offset)))
+    return text, sources, raw, offset_map
+
+def ocr_page(processed_image: Image.Image, page_index: int, angle: float = 0.0, dpi: int = OCR_DPI) -> (str, list, float):
+    """
+    OCR of one preprocessed page with image_to_data, so every word comes with its box.
+    The text is rebuilt from the words: words on a line are separated by a space, lines by a
+    newline and paragraphs by an empty line, like image_to_string does.
+    angle is the deskew rotation from preprocessing, the boxes are rotated back to the original page.
+    Returns the text, the sources and the mean word confidence (0-100, 0.0 for a page without words).
+    """
+    data = engine.image_to_data(processed_image)
+
+    # Pixels at dpi -> points
+    scale = 72.0 / dpi
+    width, height = processed_image.size
+    parts = []
+    sources = []
+    confidences = []
+    previous = None
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        if not word:
+            continue
+        # -1 is a block/line row without text of its own
+        confidence = float(data["conf"][i])
+        if confidence >= 0:
+            confidences.append(confidence)
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if previous is not None:
+            if line[:2] != previous[:2]:
+                separator = "\n\n"
+            elif line != previous:
+                separator = "\n"
+            else:
+                separator = " "
+            parts.append(separator)
+            sources.extend([None] * len(separator))
+        previous = line
+
+        left, top = data["left"][i], data["top"][i]
+        box = unrotate_box((left, top, left + data["width"][i], top + data["height"][i]), angle, width, height)
+        box = tuple(value * scale for value in box)
+        parts.append(word)
+        sources.extend([(page_index, box)] * len(word))
+
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return "".join(parts), sources, confidence
+
+def extract_page_range(pdf_path: str, first: int, last: int, layout: bool = PDF_LAYOUT) -> list:
+    """pdfplumber_page for the pages first..last-1 (0-based). Runs in a worker process, opens the PDF itself."""
+    with pdfplumber.open(pdf_path, pages=range(first + 1, last + 1)) as pdf:
+        return [pdfplumber_page(page, first + i, layout) for i, page in enumerate(pdf.pages)]
+
+def page_ranges(page_count: int, shards: int) -> list:
+    """Splits page_count pages into at most shards contiguous (first, last) ranges of nearly equal size."""
+    shards = max(1, min(shards, page_count))
+    size, rest = divmod(page_count, shards)
+    ranges = []
+    first = 0
+    for shard in range(shards):
+        last = first + size + (1 if shard < rest else 0)
+        ranges.append((first, last))
+        first = last
+    return ranges
+
+def extract_text_with_pdfplumber(pdf_path: str, profiler=NULL_PROFILER, layout: bool = PDF_LAYOUT,
+                                 workers: int = PDF_WORKERS) -> (dict, dict, dict):
+    """
+    Extracts text from a text-based PDF.
+    Returns the text, the character sources and (raw_text, OffsetMap) per page.
+    PDFs with PDF_PARALLEL_MIN_PAGES pages or more are extracted in workers processes.
+    """
+    pages_text = {}
+    pages_sources = {}
+    pages_raw = {}
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        if workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+            pages = None
+        else:
+            pages = []
+            for i, page in enumerate(pdf.pages):
+                # Vi strippar varje sida direkt vid extraktion
+                with profiler.span("extract_text"):
+                    pages.append(pdfplumber_page(page, i, layout))
+
+    if pages is None:
+        ranges = page_ranges(page_count, workers * PDF_SHARDS_PER_WORKER)
+        with profiler.span("extract_text_parallel"):
+            with ProcessPoolExecutor(min(workers, len(ranges))) as pool:
+                futures = [pool.submit(extract_page_range, pdf_path, first, last, layout) for first, last in ranges]
+                # The ranges are in page order, so the results are too
+                pages = [page for future in futures for page in future.result()]
+
+    for i, (text, sources, raw, offset_map) in enumerate(pages, start=1):
+        pages_text[f"page_{i}"] = text
+        pages_sources[f"page_{i}"] = sources
+        pages_raw[f"page_{i}"] = (raw, offset_map)
+    return pages_text, pages_sources, pages_raw
+
+def ocr_image(image: Image.Image, page_index: int, dpi: int, profiler=NULL_PROFILER) -> (str, list, float):
+    """Preprocessing and OCR of one rendered page, see ocr_page."""
+    with profiler.span("preprocess_image"):
+        processed_image, angle = preprocess(image)
+    with profiler.span("tesseract"):
+        return ocr_page(processed_image, page_index, angle, dpi)
+
+def iter_pages_with_ocr(pdf_path: str, profiler=NULL_PROFILER, adaptive: bool = OCR_ADAPTIVE, log=print):
+    """
+    OCR one page at a time: yields (page_key, text, sources, (raw_text, OffsetMap)) as soon as a page is done.
+    Pages are also rendered one at a time, so the first page does not wait for the whole PDF to be rendered.
+    With adaptive the pages are read at OCR_LOW_DPI first and only the ones with a mean
+    confidence below OCR_MIN_CONFIDENCE again at OCR_DPI, which is reported with log.
+    """
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    dpi = OCR_LOW_DPI if adaptive else OCR_DPI
+    for i in range(1, page_count + 1):
+        with profiler.span("convert_from_path"):
+            image = convert_from_path(pdf_path, dpi=dpi, first_page=i, last_page=i)[0]
+        text, sources, confidence = ocr_image(image, i - 1, dpi, profiler)
+        if adaptive and confidence < OCR_MIN_CONFIDENCE:
+            log(f"Page {i}: mean confidence {confidence:.0f} at {dpi} dpi, reading again at {OCR_DPI} dpi")
+            with profiler.span("convert_from_path"):
+                image = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=i, last_page=i)[0]
+            text, sources, confidence = ocr_image(image, i - 1, OCR_DPI, profiler)
+        # The OCR text is built from the words and needs no cleaning, so it is its own raw text
+        yield f"page_{i}", text, sources, (text, OffsetMap.identity(len(text)))
+
+def extract_text_with_ocr(pdf_path: str, profiler=NULL_PROFILER, adaptive: bool = OCR_ADAPTIVE) -> (dict, dict, dict):
+    """
+    Extracts text from image-based PDFs using OCR.
+    Returns the text, the character sources and (raw_text, OffsetMap) per page.
+    """
+    pages_text = {}
+    pages_sources = {}
+    pages_raw = {}
+    for key, text, sources, raw in iter_pages_with_ocr(pdf_path, profiler, adaptive):
+        pages_text[key] = text
+        pages_sources[key] = sources
+        pages_raw[key] = raw
+    return pages_text, pages_sources, pages_raw
+
+def join_pages(pages_text: dict) -> str:
+    """Joins the page texts into the full document text. Entity offsets refer to this string."""
+    return "\n".join([p.strip() for p in pages_text.values() if p.strip()]).strip()
+
+def join_pages_with_sources(pages_text: dict, pages_sources: dict) -> (str, list):
+    """Same as join_pages, and the character sources joined so that sources[i] belongs to full_text[i]."""
+    text_parts = []
+    all_sources = []
+    for key, text in pages_text.items():
+        stripped = text.strip()
+        if not stripped:
+            continue
+        start = len(text) - len(text.lstrip())
+        if text_parts:
+            all_sources.append(None)  # The "\n" between pages
+        text_parts.append(stripped)
+        all_sources.extend(pages_sources[key][start:start + len(stripped)])
+    return "\n".join(text_parts), all_sources
+
+def split_text_into_chunks_with_offsets(text: str, chunk_size: int = 500) -> list:
+    """
+    Splits text into chunks using direct slicing to preserve exact character indices.
+    Returns a list of dictionaries with 'text' and 'start_offset'.
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            # Find the last whitespace to avoid cutting a word
+            last_space = text.rfind(' ', start, end)
+            last_newline = text.rfind('\n', start, end)
+            split_at = max(last_space, last_newline)
+            if split_at > start:
+                end = split_at
+        
+        chunks.append({
+            "text": text[start:end],
+            "offset": start
+        })
+        start = end
+    return chunks
+
+class PageChunker:
+    """
+    Chunks a document one page at a time, while the pages are still being extracted.
+    Offsets are in the joined text (see join_pages), so they are the same as in full_text.
+    Unlike split_text_into_chunks_with_offsets(full_text) a chunk never crosses a page break.
+    """
+
+    def __init__(self, chunk_size: int = 500):
+        self.chunk_size = chunk_size
+        self.length = 0  # Length of the joined text so far
+        self.count = 0   # Chunks so far, every chunk gets its number in the document as "index"
+
+    def add(self, page_key: str, text: str) -> (int, list):
+        """Chunks the next page. Returns its offset in the joined text (None for an empty page) and its chunks."""
+        stripped = text.strip()
+        if not stripped:
+            return None, []
+        if self.length:
+            self.length += 1  # The "\n" between pages
+        start = self.length
+        chunks = split_text_into_chunks_with_offsets(stripped, self.chunk_size)
+        for chunk in chunks:
+            chunk["offset"] += start
+            chunk["page"] = page_key
+            chunk["index"] = self.count
+            self.count += 1
+        self.length += len(stripped)
+        return start, chunks
@@ -0,0 +1,53 @@
+"""
+gunicorn config for running the app in production (python app.py is the development server).
+
+    cd flask
+    gunicorn -c gunicorn.conf.py app:app                          # WSGI, threaded workers
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py asgi:application  # ASGI, async /run
+
+Sizing:
+    - Extraction (pdfplumber, OCR) is CPU-bound and holds the GIL, so processes are what
+      scale it. Start with one worker per core: WEB_WORKERS = cores.
+    - WSGI: each /run holds a thread for the whole stream, which is mostly waiting for the
+      model. WEB_THREADS is therefore the number of documents one worker can have in flight,
+      so workers x threads should be at least the number of concurrent uploads you expect.
+      The threads of a worker share one OpenAI connection pool (LLM_MAX_CONNECTIONS).
+    - ASGI: a /run only takes a thread while it extracts or saves, the model streaming is
+      async. One worker per core is enough, WEB_THREADS is not used.
+    - All workers share the provider's rate limits but each has its own scheduler, so set
+      REQUESTS_PER_MINUTE / TOKENS_PER_MINUTE in app.py to the limit divided by the workers.
+    - OCR'ing a large scan can take minutes, hence the long timeout.
+"""
+
+import multiprocessing
+import os
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count()))
+
+if SERVER_MODE == "asgi":
+    # Needs uvicorn (and uvicorn-worker on uvicorn >= 0.30)
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    worker_class = "gthread"
+    threads = int(os.environ.get("WEB_THREADS", "16"))
+
+# Seconds a worker may be silent before it is restarted. A streaming /run keeps writing, but
+# extraction of a big scan does not
+timeout = int(os.environ.get("WEB_TIMEOUT", "600"))
+graceful_timeout = 60
+keepalive = 5
+
+# Restart workers now and then, pdfplumber and PIL do not always give memory back
+max_requests = 500
+max_requests_jitter = 50
+
+# Every worker imports the app itself: the janitor thread and the HTTP client pools
+# do not survive a fork
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("WEB_LOG_LEVEL", "info")
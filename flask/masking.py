@@ -0,0 +1,81 @@
+"""
+Masking engine for /export.
+
+Masks all entity spans in one pass over the text: the spans are sorted, overlapping spans are
+merged (touching ones are not, each keeps its own replacement), and the output is built from a
+list of pieces with a single join. Rebuilding the string once per entity
+(text[:start] + label + text[end:]) is quadratic in text length x entity count and breaks on
+overlapping spans.
+
+Modes:
+    label      - "[NAME]"
+    redact     - the same number of "*" as the masked text, so the length and layout are kept
+    pseudonym  - "[NAME_1]", "[NAME_2]" ... the same person/number gets the same pseudonym everywhere
+"""
+
+MODES = ("label", "redact", "pseudonym")
+REDACT_CHAR = "*"
+
+
+def merge_spans(entities, text_length):
+    """
+    Returns sorted, non-overlapping spans as (start, end, label) tuples.
+    Spans are clamped to the text, empty spans are dropped and overlapping spans are merged.
+    A merged span gets the label of its longest part.
+    """
+    spans = []
+    for ent in entities:
+        start = max(0, int(ent["start"]))
+        end = min(text_length, int(ent["end"]))
+        if start < end:
+            spans.append((start, end, ent.get("label") or "MASKED"))
+    spans.sort()
+
+    merged = []
+    for start, end, label in spans:
+        if merged and start < merged[-1][1]:
+            last_start, last_end, last_label, longest = merged[-1]
+            if end - start > longest:
+                last_label, longest = label, end - start
+            merged[-1] = [last_start, max(last_end, end), last_label, longest]
+        else:
+            merged.append([start, end, label, end - start])
+    return [(start, end, label) for start, end, label, _ in merged]
+
+
+def mask_spans(text, entities, mode="label"):
+    """Returns the merged spans with their replacement: [(start, end, label, replacement), ...]"""
+    if mode not in MODES:
+        raise ValueError(f"Unknown masking mode '{mode}', use one of {', '.join(MODES)}")
+
+    pseudonyms = {}
+    counters = {}
+    result = []
+
+    for start, end, label in merge_spans(entities, len(text)):
+        if mode == "label":
+            replacement = f"[{label}]"
+        elif mode == "redact":
+            replacement = REDACT_CHAR * (end - start)
+        else:
+            # Same label and (normalized) text -> same pseudonym
+            key = (label, " ".join(text[start:end].split()).lower())
+            if key not in pseudonyms:
+                counters[label] = counters.get(label, 0) + 1
+                pseudonyms[key] = f"[{label}_{counters[label]}]"
+            replacement = pseudonyms[key]
+        result.append((start, end, label, replacement))
+
+    return result
+
+
+def mask_text(text, entities, mode="label"):
+    """Returns the text with every entity span replaced according to mode."""
+    pieces = []
+    position = 0
+    for start, end, _, replacement in mask_spans(text, entities, mode):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces)
@@ -0,0 +1,137 @@
+"""
+Offset-stable whitespace normalization.
+
+clean_whitespace() collapses runs of spaces and limits runs of newlines with regexes, and the
+pages are then stripped and joined, after which an offset in full_text no longer says anything
+about where it came from in the raw page text. normalize_whitespace() does the same cleaning in
+a single pass and also returns an OffsetMap from cleaned offsets back to raw offsets.
+
+The map is run-length encoded: the cleaned text is a sequence of runs that were copied unchanged
+from the raw text, so it only stores where each run starts in the cleaned and in the raw text.
+A lookup is a binary search over the runs, and a layout=True page with thousands of padding
+spaces only needs a few hundred runs.
+"""
+
+import array
+import re
+from bisect import bisect_right
+
+# Collapsing spaces never creates a newline run and limiting newlines never creates a space run,
+# so both rules can be applied in the same pass. Same result as clean_whitespace().
+COLLAPSE = re.compile(r" {2,}|\n{3,}")
+
+
+class OffsetMap:
+    """Maps offsets in a cleaned text to offsets in the raw text it was cleaned from."""
+
+    def __init__(self, clean_starts, raw_starts, length):
+        self.clean_starts = clean_starts
+        self.raw_starts = raw_starts
+        self.length = length
+
+    @classmethod
+    def identity(cls, length):
+        return cls(array.array("I", [0]), array.array("I", [0]), length)
+
+    def __len__(self):
+        return self.length
+
+    def runs(self):
+        """(clean_start, raw_start, length) for every run."""
+        ends = list(self.clean_starts[1:]) + [self.length]
+        return [(c, r, end - c) for c, r, end in zip(self.clean_starts, self.raw_starts, ends)]
+
+    def to_raw(self, i):
+        """Raw offset of the character at cleaned offset i."""
+        run = bisect_right(self.clean_starts, i) - 1
+        return self.raw_starts[run] + (i - self.clean_starts[run])
+
+    def span_to_raw(self, start, end):
+        """Raw (start, end) for a cleaned span. The raw span includes any whitespace removed inside it."""
+        if end <= start:
+            raw = self.to_raw(start) if start < self.length else self.to_raw(self.length - 1) + 1
+            return raw, raw
+        return self.to_raw(start), self.to_raw(end - 1) + 1
+
+    def project(self, values):
+        """Picks the entries of a per-raw-character list that belong to the cleaned characters."""
+        result = []
+        for clean_start, raw_start, length in self.runs():
+            result.extend(values[raw_start:raw_start + length])
+        return result
+
+
+def normalize_whitespace(raw):
+    """
+    Cleans raw the same way as clean_whitespace() and returns (text, OffsetMap).
+    Runs of spaces become one space, runs of three or more newlines become two, and the ends are stripped.
+    """
+    if not raw:
+        return "", OffsetMap.identity(0)
+
+    # Strip first, so the runs never start in removed leading whitespace
+    begin = len(raw) - len(raw.lstrip())
+    end = len(raw.rstrip())
+
+    pieces = []
+    clean_starts = array.array("I")
+    raw_starts = array.array("I")
+    clean_length = 0
+    run_start = begin
+
+    for match in COLLAPSE.finditer(raw, begin, end):
+        keep = 1 if match.group()[0] == " " else 2
+        run_end = match.start() + keep
+        if run_end > run_start:
+            clean_starts.append(clean_length)
+            raw_starts.append(run_start)
+            pieces.append(raw[run_start:run_end])
+            clean_length += run_end - run_start
+        run_start = match.end()
+
+    if end > run_start:
+        clean_starts.append(clean_length)
+        raw_starts.append(run_start)
+        pieces.append(raw[run_start:end])
+        clean_length += end - run_start
+
+    if not clean_starts:
+        return "", OffsetMap.identity(0)
+    return "".join(pieces), OffsetMap(clean_starts, raw_starts, clean_length)
+
+
+class DocumentMap:
+    """
+    Maps offsets in full_text (the stripped pages joined with newlines) to (page_key, raw offset)
+    in the raw text of that page.
+    """
+
+    def __init__(self):
+        self.starts = []     # Offset in full_text where each page begins
+        self.pages = []      # (page_key, OffsetMap, offset of the stripped text inside the cleaned page text)
+
+    @classmethod
+    def build(cls, pages_text, pages_maps):
+        """Same joining as extraction.join_pages."""
+        doc_map = cls()
+        position = 0
+        for key, text in pages_text.items():
+            stripped = text.strip()
+            if not stripped:
+                continue
+            if doc_map.starts:
+                position += 1  # The "\n" between pages
+            doc_map.starts.append(position)
+            doc_map.pages.append((key, pages_maps[key], len(text) - len(text.lstrip())))
+            position += len(stripped)
+        return doc_map
+
+    def span_to_raw(self, start, end):
+        """(page_key, raw_start, raw_end) for a span in full_text. A span over a page break is cut at the end of its first page."""
+        page = bisect_right(self.starts, start) - 1
+        key, offset_map, strip_offset = self.pages[page]
+        local_start = start - self.starts[page] + strip_offset
+        local_end = end - self.starts[page] + strip_offset
+        local_end = min(local_end, len(offset_map))
+        raw_start, raw_end = offset_map.span_to_raw(local_start, local_end)
+        return key, raw_start, raw_end
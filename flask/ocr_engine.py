@@ -0,0 +1,126 @@
+"""
+OCR engines behind extraction.ocr_page. Both return the same word table as
+pytesseract.image_to_data(output_type=DICT): text, conf, left, top, width, height and
+block_num/par_num/line_num per word.
+
+    subprocess  pytesseract: one tesseract process per page, the image goes through a temp file
+                and the traineddata is loaded again for every page
+    tesserocr   a pool of long-lived Tesseract instances through the C API (pip install tesserocr).
+                The language is loaded once per instance and images are passed in memory. Each
+                instance is used by one thread at a time, and tesserocr releases the GIL while
+                recognizing, so OCR_WORKERS threads (e.g. gunicorn request threads) OCR in parallel
+
+Chosen with OCR_ENGINE, falls back to subprocess when tesserocr is not installed. The tesserocr
+wheels do not know where the system's traineddata is, set TESSDATA_PREFIX to the tessdata folder.
+"""
+
+import os
+import queue
+import re
+import threading
+import pytesseract
+
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "subprocess")
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+TESSDATA_PREFIX = os.environ.get("TESSDATA_PREFIX")
+ENGINES = ("subprocess", "tesserocr")
+
+FIELDS = ("text", "conf", "left", "top", "width", "height", "block_num", "par_num", "line_num")
+
+
+class SubprocessEngine:
+    name = "subprocess"
+
+    def __init__(self, lang, config):
+        self.lang = lang
+        self.config = config
+
+    def image_to_data(self, image):
+        return pytesseract.image_to_data(image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+def parse_config(config):
+    """(oem, psm) from a tesseract command line config like "--oem 3 --psm 4"."""
+    oem = re.search(r"--oem\s+(\d+)", config)
+    psm = re.search(r"--psm\s+(\d+)", config)
+    return int(oem.group(1)) if oem else 3, int(psm.group(1)) if psm else 3
+
+
+class TesserocrEngine:
+    """Pool of up to size warm PyTessBaseAPI instances, created on first use."""
+
+    name = "tesserocr"
+
+    def __init__(self, lang, config, size=OCR_WORKERS):
+        import tesserocr
+
+        self.tesserocr = tesserocr
+        self.lang = lang
+        self.oem, self.psm = parse_config(config)
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.created = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.created) < self.size:
+                options = {"path": TESSDATA_PREFIX} if TESSDATA_PREFIX else {}
+                api = self.tesserocr.PyTessBaseAPI(lang=self.lang, oem=self.oem, psm=self.psm, **options)
+                self.created.append(api)
+                return api
+        return self.idle.get()
+
+    def image_to_data(self, image):
+        tesserocr = self.tesserocr
+        data = {field: [] for field in FIELDS}
+        api = self.acquire()
+        try:
+            api.SetImage(image)
+            api.Recognize()
+            iterator = api.GetIterator()
+            block = par = line = 0
+            for word in tesserocr.iterate_level(iterator, tesserocr.RIL.WORD):
+                box = word.BoundingBox(tesserocr.RIL.WORD)
+                if box is None:
+                    continue
+                # Same numbering as image_to_data: counters restart inside their parent
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, par, line = block + 1, 0, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par, line = par + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                x0, y0, x1, y1 = box
+                values = (word.GetUTF8Text(tesserocr.RIL.WORD) or "", word.Confidence(tesserocr.RIL.WORD),
+                          x0, y0, x1 - x0, y1 - y0, block, par, line)
+                for field, value in zip(FIELDS, values):
+                    data[field].append(value)
+        finally:
+            api.Clear()
+            self.idle.put(api)
+        return data
+
+    def close(self):
+        with self.lock:
+            for api in self.created:
+                api.End()
+            self.created = []
+
+
+def create_engine(lang, config, name=OCR_ENGINE, workers=OCR_WORKERS):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine '{name}', use one of {', '.join(ENGINES)}")
+    if name == "tesserocr":
+        try:
+            return TesserocrEngine(lang, config, workers)
+        except ImportError:
+            print("WARNING: OCR_ENGINE=tesserocr needs tesserocr, using the tesseract subprocess")
+    return SubprocessEngine(lang, config)
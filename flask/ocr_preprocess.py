@@ -0,0 +1,170 @@
+"""
+Image preprocessing before OCR.
+
+The old preprocess_image() thresholded at a fixed 140 with image.point(lambda ...) and then ran
+ImageEnhance.Contrast on the result. Contrast on an image that is already pure black and white
+changes nothing but is a full extra pass over the page, so it is gone. Thresholding is done
+with a lookup table (image.point(table) runs in C, Pillow does not have to build the table by
+calling a Python function 256 times) and everything else stays in Pillow's C code or NumPy.
+
+Thresholding methods (OCR_THRESHOLD):
+    fixed    - everything darker than FIXED_THRESHOLD is black, like before
+    otsu     - one global threshold chosen from the page histogram (Otsu's method), for scans
+               that are lighter or darker than usual
+    sauvola  - a threshold per pixel from the mean and standard deviation around it, for uneven
+               lighting and shadows. Needs NumPy, falls back to otsu without it
+    none     - greyscale only, Tesseract binarizes itself
+
+Deskew (OCR_DESKEW=1) finds the rotation that gives the sharpest row profile (text lines line
+up with the pixel rows) on a small copy of the page and rotates the page back. The angle is
+returned, so the word boxes can be rotated back to the original page (see extraction.ocr_page).
+"""
+
+import math
+import os
+from PIL import Image
+
+FIXED_THRESHOLD = 140
+OCR_THRESHOLD = os.environ.get("OCR_THRESHOLD", "fixed")
+OCR_DESKEW = os.environ.get("OCR_DESKEW", "0") == "1"
+METHODS = ("fixed", "otsu", "sauvola", "none")
+
+SAUVOLA_WINDOW = 25     # Pixels, about one text line at 300 dpi
+SAUVOLA_K = 0.2
+DESKEW_MAX_ANGLE = 5.0  # Degrees
+DESKEW_STEP = 0.25
+DESKEW_WIDTH = 600      # Width of the copy the angle is searched on
+
+
+def threshold_table(threshold):
+    """Lookup table for image.point: black below threshold, white from it."""
+    return [0] * threshold + [255] * (256 - threshold)
+
+
+FIXED_TABLE = threshold_table(FIXED_THRESHOLD)
+
+
+def otsu_threshold(histogram):
+    """Otsu's method on a 256-bin histogram: the threshold with the largest between-class variance."""
+    total = sum(histogram)
+    if total == 0:
+        return FIXED_THRESHOLD
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0.0
+    weight_background = 0
+    best_threshold, best_variance = FIXED_THRESHOLD, -1.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i + 1, variance
+    return best_threshold
+
+
+def sauvola(image, window=SAUVOLA_WINDOW, k=SAUVOLA_K):
+    """Sauvola thresholding of a greyscale ("L") image. Uses running sums, so the window size costs nothing."""
+    import numpy as np
+
+    pixels = np.asarray(image, dtype=np.float64)
+    height, width = pixels.shape
+    half = window // 2
+    top = np.clip(np.arange(height) - half, 0, height)
+    bottom = np.clip(np.arange(height) + half + 1, 0, height)
+    left = np.clip(np.arange(width) - half, 0, width)
+    right = np.clip(np.arange(width) + half + 1, 0, width)
+    area = (bottom - top)[:, None] * (right - left)[None, :]
+
+    def window_sum(values):
+        # Box sum as two 1D running sums: over the rows, then over the columns
+        rows = np.zeros((height + 1, width))
+        np.cumsum(values, axis=0, out=rows[1:])
+        values = rows[bottom] - rows[top]
+        cols = np.zeros((height, width + 1))
+        np.cumsum(values, axis=1, out=cols[:, 1:])
+        return cols[:, right] - cols[:, left]
+
+    mean = window_sum(pixels) / area
+    variance = np.maximum(window_sum(pixels * pixels) / area - mean * mean, 0.0)
+    threshold = mean * (1 + k * (np.sqrt(variance) / 128.0 - 1))
+    return Image.fromarray(np.where(pixels < threshold, 0, 255).astype(np.uint8), mode="L")
+
+
+def binarize(image, method=OCR_THRESHOLD):
+    """Greyscale image -> black and white with the given method."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown threshold method '{method}', use one of {', '.join(METHODS)}")
+    if method == "none":
+        return image
+    if method == "sauvola":
+        try:
+            return sauvola(image)
+        except ImportError:
+            print("WARNING: Sauvola thresholding needs numpy, using otsu")
+            method = "otsu"
+    if method == "otsu":
+        return image.point(threshold_table(otsu_threshold(image.histogram())))
+    return image.point(FIXED_TABLE)
+
+
+def row_profile_score(image):
+    """How sharp the rows are: the variance of the mean darkness per row."""
+    # Resizing to one column with a box filter gives the mean of every row, in C
+    profile = image.resize((1, image.height), Image.BOX).tobytes()
+    mean = sum(profile) / len(profile)
+    return sum((value - mean) ** 2 for value in profile)
+
+
+def skew_angle(image, max_angle=DESKEW_MAX_ANGLE, step=DESKEW_STEP):
+    """Angle in degrees (counterclockwise, like Image.rotate) that straightens the text lines."""
+    scale = DESKEW_WIDTH / image.width if image.width > DESKEW_WIDTH else 1.0
+    small = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.BOX)
+    small = small.point(threshold_table(otsu_threshold(small.histogram())))
+
+    best_angle, best_score = 0.0, row_profile_score(small)
+    steps = int(max_angle / step)
+    for i in range(-steps, steps + 1):
+        angle = i * step
+        if angle == 0:
+            continue
+        score = row_profile_score(small.rotate(angle, resample=Image.NEAREST, fillcolor=255))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def unrotate_box(box, angle, width, height):
+    """
+    Maps a box (x0, top, x1, bottom) in an image rotated with Image.rotate(angle) (same size,
+    around the center) back to the original image. Returns the bounding box of the rotated corners.
+    """
+    if not angle:
+        return box
+    # Image.rotate turns the content counterclockwise on screen (y down), undo that
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    cx, cy = width / 2.0, height / 2.0
+    xs, ys = [], []
+    for x, y in ((box[0], box[1]), (box[2], box[1]), (box[0], box[3]), (box[2], box[3])):
+        dx, dy = x - cx, y - cy
+        xs.append(cx + dx * cos - dy * sin)
+        ys.append(cy + dx * sin + dy * cos)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def preprocess(image, method=OCR_THRESHOLD, deskew=OCR_DESKEW):
+    """Greyscale, optional deskew and thresholding. Returns (image, angle) - angle is 0.0 without deskew."""
+    image = image.convert("L")
+    angle = 0.0
+    if deskew:
+        angle = skew_angle(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+    return binarize(image, method), angle
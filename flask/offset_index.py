@@ -0,0 +1,100 @@
+"""
+Character-to-coordinate index for the extracted document text.
+
+For every character in full_text it stores where that character is on the page:
+page index and box (x0, top, x1, bottom) in PDF points from the top-left corner of the page.
+Characters that are not on any page (layout padding, the newline between pages) have page -1.
+
+The index is five flat arrays (int16 page + 4 x float32), 18 bytes per character, so a lookup
+is a plain array access. It is built during extraction and saved next to the predictions as
+temp/<job>/<name>_offsets.bin, which lets /export map entity offsets back to the page without
+extracting or OCR'ing the document again.
+
+A SHA-256 of the text is stored with it, so /export can check that the text it gets back is
+the text the index was built for, not just one of the same length.
+
+File format (little endian):
+    magic b"PIIX", uint32 version, uint32 count, 32 bytes SHA-256 of the text (UTF-8),
+    then count x int16 page, count x float32 x0, top, x1, bottom
+"""
+
+import array
+import hashlib
+import struct
+import sys
+
+MAGIC = b"PIIX"
+VERSION = 2
+HEADER = struct.Struct("<4sII32s")
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class OffsetIndex:
+
+    def __init__(self, page, x0, top, x1, bottom, digest):
+        self.page = page
+        self.x0 = x0
+        self.top = top
+        self.x1 = x1
+        self.bottom = bottom
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.page)
+
+    def matches(self, text):
+        """True if the index was built for exactly this text."""
+        return len(text) == len(self.page) and text_digest(text) == self.digest
+
+    @classmethod
+    def from_sources(cls, sources, text):
+        """Builds the index for text from a list with (page_index, (x0, top, x1, bottom)) or None per character."""
+        page = array.array("h")
+        columns = [array.array("f") for _ in range(4)]
+        for src in sources:
+            if src is None:
+                page.append(-1)
+                for column in columns:
+                    column.append(0.0)
+            else:
+                page.append(src[0])
+                for column, value in zip(columns, src[1]):
+                    column.append(value)
+        return cls(page, *columns, digest=text_digest(text))
+
+    def box(self, i):
+        """(page_index, x0, top, x1, bottom) for character i, or None if it is not on a page."""
+        page = self.page[i]
+        if page < 0:
+            return None
+        return page, self.x0[i], self.top[i], self.x1[i], self.bottom[i]
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.page), self.digest))
+            for column in (self.page, self.x0, self.top, self.x1, self.bottom):
+                if sys.byteorder != "little":
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f"{path} is not an offset index (version {VERSION})")
+            magic, version, count, digest = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not an offset index (version {VERSION})")
+            columns = []
+            for typecode in ("h", "f", "f", "f", "f"):
+                column = array.array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder != "little":
+                    column.byteswap()
+                columns.append(column)
+        return cls(*columns, digest=digest)
@@ -0,0 +1,122 @@
+"""
+A small stage graph: a source and a chain of stages, each in its own thread, connected by
+bounded queues.
+
+/run used to run in strict phases (extract every page, join, chunk, then call the model for
+every chunk), so the model waited for OCR and OCR waited for the model. With the pipeline the
+first page is chunked and sent to the model while the next pages are still being OCR'd, and a
+scan takes about max(OCR, model) instead of their sum.
+
+    events = Pipeline(iter_pages(pdf_path), chunk_page)
+    for event in events:      # in the request thread, e.g. inference
+        ...
+
+Every stage is a function from one item to an iterable of items (zero, one or many), run in
+order. The queues are bounded (PIPELINE_QUEUE_SIZE), so a fast stage waits for a slow one
+instead of piling up pages in memory. An exception in any thread is raised in the consumer, and
+when the consumer stops early (closed connection) the threads are told to stop and the source
+is closed. context (e.g. profiler.thread) is entered by every thread around its work.
+"""
+
+import os
+import queue
+import threading
+from contextlib import nullcontext
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))
+# How often a blocked put checks whether the pipeline was closed
+POLL_SECONDS = 0.1
+
+DONE = object()
+
+
+class Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+
+    def __init__(self, source, *stages, maxsize=PIPELINE_QUEUE_SIZE, context=nullcontext):
+        self.context = context
+        self.queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        self.closed = threading.Event()
+        self.threads = [threading.Thread(target=self.produce, args=(source, self.queues[0]), daemon=True)]
+        for stage, inbox, outbox in zip(stages, self.queues, self.queues[1:]):
+            self.threads.append(threading.Thread(target=self.transform, args=(stage, inbox, outbox), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, outbox, item):
+        while not self.closed.is_set():
+            try:
+                outbox.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, inbox):
+        while not self.closed.is_set():
+            try:
+                return inbox.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return DONE
+
+    def produce(self, source, outbox):
+        with self.context():
+            try:
+                for item in source:
+                    if not self.put(outbox, item):
+                        return
+            except Exception as e:
+                self.put(outbox, Failed(e))
+            finally:
+                # A generator is closed in the thread that runs it, so its finally blocks (timers,
+                # open files) run here, also when the pipeline is closed in the middle
+                if hasattr(source, "close"):
+                    source.close()
+            self.put(outbox, DONE)
+
+    def transform(self, stage, inbox, outbox):
+        with self.context():
+            self.run_stage(stage, inbox, outbox)
+
+    def run_stage(self, stage, inbox, outbox):
+        while True:
+            item = self.get(inbox)
+            if item is DONE or isinstance(item, Failed):
+                # Pass the end (or the error) on, the stages after this one stop too
+                self.put(outbox, item)
+                return
+            try:
+                for result in stage(item):
+                    if not self.put(outbox, result):
+                        return
+            except Exception as e:
+                self.put(outbox, Failed(e))
+                self.put(outbox, DONE)
+                return
+
+    def __iter__(self):
+        try:
+            while True:
+                # Returns DONE once the pipeline is closed, also when another thread closed it
+                item = self.get(self.queues[-1])
+                if item is DONE:
+                    return
+                if isinstance(item, Failed):
+                    raise item.error
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops all threads and waits until the source is closed, which can take until the item the
+        source is working on is done (e.g. the OCR of a page). Items already in the queues are dropped.
+        """
+        self.closed.set()
+        if self.threads[0] is not threading.current_thread():
+            self.threads[0].join()
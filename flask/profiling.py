@@ -0,0 +1,252 @@
+"""
+Opt-in profiling for /run.
+
+Enable it per request with the header "X-Profile: <mode>" or the query flag "?profile=<mode>":
+
+    spans         - only time the pipeline stages (extraction, OCR, chunking, LLM, index_finder, JSON)
+    cprofile      - spans + a cProfile profile, saved as .prof (open with e.g. snakeviz)
+    pyinstrument  - spans + a pyinstrument profile, saved as .html and speedscope .json (needs pyinstrument)
+
+Spans are saved as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev) which shows
+the stages as a flame chart. All files are stored next to temp/<job>/<name>_predictions.json.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+MODES = {"spans", "cprofile", "pyinstrument"}
+
+# cProfile allows one active profiler per process on Python 3.12+ (sys.monitoring), and on 3.11 a
+# second one in the same thread replaces the first. So only one run at a time gets a profile, the
+# others fall back to spans
+PROFILE_LOCK = threading.Lock()
+
+
+class Profiler:
+    """
+    Records timed spans for one request and optionally runs a sampling/deterministic profiler.
+
+    Both profilers only see the thread they were started in (cProfile before Python 3.12), so
+    every thread of the request (the pipeline stages) runs its own inside thread(), and save()
+    merges them. Where one profiler already sees all threads, the extra ones cannot start and
+    are skipped. Spans can be recorded from any thread, their nesting depth is kept per thread.
+    """
+
+    enabled = True
+
+    def __init__(self, mode="spans"):
+        self.mode = mode
+        self.spans = []
+        self.started = time.perf_counter()
+        self.finished = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.main = None
+        self.profiles = []
+        self.owns_lock = False
+        self.skipped = None
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            thread = threading.current_thread()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start": start - self.started,
+                    "duration": time.perf_counter() - start,
+                    "depth": depth,
+                    "thread": thread.ident,
+                    "thread_name": thread.name
+                })
+
+    def _begin(self):
+        """Starts a profile in the calling thread. Returns it, or None if there is none or one is already running."""
+        if not self.owns_lock or getattr(self.local, "profile", None) is not None:
+            return None
+        try:
+            if self.mode == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+            else:
+                from pyinstrument import Profiler as PyinstrumentProfiler
+                profile = PyinstrumentProfiler()
+                profile.start()
+        except (ValueError, RuntimeError):
+            # Another profiling tool is already active (e.g. this run's own profiler on Python 3.12+)
+            return None
+        self.local.profile = profile
+        return profile
+
+    def _end(self, profile):
+        if profile is None:
+            return
+        if self.mode == "cprofile":
+            profile.disable()
+        else:
+            profile.stop()
+        self.local.profile = None
+        with self.lock:
+            self.profiles.append(profile)
+
+    @contextmanager
+    def thread(self):
+        """Profiles the calling thread until the block ends, e.g. a pipeline stage: Pipeline(..., context=profiler.thread)."""
+        profile = self._begin()
+        try:
+            yield
+        finally:
+            self._end(profile)
+
+    def start(self):
+        """Starts profiling the calling thread. stop() has to be called in the same thread."""
+        self.started = time.perf_counter()
+        if self.mode == "spans":
+            return self
+        if self.mode == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                # Fall back to cProfile so the request still gets a profile
+                self.mode = "cprofile"
+        if not PROFILE_LOCK.acquire(blocking=False):
+            self.skipped = self.mode
+            self.mode = "spans"
+            return self
+        self.owns_lock = True
+        self.main = self._begin()
+        return self
+
+    def stop(self):
+        """Stops the profile and lets the next run be profiled. Can be called again, e.g. when the run was cut short."""
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        self._end(self.main)
+        self.main = None
+        if self.owns_lock:
+            self.owns_lock = False
+            PROFILE_LOCK.release()
+
+    def breakdown(self):
+        """Total time per stage name in the order the stages first ran. Nested stages keep their depth."""
+        with self.lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            entry = totals.setdefault(span["name"], {"first": span["start"], "depth": span["depth"], "total": 0.0, "count": 0})
+            entry["first"] = min(entry["first"], span["start"])
+            entry["total"] += span["duration"]
+            entry["count"] += 1
+        return sorted(totals.items(), key=lambda item: item[1]["first"])
+
+    def log_lines(self):
+        """Timing breakdown formatted for the LOG: channel."""
+        wall = (self.finished or time.perf_counter()) - self.started
+        lines = [f"Profile ({self.mode}): {wall:.2f}s wall time"]
+        if self.skipped:
+            lines.append(f"  No {self.skipped} profile, another request is being profiled")
+        for name, entry in self.breakdown():
+            share = entry["total"] / wall if wall > 0 else 0.0
+            label = "  " * entry["depth"] + name
+            lines.append(f"  {label:<22} {entry['total']:8.3f}s {share:6.1%}  ({entry['count']}x)")
+        return lines
+
+    def save(self, folder, base_name):
+        """Writes the spans (and profile, if any) next to the predictions. Returns the paths written."""
+        paths = []
+
+        trace_path = os.path.join(folder, f"{base_name}_trace.json")
+        # One row per thread in the trace viewer
+        with self.lock:
+            spans = list(self.spans)
+            profiles = list(self.profiles)
+        threads = {span["thread"]: span["thread_name"] for span in spans}
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        events += [
+            {
+                "name": span["name"],
+                "ph": "X",
+                "ts": round(span["start"] * 1e6),
+                "dur": round(span["duration"] * 1e6),
+                "pid": 1,
+                "tid": span["thread"]
+            }
+            for span in spans
+        ]
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        paths.append(trace_path)
+
+        if self.mode == "cprofile" and profiles:
+            prof_path = os.path.join(folder, f"{base_name}_profile.prof")
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(prof_path)
+            paths.append(prof_path)
+
+        elif self.mode == "pyinstrument" and profiles:
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+            session = functools.reduce(Session.combine, [profile.last_session for profile in profiles])
+            html_path = os.path.join(folder, f"{base_name}_profile.html")
+            with open(html_path, "w", encoding="utf-8") as f:
+                f.write(HTMLRenderer().render(session))
+            paths.append(html_path)
+            try:
+                from pyinstrument.renderers import SpeedscopeRenderer
+                speedscope_path = os.path.join(folder, f"{base_name}_profile.speedscope.json")
+                with open(speedscope_path, "w", encoding="utf-8") as f:
+                    f.write(SpeedscopeRenderer().render(session))
+                paths.append(speedscope_path)
+            except ImportError:
+                pass
+
+        return paths
+
+
+class NullProfiler:
+    """Used when profiling is off. Same interface, does nothing."""
+
+    enabled = False
+
+    @contextmanager
+    def span(self, name):
+        yield
+
+    @contextmanager
+    def thread(self):
+        yield
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profiler_from_request(req):
+    """Returns a Profiler if the request asked for one (header X-Profile or ?profile=), otherwise NULL_PROFILER."""
+    value = req.headers.get("X-Profile") or req.args.get("profile")
+    if not value:
+        return NULL_PROFILER
+    value = value.strip().lower()
+    if value in ("0", "false", "off", "no"):
+        return NULL_PROFILER
+    return Profiler(value if value in MODES else "spans")
@@ -0,0 +1,225 @@
+"""
+Layout-preserving redaction of the original PDF.
+
+Instead of re-typesetting the masked plain text, the entity offsets in the extracted text are
+mapped back to where the characters are on the page with the OffsetIndex built during extraction:
+
+    - text-based PDFs: the pdfplumber character boxes behind extract_text(layout=True)
+    - scanned PDFs:    the Tesseract word boxes (image_to_data) of the OCR'd page
+
+Each page is then rendered as an image and black boxes are drawn over the entities (with the
+label or pseudonym written in them, unless mode is "redact"). Because the pages are images,
+the masked text is really gone from the output and not just hidden under a rectangle.
+Pages are rendered in parallel, in a process pool shared by all requests, and written to disk
+one at a time, so memory use does not grow with the number of pages.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pdfplumber
+from pdf2image import convert_from_path
+from PIL import ImageDraw, ImageFont
+from extraction import MIN_TEXT_LENGTH, extract_text_with_pdfplumber, extract_text_with_ocr, join_pages_with_sources
+from masking import mask_spans
+from offset_index import OffsetIndex
+
+RENDER_DPI = 150
+JPEG_QUALITY = 85
+# Padding around each box in points
+PADDING = 1.0
+# Processes in the shared render pool, 1 renders in the request thread
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+class TextMismatchError(Exception):
+    """The text sent to /export does not belong to this PDF/index, so offsets cannot be mapped."""
+
+
+# --- OFFSETS TO PAGE BOXES ---
+
+def document_index(pdf_path):
+    """
+    Extracts the document like /run does (iter_document_pages in app.py) and returns (full_text, OffsetIndex).
+    Only needed when no index was saved during /run.
+    """
+    pages_text, pages_sources, _ = extract_text_with_pdfplumber(pdf_path)
+    if len("".join(pages_text.values()).strip()) < MIN_TEXT_LENGTH:
+        pages_text, pages_sources, _ = extract_text_with_ocr(pdf_path)
+    full_text, sources = join_pages_with_sources(pages_text, pages_sources)
+    return full_text, OffsetIndex.from_sources(sources, full_text)
+
+
+def entity_boxes(index, spans):
+    """
+    Turns masked spans into boxes per page: {page_index: [(x0, top, x1, bottom, replacement), ...]}.
+    The characters of a span are grouped per line, so an entity over a line break gets one box per line.
+    """
+    boxes = {}
+    for start, end, _, replacement in spans:
+        current = None
+        for i in range(start, end):
+            box = index.box(i)
+            if box is None:
+                continue
+            page_index, x0, top, x1, bottom = box
+            same_line = (current is not None and current[0] == page_index
+                         and abs(current[2] - top) < (bottom - top) / 2)
+            if same_line:
+                current[1] = min(current[1], x0)
+                current[3] = max(current[3], x1)
+                current[4] = max(current[4], bottom)
+            else:
+                if current is not None:
+                    boxes.setdefault(current[0], []).append((*current[1:], replacement))
+                current = [page_index, x0, top, x1, bottom]
+        if current is not None:
+            boxes.setdefault(current[0], []).append((*current[1:], replacement))
+    return boxes
+
+
+# --- RENDERING ---
+
+def render_redacted_page(task):
+    """Worker: renders one page, draws the boxes and returns (jpeg_bytes, width_px, height_px)."""
+    import io
+
+    pdf_path, page_number, dpi, boxes, write_labels = task
+    image = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)[0].convert("RGB")
+    draw = ImageDraw.Draw(image)
+    scale = dpi / 72.0
+
+    for x0, top, x1, bottom, replacement in boxes:
+        rect = ((x0 - PADDING) * scale, (top - PADDING) * scale, (x1 + PADDING) * scale, (bottom + PADDING) * scale)
+        draw.rectangle(rect, fill="black")
+        if write_labels:
+            height = max(int((rect[3] - rect[1]) * 0.7), 6)
+            try:
+                font = ImageFont.load_default(size=height)
+            except TypeError:
+                # Pillow < 10.1 has a single fixed-size default font
+                font = ImageFont.load_default()
+            draw.text((rect[0] + 1, rect[1]), replacement, fill="white", font=font)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=JPEG_QUALITY)
+    return output.getvalue(), image.width, image.height
+
+
+def render_pool():
+    """The process pool for rendering pages, started on first use and shared by all requests."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        return _render_pool
+
+
+def discard_render_pool(pool):
+    """Drops a broken pool (a worker died), the next request starts a new one."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+
+class StreamingPdfWriter:
+    """
+    Minimal PDF writer for pages that are one JPEG image each.
+    Every page is written to the file as soon as it is added, only the object offsets are kept in memory.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3  # 1 = catalog, 2 = page tree, written last
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _begin(self, obj_id):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode("ascii"))
+
+    def _stream_object(self, obj_id, dictionary, data):
+        self._begin(obj_id)
+        self.file.write(f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode("ascii"))
+        self.file.write(data)
+        self.file.write(b"\nendstream\nendobj\n")
+
+    def add_jpeg_page(self, jpeg, width_px, height_px, dpi):
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width_pt = width_px * 72.0 / dpi
+        height_pt = height_px * 72.0 / dpi
+
+        self._stream_object(image_id, (
+            f"/Type /XObject /Subtype /Image /Width {width_px} /Height {height_px} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode"
+        ), jpeg)
+        self._stream_object(content_id, "", f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode("ascii"))
+
+        self._begin(page_id)
+        self.file.write((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>\nendobj\n"
+        ).encode("ascii"))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        self._begin(1)
+        self.file.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+        self._begin(2)
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.file.write(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>\nendobj\n".encode("ascii"))
+
+        xref = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode("ascii"))
+        for obj_id in range(1, self.next_id):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+        self.file.write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+        self.file.close()
+
+
+def redact_pdf(pdf_path, text, entities, out_path, mode="label", index=None, dpi=RENDER_DPI):
+    """
+    Writes a redacted copy of pdf_path to out_path, with the entities (offsets into text) blacked out.
+    index is the OffsetIndex saved during /run; without it the document is extracted again.
+    Raises TextMismatchError if text is not the text extracted from this PDF.
+    """
+    if index is None:
+        full_text, index = document_index(pdf_path)
+        if full_text != text:
+            raise TextMismatchError("The text does not match the text extracted from the PDF")
+    elif not index.matches(text):
+        raise TextMismatchError("The offset index was built for another text")
+
+    boxes = entity_boxes(index, mask_spans(text, entities, mode))
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+
+    tasks = [(pdf_path, i + 1, dpi, boxes.get(i, []), mode != "redact") for i in range(page_count)]
+
+    writer = StreamingPdfWriter(out_path)
+    try:
+        if page_count <= 1 or RENDER_WORKERS <= 1:
+            results = map(render_redacted_page, tasks)
+            for jpeg, width, height in results:
+                writer.add_jpeg_page(jpeg, width, height, dpi)
+        else:
+            pool = render_pool()
+            try:
+                # map() returns the pages in order, each one is written as soon as it (and the ones before it) are done
+                for jpeg, width, height in pool.map(render_redacted_page, tasks):
+                    writer.add_jpeg_page(jpeg, width, height, dpi)
+            except BrokenProcessPool:
+                discard_render_pool(pool)
+                raise
+    finally:
+        writer.close()
+    return out_path
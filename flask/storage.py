@@ -0,0 +1,202 @@
+"""
+Work directories for uploads and their temp files, and a janitor that keeps them bounded.
+
+Every /run gets its own job id, the PDF is stored in uploads/<job>/ and everything produced
+from it (predictions, offset index, masked PDF, profiles) in temp/<job>/. Two uploads with
+the same filename no longer overwrite each other, and a job can be removed as a whole.
+
+The request body as a whole is limited by MAX_CONTENT_LENGTH in the Flask config, which
+werkzeug enforces while it reads the body, announced or chunked, and it has already spooled the
+file to a temp file (or memory, when small) by the time /run sees it. save_upload copies that
+into the job folder in fixed-size chunks and checks the file itself against MAX_UPLOAD_BYTES,
+since MAX_CONTENT_LENGTH leaves room for the multipart overhead.
+
+The janitor is a daemon thread that every JANITOR_INTERVAL seconds removes jobs older than
+MAX_JOB_AGE and then, while uploads/ and temp/ together use more than DISK_QUOTA_BYTES, the
+oldest remaining jobs. Jobs that are still running, or younger than MIN_JOB_AGE, are never
+removed. Files directly in uploads/ (the sample PDFs) are not jobs and are left alone.
+Caches derived from the uploads (chunk_cache.ChunkCache) are given the same MAX_JOB_AGE.
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+DISK_QUOTA_BYTES = int(os.environ.get("DISK_QUOTA_MB", "2048")) * 1024 * 1024
+MAX_JOB_AGE = float(os.environ.get("MAX_JOB_AGE_HOURS", "24")) * 3600
+JANITOR_INTERVAL = float(os.environ.get("JANITOR_INTERVAL", "300"))
+# Jobs are never evicted before this age, not even over the quota. The set of running jobs is per
+# process, and with several server workers another process may still be using a young job
+MIN_JOB_AGE = float(os.environ.get("MIN_JOB_AGE_MINUTES", "15")) * 60
+COPY_BUFFER = 1024 * 1024
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadTooLargeError(Exception):
+    """The upload is larger than the allowed size."""
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def is_job_id(value):
+    """Job ids come back from the browser, only accept ones that cannot point outside the folders."""
+    return bool(value) and JOB_ID.match(value) is not None
+
+
+def job_folder(root, job_id):
+    """uploads/<job> or temp/<job>, created if needed."""
+    if not is_job_id(job_id):
+        raise ValueError(f"Invalid job id '{job_id}'")
+    path = os.path.join(root, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_upload(file_storage, path, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Copies an uploaded file (already spooled by werkzeug) to path in chunks. Removes the partial
+    file and raises UploadTooLargeError if it is larger than max_bytes. Returns the number of bytes written.
+    """
+    written = 0
+    try:
+        with open(path, "wb") as out:
+            while True:
+                chunk = file_storage.stream.read(COPY_BUFFER)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLargeError(f"Upload is larger than {max_bytes // (1024 * 1024)} MB")
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return written
+
+
+def folder_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass  # Removed while we were walking
+    return total
+
+
+class Janitor:
+    """Removes old jobs and keeps the job folders under a disk quota. Thread-safe."""
+
+    def __init__(self, roots, quota_bytes=DISK_QUOTA_BYTES, max_age=MAX_JOB_AGE,
+                 interval=JANITOR_INTERVAL, min_age=MIN_JOB_AGE, caches=(), log=print):
+        self.roots = roots
+        # Anything with expire(max_age) -> (removed, bytes freed)
+        self.caches = list(caches)
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.interval = interval
+        self.log = log
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # --- Jobs in use ---
+
+    def begin(self, job_id):
+        with self.lock:
+            self.active.add(job_id)
+
+    def end(self, job_id):
+        with self.lock:
+            self.active.discard(job_id)
+
+    def touch(self, job_id):
+        """Marks a job as recently used (e.g. on /export), so it is evicted last."""
+        now = time.time()
+        for root in self.roots:
+            path = os.path.join(root, job_id)
+            if os.path.isdir(path):
+                os.utime(path, (now, now))
+
+    # --- Eviction ---
+
+    def jobs(self):
+        """{job_id: (last_modified, size_bytes)} over all roots."""
+        jobs = {}
+        for root in self.roots:
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if not is_job_id(name) or not os.path.isdir(path):
+                    continue
+                modified, size = jobs.get(name, (0.0, 0))
+                jobs[name] = (max(modified, os.path.getmtime(path)), size + folder_size(path))
+        return jobs
+
+    def remove(self, job_id):
+        for root in self.roots:
+            shutil.rmtree(os.path.join(root, job_id), ignore_errors=True)
+
+    def clean(self):
+        """One eviction pass. Returns (removed jobs, bytes freed)."""
+        now = time.time()
+        jobs = self.jobs()
+        with self.lock:
+            candidates = sorted((modified, job_id) for job_id, (modified, _) in jobs.items()
+                                if job_id not in self.active)
+        total = sum(size for _, size in jobs.values())
+
+        removed = 0
+        freed = 0
+        for modified, job_id in candidates:
+            age = now - modified
+            if age < self.min_age or (age <= self.max_age and total <= self.quota_bytes):
+                break  # Oldest first, so the rest is younger
+            with self.lock:
+                if job_id in self.active:
+                    continue
+            size = jobs[job_id][1]
+            self.remove(job_id)
+            total -= size
+            freed += size
+            removed += 1
+
+        if removed and self.log:
+            self.log(f"Janitor: removed {removed} jobs, freed {freed / (1024 * 1024):.1f} MB, "
+                     f"{total / (1024 * 1024):.1f} MB in use")
+
+        for cache in self.caches:
+            expired, expired_bytes = cache.expire(self.max_age)
+            if expired and self.log:
+                self.log(f"Janitor: removed {expired} cache entries older than {self.max_age / 3600:g}h, "
+                         f"freed {expired_bytes / (1024 * 1024):.1f} MB")
+        return removed, freed
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.clean()
+            except Exception as e:
+                if self.log:
+                    self.log(f"WARNING: Janitor failed: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="janitor", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
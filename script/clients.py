@@ -0,0 +1,112 @@
+"""
+Shared HTTP client factory for all model backends (OpenAI and Ollama, sync and async).
+
+The default clients open connections with default pool sizes and long timeouts. When chunk calls
+are fanned out in parallel, connection setup (TCP + TLS) becomes a bottleneck, so every backend
+gets its client from here instead:
+
+    - a connection pool sized for the number of parallel calls, with keep-alive
+    - explicit connect/read/write/pool timeouts
+    - HTTP/2 when the h2 package is installed (pip install "httpx[http2]")
+    - max_retries=0 on the OpenAI client, retries are done by scheduler.py
+
+Clients are cached per configuration, so everything in one process shares the same pool.
+The settings can be overridden with environment variables (LLM_MAX_CONNECTIONS etc.).
+"""
+
+import os
+
+MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", 16))
+KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 120))
+HTTP2 = os.environ.get("LLM_HTTP2", "1") != "0"
+
+_clients = {}
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def http_settings(max_connections=None, max_keepalive=None, read_timeout=None):
+    """The httpx keyword arguments shared by all clients."""
+    import httpx
+
+    max_connections = max_connections or MAX_CONNECTIONS
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(max_keepalive or MAX_KEEPALIVE, max_connections),
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(read_timeout or READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=READ_TIMEOUT),
+        "http2": HTTP2 and http2_available()
+    }
+
+
+def _cached(key, factory):
+    if key not in _clients:
+        _clients[key] = factory()
+    return _clients[key]
+
+
+def openai_client(base_url=None, max_connections=None, read_timeout=None):
+    """Pooled synchronous OpenAI client. base_url defaults to OPENAI_BASE_URL / the real API."""
+    def factory():
+        import httpx
+        from openai import OpenAI
+        settings = http_settings(max_connections, read_timeout=read_timeout)
+        return OpenAI(
+            base_url=base_url,
+            max_retries=0,
+            timeout=settings["timeout"],
+            http_client=httpx.Client(**settings)
+        )
+    return _cached(("openai", base_url, max_connections, read_timeout), factory)
+
+
+def async_openai_client(base_url=None, max_connections=None, read_timeout=None):
+    """Pooled asyncio OpenAI client. Must be used from a single event loop."""
+    def factory():
+        import httpx
+        from openai import AsyncOpenAI
+        settings = http_settings(max_connections, read_timeout=read_timeout)
+        return AsyncOpenAI(
+            base_url=base_url,
+            max_retries=0,
+            timeout=settings["timeout"],
+            http_client=httpx.AsyncClient(**settings)
+        )
+    return _cached(("async_openai", base_url, max_connections, read_timeout), factory)
+
+
+def ollama_client(host=None, max_connections=None, read_timeout=None):
+    """Pooled synchronous Ollama client. host defaults to OLLAMA_HOST / localhost:11434."""
+    def factory():
+        import ollama
+        return ollama.Client(host=host, **http_settings(max_connections, read_timeout=read_timeout))
+    return _cached(("ollama", host, max_connections, read_timeout), factory)
+
+
+def async_ollama_client(host=None, max_connections=None, read_timeout=None):
+    """Pooled asyncio Ollama client."""
+    def factory():
+        import ollama
+        return ollama.AsyncClient(host=host, **http_settings(max_connections, read_timeout=read_timeout))
+    return _cached(("async_ollama", host, max_connections, read_timeout), factory)
+
+
+def close_all():
+    """Closes the synchronous clients (async clients are closed by their event loop)."""
+    for key, client in list(_clients.items()):
+        if not key[0].startswith("async"):
+            close = getattr(client, "close", None) or getattr(getattr(client, "_client", None), "close", None)
+            if close:
+                close()
+        del _clients[key]
@@ -0,0 +1,250 @@
+"""
+Columnar storage for gold data and predictions (.cols files).
+
+The JSON files repeat the whole document text for every run and store every entity as a dict
+with the label spelled out and its text copied. A .cols file stores each text once, in one
+UTF-8 blob, and the entities as three flat arrays: start (uint32), end (uint32) and a label code
+(uint8, an index into the label list in the header). Evaluation only needs the arrays, so
+ColumnarFile maps the file with mmap and reads them through memoryviews without copying or
+decoding any text.
+
+Everything in the JSON that is not id/text/entity start, end and label (e.g. "language", gold
+entity ids, an entity text that is not text[start:end]) is kept in a small JSON "meta" string
+per document, so converting back gives the same JSON.
+
+File format (little endian, every section starts at a multiple of 8):
+    magic b"PIIC", uint32 version, uint32 doc count, uint32 entity count
+    uint64 x 2 x SECTIONS: offset and length of every section
+    header        JSON: {"entities_key": "gold_entities" | "predicted_entities", "labels": [...]}
+    text_offsets  uint64 x (docs + 1), byte offsets into text
+    id_offsets    uint64 x (docs + 1), byte offsets into ids
+    meta_offsets  uint64 x (docs + 1), byte offsets into meta
+    entity_index  uint64 x (docs + 1), the entities of doc i are entity_index[i]:entity_index[i + 1]
+    start, end    uint32 x entities
+    label         uint8 x entities
+    text, ids, meta  UTF-8 blobs
+
+    python columnar.py to-cols ../data/gold-sv-200.json gold-sv-200.cols
+    python columnar.py to-json gold-sv-200.cols gold-sv-200.json
+"""
+
+import array
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b"PIIC"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+SECTIONS = ("header", "text_offsets", "id_offsets", "meta_offsets", "entity_index", "start", "end", "label", "text", "ids", "meta")
+TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+TYPECODES = {"text_offsets": "Q", "id_offsets": "Q", "meta_offsets": "Q", "entity_index": "Q", "start": "I", "end": "I", "label": "B"}
+ENTITY_KEYS = ("gold_entities", "predicted_entities")
+ENTITY_FIELDS = ["label", "start", "end", "text"]
+
+
+def entities_key(doc):
+    for key in ENTITY_KEYS:
+        if key in doc:
+            return key
+    raise ValueError(f"Document {doc.get('id')} has neither gold_entities nor predicted_entities")
+
+
+def document_keys(meta_keys, key):
+    """The key order of our JSON documents: id, the other fields (language), text, entities."""
+    return ["id"] + meta_keys + ["text", key]
+
+
+def document_meta(doc, key):
+    """Everything in doc that the columns do not hold, as a JSON string ("" when there is nothing)."""
+    meta = {k: v for k, v in doc.items() if k not in ("id", "text", key)}
+    text = doc["text"]
+    extra = []
+    for entity in doc[key]:
+        fields = {k: v for k, v in entity.items() if k not in ("start", "end", "label", "text")}
+        # The entity text is only stored when it is not just the slice of the document text
+        if entity.get("text") != text[entity["start"]:entity["end"]]:
+            fields["text"] = entity.get("text")
+        extra.append(fields)
+    # Key order, only stored when it is not the one our files use, so the JSON comes back the same
+    order = list(doc.keys())
+    if order != document_keys(list(meta), key):
+        meta["_keys"] = order
+    if any(extra):
+        meta["_entities"] = extra
+    if doc[key] and list(doc[key][0].keys()) != ENTITY_FIELDS:
+        meta["_entity_keys"] = list(doc[key][0].keys())
+    return json.dumps(meta, ensure_ascii=False) if meta else ""
+
+
+def write_columnar(documents, path):
+    """Writes JSON-style documents (dicts with id, text and gold_entities or predicted_entities) to a .cols file."""
+    documents = list(documents)
+    key = entities_key(documents[0]) if documents else "predicted_entities"
+    labels = []
+    label_codes = {}
+    columns = {name: array.array(typecode) for name, typecode in TYPECODES.items()}
+    blobs = {"text": bytearray(), "ids": bytearray(), "meta": bytearray()}
+    for name in ("text_offsets", "id_offsets", "meta_offsets", "entity_index"):
+        columns[name].append(0)
+
+    for doc in documents:
+        for entity in doc[key]:
+            label = entity.get("label")
+            if label not in label_codes:
+                if len(labels) == 256:
+                    raise ValueError("More than 256 labels")
+                label_codes[label] = len(labels)
+                labels.append(label)
+            columns["start"].append(entity["start"])
+            columns["end"].append(entity["end"])
+            columns["label"].append(label_codes[label])
+        blobs["text"] += doc["text"].encode("utf-8")
+        blobs["ids"] += str(doc["id"]).encode("utf-8")
+        blobs["meta"] += document_meta(doc, key).encode("utf-8")
+        columns["text_offsets"].append(len(blobs["text"]))
+        columns["id_offsets"].append(len(blobs["ids"]))
+        columns["meta_offsets"].append(len(blobs["meta"]))
+        columns["entity_index"].append(len(columns["start"]))
+
+    sections = {"header": json.dumps({"entities_key": key, "labels": labels}, ensure_ascii=False).encode("utf-8")}
+    for name, column in columns.items():
+        if sys.byteorder != "little":
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        sections[name] = column.tobytes()
+    sections.update(blobs)
+
+    position = HEADER.size + TABLE.size
+    table = []
+    for name in SECTIONS:
+        position += -position % 8
+        table.extend((position, len(sections[name])))
+        position += len(sections[name])
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(documents), len(columns["start"])))
+        f.write(TABLE.pack(*table))
+        for name in SECTIONS:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(sections[name])
+
+
+class ColumnarFile:
+    """A .cols file mapped into memory. The columns are memoryviews on the mapping, nothing is read up front."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        magic, version, self.doc_count, self.entity_count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a columnar file (version {VERSION})")
+        table = TABLE.unpack_from(view, HEADER.size)
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = table[2 * i], table[2 * i + 1]
+            section = view[offset:offset + length]
+            if name in TYPECODES:
+                if sys.byteorder == "little":
+                    section = section.cast(TYPECODES[name])
+                else:
+                    # Big endian machines get a swapped copy
+                    column = array.array(TYPECODES[name], section.tobytes())
+                    column.byteswap()
+                    section = column
+            self.sections[name] = section
+        header = json.loads(bytes(self.sections["header"]))
+        self.entities_key = header["entities_key"]
+        self.labels = header["labels"]
+
+    def __len__(self):
+        return self.doc_count
+
+    def close(self):
+        """
+        Unmaps the file. The columns are released first: a document_spans() generator that is still
+        alive (e.g. when the evaluation failed) holds them, and mmap.close() raises BufferError
+        while there are views on the mapping.
+        """
+        for section in self.sections.values():
+            if isinstance(section, memoryview):
+                section.release()
+        self.sections = {}
+        try:
+            self.map.close()
+        except BufferError:
+            # Something else still has a view, the mapping is freed with it
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _blob(self, name, offsets, i):
+        offsets = self.sections[offsets]
+        return bytes(self.sections[name][offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def doc_id(self, i):
+        return self._blob("ids", "id_offsets", i)
+
+    def text(self, i):
+        return self._blob("text", "text_offsets", i)
+
+    def doc_ids(self):
+        return [self.doc_id(i) for i in range(self.doc_count)]
+
+    def document_spans(self):
+        """(doc_id, {(start, end, label), ...}) per document, straight from the columns. Texts are not read."""
+        index = self.sections["entity_index"]
+        starts, ends, codes = self.sections["start"], self.sections["end"], self.sections["label"]
+        labels = self.labels
+        for i in range(self.doc_count):
+            yield self.doc_id(i), {(starts[j], ends[j], labels[codes[j]]) for j in range(index[i], index[i + 1])}
+
+    def document(self, i):
+        """Document i as the JSON dict it was converted from."""
+        text = self.text(i)
+        meta_text = self._blob("meta", "meta_offsets", i)
+        meta = json.loads(meta_text) if meta_text else {}
+        extra = meta.pop("_entities", None)
+        entity_keys = meta.pop("_entity_keys", ENTITY_FIELDS)
+        keys = meta.pop("_keys", None) or document_keys(list(meta), self.entities_key)
+        index = self.sections["entity_index"]
+        entities = []
+        for n, j in enumerate(range(index[i], index[i + 1])):
+            start, end = self.sections["start"][j], self.sections["end"][j]
+            fields = {"label": self.labels[self.sections["label"][j]], "start": start, "end": end, "text": text[start:end]}
+            if extra:
+                fields.update(extra[n])
+            entities.append({k: fields[k] for k in entity_keys if k in fields})
+        fields = {**meta, "id": self.doc_id(i), "text": text, self.entities_key: entities}
+        return {k: fields[k] for k in keys}
+
+    def documents(self):
+        for i in range(self.doc_count):
+            yield self.document(i)
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-cols", "to-json"):
+        print("Usage: python columnar.py to-cols <file.json> <file.cols>\n       python columnar.py to-json <file.cols> <file.json>")
+        sys.exit(1)
+    command, source, target = sys.argv[1:]
+    if command == "to-cols":
+        with open(source, "r", encoding="utf-8") as f:
+            write_columnar(json.load(f), target)
+    else:
+        with ColumnarFile(source) as data:
+            documents = list(data.documents())
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump(documents, f, ensure_ascii=False, indent=2)
+    print(f"Saved {target}")
+
+
+if __name__ == "__main__":
+    main()
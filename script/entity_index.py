@@ -0,0 +1,102 @@
+"""
+Finding the predicted entity strings in the text, shared by get_predictions.py and
+get_predictions_openai.py (and the benchmarks in ../benchmark).
+"""
+
+def index_finder(text, entity_texts):
+	"""
+	Takes the text and a list of entity substrings as input. 
+	For each entity, finds the start and end index in the text. 
+	Ensures no overlaps if there are identical entities ("Mia gillar att heta Mia.").
+	Returns a list of dictionaries: {"text": ..., "start"..., "end"...,}
+	"""
+	found_entities = []
+	occupied_indices = set()
+
+	# Sort the list by length (descending) to prioritize longest entities first
+	unique_entities = sorted(list(set(entity_texts)), key=len, reverse=True)
+
+	for entity_text in unique_entities:
+		search_start = 0
+		while True:
+			start_index = text.find(entity_text, search_start) # Finds first occurrence of entity_text after search_start
+
+			if start_index == -1:
+				break # No more occurrences found
+
+			else:
+				end_index = start_index + len(entity_text)
+
+				is_occupied = any(i in occupied_indices for i in range(start_index, end_index))
+
+				if is_occupied: # Index already occupied (found), move search cursor forward one step
+					search_start += 1
+					continue
+				else:
+					found_entities.append({
+						"text": entity_text,
+						"start": start_index,
+						"end": end_index
+					})
+					
+				# Mark these positions as occupied
+				for i in range(start_index, end_index):
+					occupied_indices.add(i)
+
+				# Move search cursor forward
+				search_start = end_index
+	
+	# Sort the list by start_index for a consistent order
+	found_entities.sort(key=lambda x: x['start'])
+
+	return found_entities
+
+def build_json(predictions, indexed_entities):
+	"""
+    Takes:
+        predictions = [(label_id, entity_text), ...]
+        indexed_entities = [ {"text": ..., "start": ..., "end": ...}, ...]
+
+    Returns:
+        A list of JSON dictionaries matching the gold format:
+		[{'label': 'NAME', 'start': 23, 'end': 27, 'text': 'Elin Rask'}, {'label': 'PHONE', 'start': 12, 'end': 48, 'text': '0722 33 44 55'}]
+    """
+
+	label_map = {
+        '1': 'NAME',
+        '2': 'PHONE',
+        '3': 'ADDRESS',
+        '4': 'NATIONAL_ID',
+		'5': 'EMAIL'
+    }
+
+	final_entities = []
+ 
+	index_lookup = {}
+	for item in indexed_entities:
+		text = item["text"]
+		index_lookup.setdefault(text, []).append(item)
+
+ 
+	for label_id, entity_text in predictions:
+		index_list = index_lookup.get(entity_text)
+
+		if not index_list or len(index_list) == 0:
+			print(f"WARNING: No remaining index match for entity '{entity_text}'")
+			continue
+
+		index_info = index_list.pop(0)
+
+		# Convert label_id -> label string
+		label_str = label_map.get(label_id, "Unknown")
+
+		entity_obj = {
+			"label": label_str,
+			"start": index_info["start"],
+			"end": index_info["end"],
+			"text": entity_text
+		}
+
+		final_entities.append(entity_obj)
+	
+	return final_entities
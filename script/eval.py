@@ -1,6 +1,8 @@
-import json
 import csv
 import sys
+from contextlib import ExitStack, closing
+from columnar import ColumnarFile
+from json_stream import iter_documents
 
 """
 This script computes two different evaluations. 
@@ -33,126 +35,6 @@ In this scenario, there are:
     - 1 false negative ((30, 40))
 
 """
-# Define gold and prediction files and run_id in terminal
-if len(sys.argv) < 4:
-    print("Usage: python eval.py <run_id> <gold-file> <prediction-file>")
-    sys.exit(1)
-
-run_id = sys.argv[1]
-gold_file = sys.argv[2]
-pred_file = sys.argv[3]
-
-# Read gold file
-with open (gold_file, "r", encoding="utf-8") as f:
-    gold_data = json.load(f)
-
-# Read prediction file
-with open(pred_file, "r", encoding="utf-8") as f:
-    pred_data = json.load(f)
-
-# Save all spans in sets for easy comparison later through set operations
-gold_spans = set()
-pred_spans = set()
-
-# Iterate over all docs to extract all index spans. Add doc ids to avoid collisions if several docs contain the same spans.
-for doc in gold_data:
-    doc_id = doc["id"]
-    for entity in doc["gold_entities"]:
-        gold_spans.add((doc_id, entity["start"], entity["end"]))
-
-
-# Exactly the same for prediction data
-for doc in pred_data:
-    doc_id = doc["id"]
-    for entity in doc["predicted_entities"]:
-        pred_spans.add((doc_id, entity["start"], entity["end"]))
-
-# Sets look like: {('sv-02', 190, 215), ('sv-24', 32, 45), ('sv-02', 32, 43), ('sv-14', 11, 21)...}
-
-# Intersection - returns values that are in both sets, i.e. True Positives. 
-tp = len(gold_spans & pred_spans)
-
-# Difference - returns values that are in predicted set but not in gold, i.e. False Positives.
-fp = len(pred_spans - gold_spans)
-
-# Difference - returns values that are in gold set but not predicted set, i.e. False Negatives.
-fn = len(gold_spans - pred_spans)
-
-# Else clause is to avoid division by zero
-precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
-recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-
-denominator = precision + recall
-
-f1 = 2 * ((precision * recall) / denominator) if denominator > 0 else 0.0
-
-"""
-2. Standard NER evaluation
-
-The logic is exactly the same as part one except that here, the predicted label is also taken into account. 
-
-True positive = the model predicts an index span + label that matches the gold exactly
-False positive = the model predicts a span + label that are not present in gold
-False negative = a gold span + label that the model missed
-
-"""
-
-gold_spans_std = set()
-pred_spans_std = set()
-
-for doc in gold_data:
-    doc_id = doc["id"]
-    for entity in doc["gold_entities"]:
-        gold_spans_std.add((doc_id, entity["start"], entity["end"], entity["label"]))
-
-for doc in pred_data:
-    doc_id = doc["id"]
-    for entity in doc["predicted_entities"]:
-        pred_spans_std.add((doc_id, entity["start"], entity["end"], entity["label"]))
-
-
-tp_std = len(gold_spans_std & pred_spans_std)
-fp_std = len(pred_spans_std - gold_spans_std)
-fn_std = len(gold_spans_std - pred_spans_std)
-
-precision_std = tp_std / (tp_std + fp_std) if (tp_std + fp_std) > 0 else 0.0
-recall_std = tp_std / (tp_std + fn_std) if (tp_std + fn_std) > 0 else 0.0
-
-denominator = precision_std + recall_std
-f1_std = 2 * ((precision_std * recall_std) / denominator) if denominator > 0 else 0.0
-
-"""
-Compute f1 for each label
-
-True positives = correct predictions for this label
-False positives = predictions with this label that are wrong
-False negatives = gold entities of this label that the model missed
-
-"""
-
-
-# Initialize empty dictionaries for each label as a counter
-labels = ["NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"]
-
-tp_label = {label: 0 for label in labels}
-fp_label = {label: 0 for label in labels}
-fn_label = {label: 0 for label in labels}
-
-# Count TP for each label
-for item in gold_spans_std & pred_spans_std: # Only spans that match exactly
-    label = item[3] # The fourth element of the tuple is the label
-    tp_label[label] += 1
-
-# Count FP for each label
-for item in pred_spans_std - gold_spans_std: # Predicted but wrong
-    label = item[3]
-    fp_label[label] += 1
-
-# Count FN for each label
-for item in gold_spans_std - pred_spans_std: # Missed spans/labels
-    label = item[3]
-    fn_label[label] += 1
-
 
 # Function to compute f1 for a single label
 def f1_for_label(tp, fp, fn):
@@ -175,66 +57,223 @@ def f1_for_label(tp, fp, fn):
         f1 = 2 * (precision * recall) / (precision + recall)
         return f1
 
-# Call the function for each label to get a f1 score for each
-NAME_f1 = f1_for_label(tp_label["NAME"], fp_label["NAME"], fn_label["NAME"])
-PHONE_f1 = f1_for_label(tp_label["PHONE"], fp_label["PHONE"], fn_label["PHONE"])
-ADDRESS_f1 = f1_for_label(tp_label["ADDRESS"], fp_label["ADDRESS"], fn_label["ADDRESS"])
-NATIONAL_ID_f1 = f1_for_label(tp_label["NATIONAL_ID"], fp_label["NATIONAL_ID"], fn_label["NATIONAL_ID"])
-EMAIL_f1 = f1_for_label(tp_label["EMAIL"], fp_label["EMAIL"], fn_label["EMAIL"])
-
-# Finally - save everything to a CSV file
-
-# Define the header
-columns = [
-    "run_id",
-    "eval_type",
-    "precision",
-    "recall",
-    "f1",
-    "tp",
-    "fp",
-    "fn",
-    "NAME_f1",
-    "PHONE_f1",
-    "ADDRESS_f1",
-    "NATIONAL_ID_f1",
-    "EMAIL_f1"
-]
-
-# Two rows will be produced - one for the span only evaluation and one for the standard evaluation
-
-span_only_row = [
-    run_id,
-    "span-only",
-    precision,
-    recall,
-    f1,
-    tp,
-    fp,
-    fn
-]
-
-standard_row = [
-    run_id,
-    "standard",
-    precision_std,
-    recall_std,
-    f1_std,
-    tp_std,
-    fp_std,
-    fn_std,
-    NAME_f1,
-    PHONE_f1,
-    ADDRESS_f1,
-    NATIONAL_ID_f1,
-    EMAIL_f1
-]
-
-rows = [span_only_row, standard_row]
-
-with open("metrics.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(columns)
-    writer.writerows(rows)
-
-print("Done! Result saved to 'metrics.csv'.")
\ No newline at end of file
+
+def document_spans(data, key):
+    """
+    (doc_id, {(start, end, label), ...}) per document. data is a list or an iterator of documents
+    (see json_stream.iter_documents) or a ColumnarFile, which is read straight from its arrays.
+    """
+    if isinstance(data, ColumnarFile):
+        return data.document_spans()
+    return ((doc["id"], {(entity["start"], entity["end"], entity["label"]) for entity in doc[key]}) for doc in data)
+
+
+def paired_documents(gold_docs, pred_docs):
+    """
+    Reads both files at the same time and yields (doc_id, gold spans, predicted spans) per document.
+    The files are normally in the same order, then only one document per file is in memory. A document
+    that is only in one file so far (e.g. a prediction that failed and was skipped) waits until the same
+    id shows up in the other file, or is compared against an empty set when the files end.
+    """
+    pending = ({}, {})
+    streams = [iter(gold_docs), iter(pred_docs)]
+    while any(streams):
+        for side, stream in enumerate(streams):
+            if stream is None:
+                continue
+            item = next(stream, None)
+            if item is None:
+                streams[side] = None
+                continue
+            doc_id, spans = item
+            other = pending[1 - side]
+            if doc_id in other:
+                pair = (spans, other.pop(doc_id)) if side == 0 else (other.pop(doc_id), spans)
+                yield (doc_id, *pair)
+            else:
+                pending[side].setdefault(doc_id, set()).update(spans)
+    for doc_id, spans in pending[0].items():
+        yield doc_id, spans, set()
+    for doc_id, spans in pending[1].items():
+        yield doc_id, set(), spans
+
+
+def load_documents(path):
+    """A .cols file is memory mapped (see columnar.py), .json and .jsonl files are read one document at a time."""
+    if path.endswith(".cols"):
+        return ColumnarFile(path)
+    return iter_documents(path)
+
+
+def evaluate(gold_data, pred_data, run_id):
+    """
+    Computes both evaluations. Returns the span-only row and the standard row for metrics.csv.
+    The documents are compared one at a time, so the files never have to be in memory at once.
+    """
+    # Initialize empty dictionaries for each label as a counter (see "Compute f1 for each label" below)
+    labels = ["NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"]
+
+    tp_label = {label: 0 for label in labels}
+    fp_label = {label: 0 for label in labels}
+    fn_label = {label: 0 for label in labels}
+
+    tp = fp = fn = 0
+    tp_std = fp_std = fn_std = 0
+
+    for doc_id, gold_spans_std, pred_spans_std in paired_documents(document_spans(gold_data, "gold_entities"),
+                                                                   document_spans(pred_data, "predicted_entities")):
+        # Save all spans of the document in sets for easy comparison through set operations.
+        # Each document is compared on its own, so spans in different docs never collide.
+        gold_spans = {(start, end) for start, end, label in gold_spans_std}
+        pred_spans = {(start, end) for start, end, label in pred_spans_std}
+
+        # Sets look like: {(190, 215), (32, 45), (32, 43), (11, 21)...}
+
+        # Intersection - returns values that are in both sets, i.e. True Positives. 
+        tp += len(gold_spans & pred_spans)
+
+        # Difference - returns values that are in predicted set but not in gold, i.e. False Positives.
+        fp += len(pred_spans - gold_spans)
+
+        # Difference - returns values that are in gold set but not predicted set, i.e. False Negatives.
+        fn += len(gold_spans - pred_spans)
+
+        """
+        2. Standard NER evaluation
+
+        The logic is exactly the same as part one except that here, the predicted label is also taken into account. 
+
+        True positive = the model predicts an index span + label that matches the gold exactly
+        False positive = the model predicts a span + label that are not present in gold
+        False negative = a gold span + label that the model missed
+
+        """
+
+        tp_std += len(gold_spans_std & pred_spans_std)
+        fp_std += len(pred_spans_std - gold_spans_std)
+        fn_std += len(gold_spans_std - pred_spans_std)
+
+        """
+        Compute f1 for each label
+
+        True positives = correct predictions for this label
+        False positives = predictions with this label that are wrong
+        False negatives = gold entities of this label that the model missed
+
+        """
+
+        # Count TP for each label
+        for item in gold_spans_std & pred_spans_std: # Only spans that match exactly
+            label = item[2] # The third element of the tuple is the label
+            tp_label[label] += 1
+
+        # Count FP for each label
+        for item in pred_spans_std - gold_spans_std: # Predicted but wrong
+            label = item[2]
+            fp_label[label] += 1
+
+        # Count FN for each label
+        for item in gold_spans_std - pred_spans_std: # Missed spans/labels
+            label = item[2]
+            fn_label[label] += 1
+
+    # Else clause is to avoid division by zero
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+
+    denominator = precision + recall
+
+    f1 = 2 * ((precision * recall) / denominator) if denominator > 0 else 0.0
+
+    precision_std = tp_std / (tp_std + fp_std) if (tp_std + fp_std) > 0 else 0.0
+    recall_std = tp_std / (tp_std + fn_std) if (tp_std + fn_std) > 0 else 0.0
+
+    denominator = precision_std + recall_std
+    f1_std = 2 * ((precision_std * recall_std) / denominator) if denominator > 0 else 0.0
+
+
+    # Call the function for each label to get a f1 score for each
+    NAME_f1 = f1_for_label(tp_label["NAME"], fp_label["NAME"], fn_label["NAME"])
+    PHONE_f1 = f1_for_label(tp_label["PHONE"], fp_label["PHONE"], fn_label["PHONE"])
+    ADDRESS_f1 = f1_for_label(tp_label["ADDRESS"], fp_label["ADDRESS"], fn_label["ADDRESS"])
+    NATIONAL_ID_f1 = f1_for_label(tp_label["NATIONAL_ID"], fp_label["NATIONAL_ID"], fn_label["NATIONAL_ID"])
+    EMAIL_f1 = f1_for_label(tp_label["EMAIL"], fp_label["EMAIL"], fn_label["EMAIL"])
+
+    # Two rows will be produced - one for the span only evaluation and one for the standard evaluation
+
+    span_only_row = [
+        run_id,
+        "span-only",
+        precision,
+        recall,
+        f1,
+        tp,
+        fp,
+        fn
+    ]
+
+    standard_row = [
+        run_id,
+        "standard",
+        precision_std,
+        recall_std,
+        f1_std,
+        tp_std,
+        fp_std,
+        fn_std,
+        NAME_f1,
+        PHONE_f1,
+        ADDRESS_f1,
+        NATIONAL_ID_f1,
+        EMAIL_f1
+    ]
+
+    return [span_only_row, standard_row]
+
+
+def main():
+    # Define gold and prediction files and run_id in terminal
+    if len(sys.argv) < 4:
+        print("Usage: python eval.py <run_id> <gold-file> <prediction-file>   (.json, .jsonl or .cols)")
+        sys.exit(1)
+
+    run_id = sys.argv[1]
+    gold_file = sys.argv[2]
+    pred_file = sys.argv[3]
+
+    # Gold and prediction files are read while they are evaluated, with progress on stderr.
+    # Both a ColumnarFile and a document generator are closed when the evaluation is done
+    with ExitStack() as stack:
+        gold_data = stack.enter_context(closing(load_documents(gold_file)))
+        pred_data = stack.enter_context(closing(load_documents(pred_file)))
+        rows = evaluate(gold_data, pred_data, run_id)
+
+    # Finally - save everything to a CSV file
+
+    # Define the header
+    columns = [
+        "run_id",
+        "eval_type",
+        "precision",
+        "recall",
+        "f1",
+        "tp",
+        "fp",
+        "fn",
+        "NAME_f1",
+        "PHONE_f1",
+        "ADDRESS_f1",
+        "NATIONAL_ID_f1",
+        "EMAIL_f1"
+    ]
+
+    with open("metrics.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+    print("Done! Result saved to 'metrics.csv'.")
+
+
+if __name__ == "__main__":
+    main()
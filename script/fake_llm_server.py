@@ -0,0 +1,208 @@
+"""
+A local fake model server for testing retries, rate limits and load without calling a real API.
+
+It speaks enough of two protocols for our code:
+    - OpenAI:  POST /v1/chat/completions (normal and stream=True with usage)
+    - Ollama:  POST /api/chat (streamed NDJSON)
+
+The "model" answers in our <label_id><entity_text> format, using simple regexes for emails,
+national IDs and phone numbers, so the whole pipeline produces entities.
+
+Failures can be injected: --error-rate is the share of requests that get a 429 (with Retry-After)
+or a 500, and --latency / --token-delay simulate a slow model.
+
+    python fake_llm_server.py --port 8001 --error-rate 0.2 --latency 0.3
+    export OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATTERNS = [
+    ("5", re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")),
+    ("4", re.compile(r"\b(?:19|20)?\d{6}[-+]?\d{4}\b")),
+    ("2", re.compile(r"\b0\d{1,3}[- ]?\d{2,3}[ ]?\d{2}[ ]?\d{2,3}\b")),
+]
+
+
+def fake_entities(text):
+    """Our line format for everything the regexes find in the text."""
+    lines = []
+    taken = []
+    for label_id, pattern in PATTERNS:
+        for match in pattern.finditer(text):
+            if any(start < match.end() and match.start() < end for start, end in taken):
+                continue
+            taken.append((match.start(), match.end()))
+            lines.append(f"{label_id}{match.group()}")
+    return lines
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set by start_server
+    error_rate = 0.0
+    latency = 0.0
+    token_delay = 0.0
+    retry_after = 1
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, data):
+        """One piece of a chunked (streamed) HTTP/1.1 response."""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path in ("/", "/health"):
+            self.send_json(200, {"status": "ok", **self.stats_snapshot()})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def stats_snapshot(self):
+        with self.stats["lock"]:
+            return {key: value for key, value in self.stats.items() if key != "lock"}
+
+    def count(self, key):
+        with self.stats["lock"]:
+            self.stats[key] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.count("requests")
+
+        # Inject failures before doing any "work"
+        if random.random() < self.error_rate:
+            if random.random() < 0.5:
+                self.count("errors_429")
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                               {"Retry-After": str(self.retry_after)})
+            else:
+                self.count("errors_500")
+                self.send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+
+        time.sleep(self.latency)
+
+        messages = body.get("messages", [])
+        text = messages[-1]["content"] if messages else ""
+        lines = fake_entities(text)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = sum(len(line) for line in lines) // 4 + 1
+
+        if self.path.startswith("/v1/chat/completions"):
+            self.openai_response(body, lines, prompt_tokens, completion_tokens)
+        elif self.path.startswith("/api/chat"):
+            self.ollama_response(body, lines, prompt_tokens, completion_tokens)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def openai_response(self, body, lines, prompt_tokens, completion_tokens):
+        model = body.get("model", "fake")
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+        if not body.get("stream"):
+            self.send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "\n".join(lines)}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, extra=None):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices, **(extra or {})}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        for i, line in enumerate(lines):
+            time.sleep(self.token_delay)
+            content = line + ("\n" if i < len(lines) - 1 else "")
+            event([{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event([], {"usage": usage})
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def ollama_response(self, body, lines, prompt_tokens, completion_tokens):
+        model = body.get("model", "fake")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for i, line in enumerate(lines):
+            time.sleep(self.token_delay)
+            content = line + ("\n" if i < len(lines) - 1 else "")
+            chunk = {"model": model, "message": {"role": "assistant", "content": content}, "done": False}
+            self.write_chunk((json.dumps(chunk) + "\n").encode("utf-8"))
+
+        final = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                 "prompt_eval_count": prompt_tokens, "eval_count": completion_tokens, "load_duration": 0}
+        self.write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+        self.write_chunk(b"")
+
+
+def start_server(port=8001, error_rate=0.0, latency=0.0, token_delay=0.0, retry_after=1, host="127.0.0.1"):
+    """Starts the server in a background thread and returns it. port=0 picks a free port (server.server_port)."""
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "error_rate": error_rate,
+        "latency": latency,
+        "token_delay": token_delay,
+        "retry_after": retry_after,
+        "stats": {"lock": threading.Lock(), "requests": 0, "errors_429": 0, "errors_500": 0}
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI/Ollama compatible server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/500")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the answer starts")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed lines")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After header sent with 429")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.error_rate, args.latency, args.token_delay, args.retry_after)
+    print(f"Fake LLM server on http://127.0.0.1:{server.server_port} (OpenAI: /v1, Ollama: /api/chat)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,7 +1,13 @@
-from openai import OpenAI
 import json
 import sys
 import os
+import itertools
+from metrics import Metrics
+from json_stream import iter_documents, DocumentWriter
+from scheduler import CallScheduler, estimate_tokens
+from clients import openai_client
+from entity_index import index_finder, build_json
+from llm_request import build_messages, chat_openai, prefix_fingerprint, CacheReport, format_call_stats
 
 """ 
 How to set the API key:
@@ -21,12 +27,17 @@ How to set the API key:
 
 """
 
-client = OpenAI()
+# Pooled keep-alive client, retries are handled by the scheduler
+client = openai_client()
 
 INPUT_FILE = sys.argv[1]
 OUTPUT_FILE = sys.argv[2]
 
 LABEL_IDS = {"1", "2", "3", "4", "5"}
+MODEL_NAME = "gpt-4.1"
+# Keep these a bit under the limits of the API key's usage tier
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
 
 
 SYSTEM_PROMPT = """
@@ -58,15 +69,37 @@ Rules:
 - If no entities are found, output an empty string.
 """
 
+# Fixed instruction placed before the document text. Together with SYSTEM_PROMPT it forms the
+# static prefix that can be reused from the prompt cache, so it must not contain anything that varies.
+USER_INSTRUCTION = "Extract all entities from the following text and respond only with the requested entity string:"
+
+# Collects cache hits and time-to-first-token for all model calls in the run
+cache_report = CacheReport()
+
+# Latency, tokens and cost per call and document, exported next to metrics.csv when the run is done
+metrics = Metrics()
+
+# Rate limits, retries with backoff and a circuit breaker for all model calls
+scheduler = CallScheduler(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+
 def load_data(filename):
-	"""Read data from a JSON file"""
+	"""Read documents from a JSON, JSONL or .cols file, one at a time. The file is checked before the output is opened"""
 	if not os.path.exists(filename):
 		print(f'ERROR: File "{filename}" could not be found.')
 		sys.exit(1) # Interrupt the script
-	
+
+	docs = read_documents(filename)
+	# The documents are only read in the main loop, so the first one is read here: a file that
+	# cannot be parsed stops the script before an empty output file has been created
+	first = next(docs, None)
+	return docs if first is None else itertools.chain([first], docs)
+
+
+def read_documents(filename):
+	"""Yield the documents of filename, exit with an error message if it cannot be read"""
 	try:
-		with open(filename, "r", encoding="utf-8") as f:
-			return json.load(f)
+		# Only the current document is in memory, the progress is printed to stderr
+		yield from iter_documents(filename)
 	
 	except json.JSONDecodeError:
 		print(f'ERROR: JSON could not be decoded from "{filename}"')
@@ -78,38 +111,50 @@ def load_data(filename):
 		sys.exit(1)
 
 
-def save_data(filename, data):
-	"""Save data to a JSON file"""
+def open_output(filename):
+	"""Open the output file, the documents are appended one at a time (JSON array, or JSONL for a .jsonl name)"""
 	try:
-		with open(filename, "w", encoding="utf-8") as f:
-			json.dump(data, f, ensure_ascii=False, indent=2)
+		return DocumentWriter(filename)
 	
 	except IOError as e:
 		print(f'ERROR: Could not write to file "{filename}". Error: {e}')
+		sys.exit(1)
+
+
+def save_data(output, doc):
+	"""Append one document to the output file"""
+	try:
+		output.write(doc)
+	
+	except IOError as e:
+		print(f'ERROR: Could not write to file "{output.path}". Error: {e}')
 	
 	except Exception as e:
 		print(f'ERROR: An unexpected error occurred: {e}')
 
 
-def prompt_model(text):
+def prompt_model(text, doc_id=None):
 	"""Prompts the LLM for one document and returns a list of tuples with label id and entity."""
 
-	user_prompt = f"Extract all entities from the following text and respond only with the requested entity string:\n\n{text}"
-
 	try:
-		response = client.chat.completions.create(
-			model="gpt-4.1",
-			messages=[
-				{"role": "system", "content": SYSTEM_PROMPT},
-				{"role": "user", "content": user_prompt}
-			],
-			temperature=0.1,
+		raw_response, stats = scheduler.call(
+			lambda: chat_openai(
+				client,
+				MODEL_NAME,
+				build_messages(SYSTEM_PROMPT, USER_INSTRUCTION, text),
+				temperature=0.1
+			),
+			estimated_tokens=estimate_tokens(text),
+			used_tokens=lambda result: result[1]["prompt_tokens"] + result[1]["completion_tokens"]
 		)
 
-		raw_response = response.choices[0].message.content
+		cache_report.add(stats)
+		metrics.record_call(MODEL_NAME, stats, doc_id)
+		print(f"Model call: {format_call_stats(stats)}")
 
 	except Exception as e:
 		print(f"ERROR: Model call failed: {e}")
+		metrics.record_error(MODEL_NAME, doc_id)
 		return None
 
 	lines = raw_response.splitlines()
@@ -133,109 +178,25 @@ def prompt_model(text):
 	return entities
 
 
-def index_finder(text, entity_texts):
-	"""
-	Takes the text and a list of entity substrings as input. 
-	For each entity, finds the start and end index in the text. 
-	Ensures no overlaps if there are identical entities ("Mia gillar att heta Mia.").
-	Returns a list of dictionaries: {"text": ..., "start"..., "end"...,}
-	"""
-	found_entities = []
-	occupied_indices = set()
-
-	# Sort the list by length (descending) to prioritize longest entities first
-	unique_entities = sorted(list(set(entity_texts)), key=len, reverse=True)
-
-	for entity_text in unique_entities:
-		search_start = 0
-		while True:
-			start_index = text.find(entity_text, search_start) # Finds first occurrence of entity_text after search_start
-
-			if start_index == -1:
-				break # No more occurrences found
-
-			else:
-				end_index = start_index + len(entity_text)
-
-				is_occupied = any(i in occupied_indices for i in range(start_index, end_index))
-
-				if is_occupied: # Index already occupied (found), move search cursor forward one step
-					search_start += 1
-					continue
-				else:
-					found_entities.append({
-						"text": entity_text,
-						"start": start_index,
-						"end": end_index
-					})
-					
-				# Mark these positions as occupied
-				for i in range(start_index, end_index):
-					occupied_indices.add(i)
-
-				# Move search cursor forward
-				search_start = end_index
-	
-	# Sort the list by start_index for a consistent order
-	found_entities.sort(key=lambda x: x['start'])
-
-	return found_entities
-
-def build_json(predictions, indexed_entities):
-	"""
-    Takes:
-        predictions = [(label_id, entity_text), ...]
-        indexed_entities = [ {"text": ..., "start": ..., "end": ...}, ...]
-
-    Returns:
-        A list of JSON dictionaries matching the gold format:
-		[{'label': 'NAME', 'start': 23, 'end': 27, 'text': 'Elin Rask'}, {'label': 'PHONE', 'start': 12, 'end': 48, 'text': '0722 33 44 55'}]
-    """
-
-	label_map = {
-        '1': 'NAME',
-        '2': 'PHONE',
-        '3': 'ADDRESS',
-        '4': 'NATIONAL_ID',
-		'5': 'EMAIL'
-    }
-
-	final_entities = []
- 
-	index_lookup = {}
-	for item in indexed_entities:
-		text = item["text"]
-		index_lookup.setdefault(text, []).append(item)
-
- 
-	for label_id, entity_text in predictions:
-		index_list = index_lookup.get(entity_text)
-
-		if not index_list or len(index_list) == 0:
-			print(f"WARNING: No remaining index match for entity '{entity_text}'")
-			continue
-
-		index_info = index_list.pop(0)
-
-		# Convert label_id -> label string
-		label_str = label_map.get(label_id, "Unknown")
-
-		entity_obj = {
-			"label": label_str,
-			"start": index_info["start"],
-			"end": index_info["end"],
-			"text": entity_text
-		}
+def save_metrics():
+	"""Exports call metrics as JSON and CSV in the same folder as the predictions (and metrics.csv)"""
+	folder = os.path.dirname(os.path.abspath(OUTPUT_FILE))
+	try:
+		metrics.export_json(os.path.join(folder, "call_metrics.json"))
+		metrics.export_csv(os.path.join(folder, "call_metrics.csv"))
+		print(f"Call metrics saved to {folder}")
 
-		final_entities.append(entity_obj)
-	
-	return final_entities
+	except IOError as e:
+		print(f'ERROR: Could not write call metrics to "{folder}". Error: {e}')
 
 # A main loop that processes all documents and saves the results to a file
 def main():
 	docs = load_data(INPUT_FILE)
 
-	output_docs = []
+	print(f"Prompt prefix: {prefix_fingerprint(SYSTEM_PROMPT, USER_INSTRUCTION)}")
+
+	output = open_output(OUTPUT_FILE)
+	failed_docs = []
 
 	for doc in docs:
 		text = doc.get("text", "")
@@ -244,19 +205,22 @@ def main():
 		print(f"Processing document: {doc_id}")
 
 		# Call the model
-		predictions = prompt_model(text)
+		predictions = prompt_model(text, doc_id)
 		if predictions is None:
 			print(f"ERROR: Model failed to process document {doc_id}. Skipping.")
+			failed_docs.append(doc_id)
 			continue
 
 		# Extract only the text part for index finder
 		entity_texts = [entity_text for (_, entity_text) in predictions]
 
 		# Pass text values to index finder
-		indexed = index_finder(text, entity_texts)
+		with metrics.stage("index_finder", doc_id):
+			indexed = index_finder(text, entity_texts)
 
 		# Build JSON entity objects
-		predicted_entities = build_json(predictions, indexed)
+		with metrics.stage("build_json", doc_id):
+			predicted_entities = build_json(predictions, indexed)
 
 		# Construct final document object
 		output_doc = {
@@ -266,11 +230,17 @@ def main():
 			"predicted_entities": predicted_entities
 		}
 
-		output_docs.append(output_doc)
+		# Save the document to file, earlier documents are already written
+		with metrics.stage("save_json", doc_id):
+			save_data(output, output_doc)
 
-		# Save everything to file
-		save_data(OUTPUT_FILE, output_docs)
+		print(f"Totals for {doc_id}: {metrics.document_summary(doc_id)}")
 
+	output.close()
+	print(cache_report.summary())
+	if failed_docs:
+		print(f"WARNING: {len(failed_docs)} documents failed after {scheduler.retries} retries and are missing from the output: {', '.join(failed_docs)}")
+	save_metrics()
 	print(f"Done! Predictions saved to {OUTPUT_FILE}.")
 
 if __name__ == "__main__":
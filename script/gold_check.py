@@ -0,0 +1,188 @@
+"""
+Checks the entity offsets of gold (or prediction) files and repairs them.
+
+For every entity, text[start:end] must be exactly the entity text. The browser tool
+verktyg/testdata_indexfixer.html fixes this one pasted file at a time, this script does the same
+for whole corpora (e.g. synthetic ones), one document at a time:
+
+    moved       the span did not match, it is moved to the occurrence of the entity text that is
+                nearest to the old start and not already used by another entity with the same text
+                ("Elin Rask" at 73-83 was "Elin Rask." and becomes 73-82)
+    trimmed     the entity text had whitespace around it, it is stripped before anchoring
+    missing     the entity text is not in the document at all, kept as it is (or --drop-missing)
+    duplicate   the same span with the same label twice, the copy is removed
+    conflict    the same span with different labels, reported
+    overlap     two different spans that overlap, reported (nested names, address inside an address...)
+
+The entity text is trusted over the offsets, like in the browser tool. Occurrences are found with
+str.find, so a document is checked in one pass over its entities without any extra dependencies.
+
+    python gold_check.py ../data/gold-sv-200.json                       # report only
+    python gold_check.py ../data/gold-sv-200.json --fix ../data/gold-sv-200.json
+    python gold_check.py synthetic.jsonl --fix synthetic-fixed.jsonl --drop-missing
+"""
+
+import argparse
+import os
+import sys
+from collections import Counter
+from columnar import entities_key
+from json_stream import iter_documents, DocumentWriter
+
+KINDS = ["moved", "trimmed", "missing", "duplicate", "conflict", "overlap"]
+# Kinds that --fix changes in the output
+REPAIRED = {"moved", "trimmed", "duplicate"}
+
+
+def occurrences(text, needle):
+    """Start of every occurrence of needle in text, overlapping ones included."""
+    starts = []
+    index = text.find(needle)
+    while index != -1:
+        starts.append(index)
+        index = text.find(needle, index + 1)
+    return starts
+
+
+def matches(text, entity):
+    """text[start:end] is the entity text. Checks the length too, a slice past the end of the text is shorter."""
+    start, end = entity["start"], entity["end"]
+    return 0 <= start and end - start == len(entity["text"]) > 0 and text[start:end] == entity["text"]
+
+
+def check_document(doc, key, drop_missing=False):
+    """
+    Returns (repaired document, issues) where issues are (kind, entity, message).
+    The document itself is not changed.
+    """
+    text = doc["text"]
+    entities = [dict(entity) for entity in doc[key]]
+    issues = []
+
+    # Spans that already match are taken first, so a moved entity never lands on one of them
+    used = set()
+    for entity in entities:
+        if matches(text, entity):
+            used.add((entity["start"], entity["end"]))
+
+    found = {}
+    kept = []
+    missing = []  # Kept in the output, but their spans mean nothing for the checks below
+    for entity in entities:
+        old_start, old_end = entity["start"], entity["end"]
+        if matches(text, entity):
+            kept.append(entity)
+            continue
+
+        stripped = entity["text"].strip()
+        if stripped != entity["text"]:
+            issues.append(("trimmed", entity, f"{entity['text']!r} -> {stripped!r}"))
+            entity["text"] = stripped
+        if not stripped:
+            issues.append(("missing", entity, "empty entity text"))
+            missing.append(entity)
+            continue
+
+        if stripped not in found:
+            found[stripped] = occurrences(text, stripped)
+        free = [start for start in found[stripped] if (start, start + len(stripped)) not in used]
+        if not free:
+            issues.append(("missing", entity, f"{stripped!r} is not in the text"))
+            missing.append(entity)
+            continue
+
+        # Nearest to the old start, the earlier one on a tie
+        start = min(free, key=lambda s: (abs(s - old_start), s))
+        entity["start"], entity["end"] = start, start + len(stripped)
+        used.add((entity["start"], entity["end"]))
+        if (entity["start"], entity["end"]) != (old_start, old_end):
+            issues.append(("moved", entity, f"{old_start}-{old_end} {text[old_start:old_end]!r} -> {entity['start']}-{entity['end']}"))
+        kept.append(entity)
+
+    # Duplicates and conflicts: the same span more than once
+    labels = {}
+    unique = []
+    for entity in kept:
+        span = (entity["start"], entity["end"])
+        if span in labels:
+            if entity.get("label") in labels[span]:
+                issues.append(("duplicate", entity, f"{span[0]}-{span[1]} {entity['text']!r} ({entity.get('label')})"))
+                continue
+            issues.append(("conflict", entity, f"{span[0]}-{span[1]} {entity['text']!r} is {' and '.join(sorted(labels[span]))} and {entity.get('label')}"))
+            labels[span].add(entity.get("label"))
+        else:
+            labels[span] = {entity.get("label")}
+        unique.append(entity)
+
+    # Overlaps: sweep over the spans in order, against the one that reaches furthest so far
+    reach = None
+    for entity in sorted(unique, key=lambda e: (e["start"], e["end"])):
+        if reach is not None and entity["start"] < reach["end"] and (entity["start"], entity["end"]) != (reach["start"], reach["end"]):
+            issues.append(("overlap", entity, f"{entity['start']}-{entity['end']} {entity['text']!r} overlaps "
+                                              f"{reach['start']}-{reach['end']} {reach['text']!r}"))
+        if reach is None or entity["end"] > reach["end"]:
+            reach = entity
+
+    # In the original order, duplicates (and with drop_missing the missing ones) left out
+    keep = {id(entity) for entity in unique + ([] if drop_missing else missing)}
+    return {**doc, key: [entity for entity in entities if id(entity) in keep]}, issues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and repair entity offsets in gold or prediction files")
+    parser.add_argument("input", help=".json, .jsonl or .cols")
+    parser.add_argument("--fix", metavar="OUTPUT", help="Write the repaired documents here (.json or .jsonl, may be the input file)")
+    parser.add_argument("--drop-missing", action="store_true", help="Remove entities whose text is not in the document")
+    parser.add_argument("--show", type=int, default=20, help="Issues to list per kind (0 for none, -1 for all)")
+    args = parser.parse_args()
+
+    counts = Counter()
+    shown = Counter()
+    documents = entities = 0
+    labels = Counter()
+    # Written next to the output and renamed at the end, so the input can be fixed in place
+    writer = temp_path = None
+    if args.fix:
+        base, extension = os.path.splitext(args.fix)
+        temp_path = f"{base}.{os.getpid()}.tmp{extension}"
+        writer = DocumentWriter(temp_path)
+    try:
+        for doc in iter_documents(args.input):
+            key = entities_key(doc)
+            fixed, issues = check_document(doc, key, args.drop_missing)
+            documents += 1
+            entities += len(doc[key])
+            for kind, entity, message in issues:
+                counts[kind] += 1
+                labels[entity.get("label")] += 1
+                if args.show < 0 or shown[kind] < args.show:
+                    shown[kind] += 1
+                    print(f"{kind:<9} {doc['id']}:{entity.get('id', '-')} {entity.get('label')}: {message}")
+            if writer is not None:
+                writer.write(fixed)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+        raise
+
+    print(f"\n{documents} documents, {entities} entities")
+    for kind in KINDS:
+        note = ""
+        if counts[kind] and args.fix:
+            note = " (repaired)" if kind in REPAIRED or (kind == "missing" and args.drop_missing) else " (not changed)"
+        print(f"  {kind:<10} {counts[kind]:6d}{note}")
+    if labels:
+        print("Issues per label: " + ", ".join(f"{label} {count}" for label, count in labels.most_common()))
+
+    if writer is not None:
+        writer.close()
+        os.replace(temp_path, args.fix)
+        print(f"Saved {args.fix}")
+    # A failing exit code when checking only, so the check can run before an evaluation
+    if not args.fix and sum(counts.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Reading and writing document files one document at a time.
+
+json.load reads a whole gold or prediction file into memory before the first document can be
+used. iter_documents yields the documents of
+
+    .json   a JSON array of documents (our gold and prediction files), parsed incrementally:
+            the file is read in blocks and json's raw_decode takes one document at a time
+    .jsonl  one document per line
+    .cols   the columnar format, see columnar.py
+
+so memory only depends on the largest document, not on the corpus. While reading, a progress
+line (bytes read of the file size, documents, documents per second) is written to stderr.
+
+DocumentWriter is the other direction: documents are appended one at a time, the .json output
+is formatted exactly like json.dump(documents, f, ensure_ascii=False, indent=2). A run that is
+interrupted leaves a .json array without its closing bracket, iter_documents reads the complete
+documents of such a file and warns.
+"""
+
+import codecs
+import json
+import os
+import sys
+import time
+
+READ_BLOCK = 1024 * 1024
+PROGRESS_INTERVAL = 2.0  # Seconds between progress lines
+WHITESPACE = " \t\r\n"
+
+
+class Progress:
+    """Prints how far into a file the reader is, at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, path, enabled=True, interval=PROGRESS_INTERVAL):
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.enabled = enabled
+        self.interval = interval
+        self.started = self.last = time.perf_counter()
+        self.documents = 0
+
+    def update(self, position, force=False):
+        self.documents += 0 if force else 1
+        now = time.perf_counter()
+        if not self.enabled or (not force and now - self.last < self.interval):
+            return
+        self.last = now
+        share = position / self.size if self.size else 1.0
+        rate = self.documents / (now - self.started) if now > self.started else 0.0
+        print(f"{self.name}: {share:6.1%} read, {self.documents} documents ({rate:.0f}/s)", file=sys.stderr)
+
+    def done(self, position):
+        self.update(position, force=True)
+
+
+def iter_json_array(f, progress):
+    """The elements of a JSON array in the binary file f, one at a time."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0     # Index in buffer
+    bytes_read = 0   # For the progress, the exact position in the file is not known after decoding
+    eof = False
+    started = False
+
+    def read_more():
+        nonlocal buffer, position, bytes_read, eof
+        # Drop what has been parsed, and read at least as much as is left so a large document is not re-parsed many times
+        buffer = buffer[position:]
+        position = 0
+        block = f.read(max(READ_BLOCK, len(buffer)))
+        bytes_read += len(block)
+        buffer += utf8.decode(block, final=not block)
+        eof = not block
+
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if eof:
+                if started:
+                    print(f"WARNING: {progress.name} ends inside the array, it was probably not written completely", file=sys.stderr)
+                return
+            read_more()
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise json.JSONDecodeError("Expected a JSON array of documents", buffer, position)
+            started = True
+            position += 1
+            continue
+        if char == "]":
+            return
+        if char == ",":
+            position += 1
+            continue
+
+        try:
+            document, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+        # A document that ends exactly at the end of the buffer may be cut off (a number), read on first
+        if end == len(buffer) and not eof:
+            read_more()
+            continue
+        position = end
+        progress.update(bytes_read)
+        yield document
+
+
+def iter_documents(path, progress=True):
+    """Yields the documents of a .json, .jsonl or .cols file one at a time."""
+    if path.endswith(".cols"):
+        from columnar import ColumnarFile
+
+        with ColumnarFile(path) as data:
+            yield from data.documents()
+        return
+
+    tracker = Progress(path, progress)
+    with open(path, "rb") as f:
+        if path.endswith(".jsonl"):
+            bytes_read = 0
+            for line in f:
+                bytes_read += len(line)
+                if line.strip():
+                    yield json.loads(line)
+                    tracker.update(bytes_read)
+        else:
+            yield from iter_json_array(f, tracker)
+    tracker.done(tracker.size)
+
+
+class DocumentWriter:
+    """Writes documents one at a time to a .json array (formatted like json.dump with indent=2) or a .jsonl file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = path.endswith(".jsonl")
+        self.file = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, document):
+        if self.lines:
+            self.file.write(json.dumps(document, ensure_ascii=False) + "\n")
+        else:
+            text = json.dumps(document, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            self.file.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+        self.count += 1
+        # Written documents survive a crash of the run
+        self.file.flush()
+
+    def close(self):
+        if not self.lines:
+            self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,226 @@
+"""
+Helpers for building model requests that are friendly to prompt caching.
+
+Both OpenAI and Ollama can reuse work for a prompt prefix they have already seen:
+
+    - OpenAI caches the longest previously seen prefix of the prompt (system prompt + the first
+      part of the messages) and reports it as usage.prompt_tokens_details.cached_tokens.
+      Note that OpenAI only starts caching once the prompt is at least 1024 tokens long.
+    - Ollama keeps the KV cache of the last prompt for as long as the model stays loaded, so a
+      byte-identical prefix is only evaluated once. keep_alive pins the model in memory between calls.
+
+For this to work the prefix must be EXACTLY the same for every call. Everything that varies
+(the document or chunk text) is therefore always placed last, after a fixed instruction.
+"""
+
+import hashlib
+import time
+
+# How long Ollama should keep the model loaded after a call ("-1" = forever)
+OLLAMA_KEEP_ALIVE = "30m"
+
+
+def build_messages(system_prompt, instruction, text):
+    """
+    Builds the message list with a stable prefix.
+    The system prompt and the instruction are constants, the text is always appended last.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{instruction}\n\n{text}"}
+    ]
+
+
+def prefix_fingerprint(system_prompt, instruction):
+    """Short hash of the static prefix. If it changes between runs, the cache cannot be reused."""
+    prefix = f"{system_prompt}\x00{instruction}".encode("utf-8")
+    return hashlib.sha256(prefix).hexdigest()[:12]
+
+
+def empty_call_stats():
+    return {
+        "ttft": None,             # Seconds until the first content token arrived
+        "latency": 0.0,           # Seconds for the whole call
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "completion_tokens": 0,
+        "model_load": None        # Ollama only: seconds spent loading the model (0 = it was already warm)
+    }
+
+
+def _openai_delta(chunk, stats, started):
+    """Returns the content delta of one streamed OpenAI chunk and picks up TTFT and usage."""
+    delta = None
+    if chunk.choices:
+        delta = chunk.choices[0].delta.content
+        if delta and stats["ttft"] is None:
+            stats["ttft"] = time.perf_counter() - started
+
+    # The last chunk has no choices, only usage
+    if chunk.usage:
+        stats["prompt_tokens"] = chunk.usage.prompt_tokens or 0
+        stats["completion_tokens"] = chunk.usage.completion_tokens or 0
+        details = getattr(chunk.usage, "prompt_tokens_details", None)
+        if details is not None:
+            stats["cached_tokens"] = getattr(details, "cached_tokens", 0) or 0
+    return delta
+
+
+def _ollama_delta(chunk, stats, started):
+    """Returns the content delta of one streamed Ollama chunk and picks up TTFT and token counts."""
+    delta = chunk["message"]["content"]
+    if delta and stats["ttft"] is None:
+        stats["ttft"] = time.perf_counter() - started
+
+    if chunk.get("done"):
+        # Ollama only reports the tokens it had to evaluate, cached prefix tokens are not counted
+        stats["prompt_tokens"] = chunk.get("prompt_eval_count") or 0
+        stats["completion_tokens"] = chunk.get("eval_count") or 0
+        stats["model_load"] = (chunk.get("load_duration") or 0) / 1e9
+    return delta
+
+
+def stream_openai(client, model, messages, temperature=0.1, stats=None):
+    """
+    Yields the content of an OpenAI chat completion piece by piece as it is generated.
+    stats (see empty_call_stats) is filled in while streaming and is complete when the generator ends.
+    """
+    stats = stats if stats is not None else empty_call_stats()
+    started = time.perf_counter()
+
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    for chunk in stream:
+        delta = _openai_delta(chunk, stats, started)
+        if delta:
+            yield delta
+
+    stats["latency"] = time.perf_counter() - started
+
+
+def stream_ollama(client, model, messages, options, keep_alive=OLLAMA_KEEP_ALIVE, stats=None):
+    """
+    Yields the content of an Ollama chat answer piece by piece, with keep_alive so the model stays warm.
+    Options must be the same for every call - changing e.g. num_ctx forces Ollama to reload the model.
+    client is an ollama.Client, see clients.ollama_client().
+    """
+    stats = stats if stats is not None else empty_call_stats()
+    started = time.perf_counter()
+
+    for chunk in client.chat(model=model, messages=messages, options=options, stream=True, keep_alive=keep_alive):
+        delta = _ollama_delta(chunk, stats, started)
+        if delta:
+            yield delta
+
+    stats["latency"] = time.perf_counter() - started
+
+
+def chat_openai(client, model, messages, temperature=0.1):
+    """
+    Calls the OpenAI chat API with streaming so that time-to-first-token can be measured.
+    Returns (content, stats).
+    """
+    stats = empty_call_stats()
+    content = "".join(stream_openai(client, model, messages, temperature, stats))
+    return content, stats
+
+
+def chat_ollama(client, model, messages, options, keep_alive=OLLAMA_KEEP_ALIVE):
+    """Calls a local Ollama model, see stream_ollama. Returns (content, stats)."""
+    stats = empty_call_stats()
+    content = "".join(stream_ollama(client, model, messages, options, keep_alive, stats))
+    return content, stats
+
+
+async def stream_openai_async(client, model, messages, temperature=0.1, stats=None):
+    """Same as stream_openai, for an AsyncOpenAI client (clients.async_openai_client())."""
+    stats = stats if stats is not None else empty_call_stats()
+    started = time.perf_counter()
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    async for chunk in stream:
+        delta = _openai_delta(chunk, stats, started)
+        if delta:
+            yield delta
+
+    stats["latency"] = time.perf_counter() - started
+
+
+async def chat_openai_async(client, model, messages, temperature=0.1):
+    """Same as chat_openai, for an AsyncOpenAI client (clients.async_openai_client())."""
+    stats = empty_call_stats()
+    parts = [delta async for delta in stream_openai_async(client, model, messages, temperature, stats)]
+    return "".join(parts), stats
+
+
+async def chat_ollama_async(client, model, messages, options, keep_alive=OLLAMA_KEEP_ALIVE):
+    """Same as chat_ollama, for an ollama.AsyncClient (clients.async_ollama_client())."""
+    stats = empty_call_stats()
+    started = time.perf_counter()
+
+    parts = []
+    async for chunk in await client.chat(model=model, messages=messages, options=options, stream=True, keep_alive=keep_alive):
+        delta = _ollama_delta(chunk, stats, started)
+        if delta:
+            parts.append(delta)
+
+    stats["latency"] = time.perf_counter() - started
+    return "".join(parts), stats
+
+
+class CacheReport:
+    """Collects call stats over a run and summarizes cache hits and time-to-first-token."""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.ttfts = []
+        self.warm_loads = 0
+
+    def add(self, stats):
+        self.calls += 1
+        self.prompt_tokens += stats["prompt_tokens"]
+        self.cached_tokens += stats["cached_tokens"]
+        if stats["ttft"] is not None:
+            self.ttfts.append(stats["ttft"])
+        # A load time under 100 ms means the model was already in memory
+        if stats["model_load"] is not None and stats["model_load"] < 0.1:
+            self.warm_loads += 1
+
+    def hit_ratio(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens > 0 else 0.0
+
+    def summary(self):
+        if self.calls == 0:
+            return "Prompt cache: no model calls"
+        mean_ttft = sum(self.ttfts) / len(self.ttfts) if self.ttfts else 0.0
+        text = (
+            f"Prompt cache: {self.cached_tokens}/{self.prompt_tokens} prompt tokens cached "
+            f"({self.hit_ratio():.0%}) over {self.calls} calls, mean TTFT {mean_ttft:.2f}s"
+        )
+        if self.warm_loads:
+            text += f", model warm in {self.warm_loads}/{self.calls} calls"
+        return text
+
+
+def format_call_stats(stats):
+    """One log line for a single call."""
+    ttft = f"{stats['ttft']:.2f}s" if stats["ttft"] is not None else "-"
+    return (
+        f"TTFT {ttft}, total {stats['latency']:.2f}s, "
+        f"cached {stats['cached_tokens']}/{stats['prompt_tokens']} prompt tokens"
+    )
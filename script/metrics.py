@@ -0,0 +1,252 @@
+"""
+Token, latency and cost instrumentation for model calls and pipeline stages.
+
+Everything is collected in a Metrics object:
+    - histograms for stage durations, model call latency and time-to-first-token
+    - counters for calls, errors, prompt/cached/completion tokens and cost
+    - per-document totals, so a slow document can be traced to OCR, chunking or the API
+
+The result can be exported to JSON/CSV (the scripts write it next to metrics.csv)
+or rendered in the Prometheus text format (the Flask app serves it on /metrics).
+"""
+
+import bisect
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds. Model calls and OCR take anything from a fraction of a second to minutes.
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# USD per 1M tokens: (input, cached input, output). Local Ollama models cost nothing.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+PREFIX = "pii"
+
+
+def escape_label(value):
+    """A label value for the Prometheus text format: backslash, double quote and newline escaped."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def call_cost(model, prompt_tokens, cached_tokens, completion_tokens):
+    """Cost in USD for one call. Cached prompt tokens are billed at the cached price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+class Histogram:
+    """Fixed-bucket histogram, same semantics as a Prometheus histogram (value <= bucket)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for c in self.counts:
+            total += c
+            result.append(total)
+        return result
+
+    def quantile(self, q):
+        """Approximate quantile: the upper bound of the bucket the q:th observation falls in."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(zip([str(b) for b in self.buckets], self.cumulative()))
+        }
+
+
+def new_document_totals():
+    return {
+        "calls": 0,
+        "errors": 0,
+        "model_seconds": 0.0,
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "completion_tokens": 0,
+        "cost_usd": 0.0,
+        "stages": {}
+    }
+
+
+class Metrics:
+    """Thread-safe collection of histograms, counters and per-document totals."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}   # (name, label_name, label_value) -> Histogram
+        self.counters = {}     # (name, label_name, label_value) -> float
+        self.documents = {}    # doc_id (a job id in the app) -> totals
+
+    def _document(self, doc_id):
+        if doc_id not in self.documents:
+            self.documents[doc_id] = new_document_totals()
+        return self.documents[doc_id]
+
+    def observe(self, name, value, label_name="", label_value=""):
+        with self.lock:
+            key = (name, label_name, label_value)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name, value=1, label_name="", label_value=""):
+        with self.lock:
+            key = (name, label_name, label_value)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def stage(self, name, doc_id=None):
+        """Times a pipeline stage: with metrics.stage("ocr", doc_id): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("stage_seconds", elapsed, "stage", name)
+            if doc_id is not None:
+                with self.lock:
+                    stages = self._document(doc_id)["stages"]
+                    stages[name] = stages.get(name, 0.0) + elapsed
+
+    def record_call(self, model, stats, doc_id=None):
+        """Records one successful model call from the stats returned by llm_request."""
+        cost = call_cost(model, stats["prompt_tokens"], stats["cached_tokens"], stats["completion_tokens"])
+
+        self.observe("model_call_seconds", stats["latency"], "model", model)
+        if stats["ttft"] is not None:
+            self.observe("model_ttft_seconds", stats["ttft"], "model", model)
+        self.inc("model_calls_total", 1, "model", model)
+        self.inc("prompt_tokens_total", stats["prompt_tokens"], "model", model)
+        self.inc("cached_tokens_total", stats["cached_tokens"], "model", model)
+        self.inc("completion_tokens_total", stats["completion_tokens"], "model", model)
+        self.inc("cost_usd_total", cost, "model", model)
+
+        if doc_id is not None:
+            with self.lock:
+                totals = self._document(doc_id)
+                totals["calls"] += 1
+                totals["model_seconds"] += stats["latency"]
+                totals["prompt_tokens"] += stats["prompt_tokens"]
+                totals["cached_tokens"] += stats["cached_tokens"]
+                totals["completion_tokens"] += stats["completion_tokens"]
+                totals["cost_usd"] += cost
+
+    def record_error(self, model, doc_id=None):
+        self.inc("model_errors_total", 1, "model", model)
+        if doc_id is not None:
+            with self.lock:
+                self._document(doc_id)["errors"] += 1
+
+    def document_summary(self, doc_id):
+        """One line with the totals for a document, for logs."""
+        with self.lock:
+            totals = self._document(doc_id)
+            stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in totals["stages"].items())
+            return (
+                f"{totals['calls']} calls, {totals['errors']} errors, "
+                f"{totals['prompt_tokens']}+{totals['completion_tokens']} tokens, "
+                f"${totals['cost_usd']:.4f}, model {totals['model_seconds']:.2f}s"
+                + (f" | {stages}" if stages else "")
+            )
+
+    def forget_document(self, doc_id):
+        """Drops the totals of a document, for long running processes once they are logged."""
+        with self.lock:
+            self.documents.pop(doc_id, None)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "histograms": [
+                    {"name": name, label_name or "label": label_value, **hist.to_dict()}
+                    for (name, label_name, label_value), hist in sorted(self.histograms.items())
+                ],
+                "counters": [
+                    {"name": name, label_name or "label": label_value, "value": value}
+                    for (name, label_name, label_value), value in sorted(self.counters.items())
+                ],
+                "documents": json.loads(json.dumps(self.documents))
+            }
+
+    def export_json(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def export_csv(self, filename):
+        """Writes one row per document with call totals and time per stage."""
+        with self.lock:
+            stage_names = sorted({name for totals in self.documents.values() for name in totals["stages"]})
+            columns = ["doc_id", "calls", "errors", "model_seconds", "prompt_tokens",
+                       "cached_tokens", "completion_tokens", "cost_usd"]
+            with open(filename, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(columns + [f"{name}_seconds" for name in stage_names])
+                for doc_id, totals in self.documents.items():
+                    row = [doc_id] + [totals[c] for c in columns[1:]]
+                    row += [round(totals["stages"].get(name, 0.0), 4) for name in stage_names]
+                    writer.writerow(row)
+
+    def prometheus(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            seen = set()
+            for (name, label_name, label_value), hist in sorted(self.histograms.items()):
+                full = f"{PREFIX}_{name}"
+                if full not in seen:
+                    lines.append(f"# TYPE {full} histogram")
+                    seen.add(full)
+                label = f'{label_name}="{escape_label(label_value)}",' if label_name else ""
+                for bound, total in zip(hist.buckets, hist.cumulative()):
+                    lines.append(f'{full}_bucket{{{label}le="{bound}"}} {total}')
+                lines.append(f'{full}_bucket{{{label}le="+Inf"}} {hist.count}')
+                label = f'{{{label_name}="{escape_label(label_value)}"}}' if label_name else ""
+                lines.append(f"{full}_sum{label} {hist.sum}")
+                lines.append(f"{full}_count{label} {hist.count}")
+
+            for (name, label_name, label_value), value in sorted(self.counters.items()):
+                full = f"{PREFIX}_{name}"
+                if full not in seen:
+                    lines.append(f"# TYPE {full} counter")
+                    seen.add(full)
+                label = f'{{{label_name}="{escape_label(label_value)}"}}' if label_name else ""
+                lines.append(f"{full}{label} {value}")
+
+        return "\n".join(lines) + "\n"
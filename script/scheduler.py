@@ -0,0 +1,353 @@
+"""
+Shared scheduler for model calls: rate limiting, retries and a circuit breaker.
+
+    - Two token buckets keep us under the provider limits for requests per minute (RPM)
+      and tokens per minute (TPM). Calls wait for capacity instead of getting a 429.
+    - Retryable errors (429, 408, 409, 5xx, timeouts, connection errors) are retried with
+      exponential backoff and full jitter. A Retry-After header from the server always wins.
+    - If many calls in a row fail, the circuit breaker opens and calls fail fast for a while
+      instead of wasting the rest of the run on a provider that is down.
+
+Usage:
+    scheduler = CallScheduler(requests_per_minute=500, tokens_per_minute=30000)
+    result = scheduler.call(lambda: chat_openai(...), estimated_tokens=estimate_tokens(text))
+
+The OpenAI client has its own retries - create it with max_retries=0 so calls are not retried twice.
+Run this file to try it against the fake server in fake_llm_server.py, which injects 429/500 errors.
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and the call is not attempted."""
+
+
+class TokenBucket:
+    """Classic token bucket. capacity tokens, refilled continuously at rate_per_minute."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1):
+        """Takes amount tokens if they are available and returns 0, else returns the seconds to wait."""
+        # A single request larger than the bucket would wait forever
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """Blocks until amount tokens are available and takes them. Returns the time waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, amount=1):
+        """Same as acquire, but waits without blocking the event loop."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def consume(self, amount):
+        """Takes tokens without waiting (may go negative). Used to correct an estimate afterwards."""
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class CircuitBreaker:
+    """
+    closed    - calls go through, consecutive failures are counted
+    open      - after failure_threshold failures in a row, calls fail fast for reset_timeout seconds
+    half-open - after the timeout one trial call is let through; success closes, failure opens again
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.trial_running):
+                raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures")
+            if state == "half-open":
+                self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Ends a half-open trial without an outcome, so the next call can be the trial."""
+        with self.lock:
+            self.trial_running = False
+
+    @contextmanager
+    def attempt(self):
+        """
+        One call through the breaker. Every way out records something, so a half-open trial never
+        stays running: success, a retryable error counts as a failure, any other error (e.g. a 400)
+        means the provider answered, and a call that is abandoned (GeneratorExit when the client of a
+        stream disconnects, cancellation) only ends the trial.
+        """
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_retryable(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+
+def status_code(error):
+    """HTTP status of an exception from openai, ollama or urllib, if it has one."""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error):
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # openai.APITimeoutError, openai.APIConnectionError, httpx.ReadTimeout, httpx.ConnectError ...
+    name = type(error).__name__
+    return "Timeout" in name or "Connect" in name
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    headers = getattr(error, "headers", None)
+    response = getattr(error, "response", None)
+    if headers is None and response is not None:
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        # Retry-After can also be an HTTP date
+        parsed = email.utils.parsedate_to_datetime(value)
+        if parsed is None:
+            return None
+        return max(parsed.timestamp() - time.time(), 0.0)
+
+
+def estimate_tokens(text, completion_tokens=256):
+    """Rough token count for the TPM bucket: ~4 characters per token plus room for the answer."""
+    return len(text) // 4 + completion_tokens
+
+
+class CallScheduler:
+    """Rate limits, retries and circuit-breaks calls to one model backend. Thread-safe."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=5,
+                 base_delay=1.0, max_delay=60.0, breaker=None, log=print):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.log = log
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def backoff(self, attempt, error):
+        """Delay before the next attempt: Retry-After if given, else exponential backoff with full jitter."""
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, estimated_tokens=0, used_tokens=None):
+        """
+        Runs fn() under the rate limits and retries it on retryable errors.
+        used_tokens(result) can return the real token usage, which corrects the TPM estimate.
+        Raises the last error when the retries are used up, or CircuitOpenError.
+        """
+        # A stream with a single item, so calls and streams share the retry loop
+        results = []
+
+        def single():
+            yield fn()
+
+        used = (lambda: used_tokens(results[0])) if used_tokens is not None else None
+        results.extend(self.stream(single, estimated_tokens, used))
+        return results[0]
+
+    def retry_delay(self, attempt, error, started_output):
+        """
+        Seconds to wait before retrying after a failed attempt, or None when the error is to be raised:
+        not retryable, part of the answer already passed on, or no retries left.
+        """
+        if not is_retryable(error) or started_output or attempt >= self.max_retries:
+            return None
+        delay = self.backoff(attempt, error)
+        self.retries += 1
+        if self.log:
+            self.log(f"WARNING: Model call failed ({status_code(error) or type(error).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def correct_tokens(self, estimated_tokens, used_tokens):
+        """Replaces the TPM estimate of a finished call with used_tokens() (the real usage), if known."""
+        if self.tokens and used_tokens is not None:
+            used = used_tokens()
+            if used:
+                self.tokens.consume(used - min(estimated_tokens, self.tokens.capacity))
+
+    def stream(self, make_stream, estimated_tokens=0, used_tokens=None):
+        """
+        Like call(), for a streamed answer: make_stream() returns a generator and its items are
+        passed on as they arrive. A failed attempt is only retried if nothing has been passed on
+        yet, otherwise the consumer would get the beginning of the answer twice.
+        used_tokens() (no argument) can return the real token usage once the stream has ended.
+        """
+        attempt = 0
+        while True:
+            started_output = False
+            try:
+                with self.breaker.attempt():
+                    if self.requests:
+                        self.throttled_seconds += self.requests.acquire(1)
+                    if self.tokens and estimated_tokens:
+                        self.throttled_seconds += self.tokens.acquire(estimated_tokens)
+                    for item in make_stream():
+                        started_output = True
+                        yield item
+            except Exception as e:
+                delay = self.retry_delay(attempt, e, started_output)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.correct_tokens(estimated_tokens, used_tokens)
+            return
+
+    async def astream(self, make_stream, estimated_tokens=0, used_tokens=None):
+        """
+        Same as stream(), for an async generator (e.g. llm_request.stream_openai_async).
+        Waiting for rate limits and backoff does not block the event loop.
+        """
+        attempt = 0
+        while True:
+            started_output = False
+            try:
+                with self.breaker.attempt():
+                    if self.requests:
+                        self.throttled_seconds += await self.requests.acquire_async(1)
+                    if self.tokens and estimated_tokens:
+                        self.throttled_seconds += await self.tokens.acquire_async(estimated_tokens)
+                    async for item in make_stream():
+                        started_output = True
+                        yield item
+            except Exception as e:
+                delay = self.retry_delay(attempt, e, started_output)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.correct_tokens(estimated_tokens, used_tokens)
+            return
+
+
+if __name__ == "__main__":
+    # Demo: 20 calls against the fake server with 30% injected 429/500 errors
+    import json
+    import urllib.request
+    from fake_llm_server import start_server
+
+    server = start_server(port=0, error_rate=0.3, latency=0.05)
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    def fake_call():
+        body = json.dumps({"model": "fake", "messages": [{"role": "user", "content": "Anna bor i Malmö"}]}).encode("utf-8")
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.loads(response.read())
+
+    scheduler = CallScheduler(requests_per_minute=600, tokens_per_minute=60000, base_delay=0.1, max_delay=2.0,
+                              breaker=CircuitBreaker(failure_threshold=10, reset_timeout=2.0))
+    ok = 0
+    for _ in range(20):
+        try:
+            scheduler.call(fake_call, estimated_tokens=100)
+            ok += 1
+        except Exception as e:
+            print(f"ERROR: {e}")
+
+    print(f"{ok}/20 calls succeeded, {scheduler.retries} retries, {scheduler.throttled_seconds:.2f}s throttled")
+    server.shutdown()
@@ -0,0 +1,109 @@
+"""
+Incremental parsing of the model answer while it is being streamed.
+
+The answer format is line oriented (<label_id><entity_text>, one entity per line), so every
+entity can be parsed and shown in the text as soon as its line is complete, instead of
+waiting for the whole completion. The saved result still comes from index_finder() on the
+complete answer, see IncrementalIndexFinder.replace.
+"""
+
+
+def iter_lines(deltas):
+    """Turns a stream of text pieces into complete lines. The last line does not need a newline."""
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            yield line
+    if buffer:
+        yield buffer
+
+
+def parse_line(line, label_ids):
+    """Returns (label_id, entity_text) for a valid line, otherwise None."""
+    line = line.strip()
+    if len(line) >= 2 and line[0] in label_ids:
+        return line[0], line[1:]
+    return None
+
+
+class IncrementalIndexFinder:
+    """
+    Finds provisional start/end indices for entities one at a time, as they stream in, so the
+    browser can highlight them right away.
+
+    index_finder places the longest entities first so that "Anna" does not take the position
+    inside "Anna Hansson". Here "Anna" may arrive first, so when a longer entity only fits where
+    shorter ones have already been placed, the shorter ones are moved to their next free
+    occurrence, and add() returns both added and removed entities. This does not always end where
+    index_finder ends: for 'Anna Bergström Anna Anna Berg' and the answer Anna, Berg, Anna Berg
+    it gives 0-4, 5-9, 20-29 where index_finder gives 0-9 (Anna Berg inside Anna Bergström) and
+    15-19. So when the answer is complete, replace() swaps in the index_finder result and returns
+    the difference, and only that result is saved.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.placed = []
+
+    def _overlapping(self, start, end):
+        return [e for e in self.placed if e["start"] < end and start < e["end"]]
+
+    def _free_occurrence(self, entity_text):
+        start = self.text.find(entity_text)
+        while start != -1:
+            if not self._overlapping(start, start + len(entity_text)):
+                return start
+            start = self.text.find(entity_text, start + 1)
+        return -1
+
+    def _place(self, label_id, entity_text, start):
+        entity = {"label_id": label_id, "text": entity_text, "start": start, "end": start + len(entity_text)}
+        self.placed.append(entity)
+        return entity
+
+    def add(self, label_id, entity_text):
+        """Locates one entity. Returns (added, removed), two lists of {"label_id", "text", "start", "end"}."""
+        if not entity_text:
+            return [], []
+
+        start = self._free_occurrence(entity_text)
+        if start != -1:
+            return [self._place(label_id, entity_text, start)], []
+
+        # No free occurrence: take one that is only blocked by shorter entities inside it
+        start = self.text.find(entity_text)
+        while start != -1:
+            end = start + len(entity_text)
+            blocking = self._overlapping(start, end)
+            if all(start <= e["start"] and e["end"] <= end and e["end"] - e["start"] < len(entity_text) for e in blocking):
+                for e in blocking:
+                    self.placed.remove(e)
+                added = [self._place(label_id, entity_text, start)]
+                for e in blocking:
+                    moved_to = self._free_occurrence(e["text"])
+                    if moved_to != -1:
+                        added.append(self._place(e["label_id"], e["text"], moved_to))
+                return added, blocking
+            start = self.text.find(entity_text, start + 1)
+
+        return [], []
+
+    def replace(self, entities):
+        """
+        Replaces the placements with the final ones (dicts with the same keys). Returns (added, removed)
+        like add(), with only the entities that differ.
+        """
+        def key(e):
+            return e["label_id"], e["text"], e["start"], e["end"]
+        old = {key(e) for e in self.placed}
+        new = {key(e) for e in entities}
+        removed = [e for e in self.placed if key(e) not in new]
+        added = [e for e in entities if key(e) not in old]
+        self.placed = list(entities)
+        return added, removed
+
+    def entities(self):
+        """The current placements, sorted by start index."""
+        return sorted(self.placed, key=lambda e: e["start"])
@@ -0,0 +1,299 @@
+"""
+Synthetic Swedish documents with gold entities, in the same format as data/gold-sv-*.json.
+
+The hand-made gold sets have 30 and 200 documents, too few to load test the pipeline or the
+evaluator. This script writes any number of documents built from sentence templates filled with
+generated people: names, addresses, phone numbers, personnummer (with a valid check digit) and
+emails. The text is put together piece by piece, so the offset of every entity is known when it
+is inserted and the gold offsets are exact by construction.
+
+Every document has its own random generator, seeded with the seed and the document number, so
+the same seed gives the same corpus however many worker processes are used and a corpus can be
+extended or split (--start). The documents are written one at a time (json_stream.DocumentWriter),
+so a corpus of millions of documents never has to fit in memory.
+
+    python synthetic_corpus.py ../data/synthetic-10k.jsonl --count 10000
+    python synthetic_corpus.py big.jsonl --count 2000000 --workers 8 --seed 7
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+from json_stream import DocumentWriter
+
+FIRST_NAMES_FEMALE = ["Anna", "Eva", "Maria", "Karin", "Sara", "Elin", "Emma", "Maja", "Ida", "Linnea",
+                      "Johanna", "Sofia", "Kerstin", "Ingrid", "Astrid", "Ebba", "Frida", "Malin",
+                      "Anna-Karin", "Lena", "Birgitta", "Hanna", "Alva", "Wilma", "Åsa", "Märta"]
+FIRST_NAMES_MALE = ["Erik", "Lars", "Karl", "Johan", "Anders", "Per", "Nils", "Mikael", "Oskar", "Lucas",
+                    "Henrik", "Gustav", "Olof", "Sven", "Björn", "Magnus", "Jonas", "David", "Ali",
+                    "Per-Olof", "Hugo", "Axel", "Elias", "Måns", "Göran", "Örjan"]
+LAST_NAMES = ["Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Larsson", "Olsson",
+              "Persson", "Svensson", "Gustafsson", "Lindberg", "Lindgren", "Berg", "Holm", "Ek",
+              "Strand", "Nyström", "Rask", "Ström", "Åberg", "Sjöberg", "Lundqvist", "Hedlund",
+              "Björk", "Mohammed", "Nguyen", "Öberg", "af Klint"]
+STREETS = ["Storgatan", "Kyrkogatan", "Drottninggatan", "Björkvägen", "Sjövägen", "Skolvägen",
+           "Stjärnvägen", "Järnvägsgatan", "Ringvägen", "Åsgatan", "Hamngatan", "Östra Långgatan",
+           "Norra Vallgatan", "Lilla Torget", "Ekbacken", "Tallstigen"]
+# City and the first three digits of its postal codes
+CITIES = [("Stockholm", ["111", "113", "116", "118", "125"]), ("Göteborg", ["411", "413", "416", "418"]),
+          ("Malmö", ["211", "214", "217"]), ("Uppsala", ["752", "753", "754"]), ("Linköping", ["582", "583"]),
+          ("Örebro", ["702", "703"]), ("Västerås", ["722", "724"]), ("Umeå", ["903", "907"]),
+          ("Lund", ["222", "224"]), ("Visby", ["621"]), ("Hässleholm", ["281"]), ("Kiruna", ["981"]),
+          ("Jönköping", ["553", "554"]), ("Gävle", ["802", "803"]), ("Skövde", ["541"])]
+AREA_CODES = ["08", "031", "040", "013", "018", "019", "021", "090", "046", "0498", "0451", "0980"]
+EMAIL_DOMAINS = ["gmail.com", "hotmail.com", "outlook.com", "telia.com", "live.se", "yahoo.se",
+                 "kommun.se", "foretaget.se", "skola.edu", "region.se"]
+ORGANISATIONS = ["Skatteverket", "Försäkringskassan", "kommunen", "vårdcentralen", "banken",
+                 "hyresvärden", "skolan", "Arbetsförmedlingen", "CSN", "tandläkaren"]
+ASCII = str.maketrans({"å": "a", "ä": "a", "ö": "o", "é": "e", "ü": "u", " ": "", "-": ""})
+
+# {NAME}, {PHONE}, {ADDRESS}, {NATIONAL_ID} and {EMAIL} become gold entities of the person the
+# sentence is about. {PRONOUN} (Hon/Han), {ORG}, {DATE}, {AMOUNT} and {CASE} are plain text, the
+# dates, amounts and case numbers are digits that are not personal data.
+OPENINGS = [
+    "Hej {NAME}!",
+    "Till {NAME}, {ADDRESS}.",
+    "Ärende {CASE} gäller {NAME}.",
+    "Anteckning från {ORG} {DATE}.",
+    "Beslut från {ORG} daterat {DATE}.",
+    "Hej, jag skriver angående ärende {CASE}.",
+]
+SENTENCES = [
+    "När handläggaren på {ORG} ringde stod det att ansökan skickats av {NAME}.",
+    "{PRONOUN} nås på {PHONE} eller via {EMAIL}.",
+    "Personnummer: {NATIONAL_ID}.",
+    "Sökandens personnummer är {NATIONAL_ID} och adressen är {ADDRESS}.",
+    "{NAME} ({NATIONAL_ID}) har flyttat till {ADDRESS}.",
+    "Ring {NAME} på {PHONE} om något är oklart.",
+    "Kontaktperson är {NAME}, tel. {PHONE}.",
+    "Skicka handlingarna till {EMAIL} senast {DATE}.",
+    "Vår adress: {ADDRESS}.",
+    "{PRONOUN} bor på {ADDRESS} sedan {DATE}.",
+    "Beloppet {AMOUNT} kronor betalas ut till {NAME}.",
+    "Mejla gärna {EMAIL} om du har frågor.",
+    "Tel: {PHONE}.",
+    "{NAME} meddelade {ORG} att {PRONOUN_LOWER} inte kunde komma på mötet {DATE}.",
+    "Vid frågor, kontakta {NAME} på {EMAIL} eller {PHONE}.",
+    "Fakturan på {AMOUNT} kr skickas till {ADDRESS}.",
+    "Enligt {ORG} är {NAME} född {BIRTH_DATE}.",
+    "Ansökan kom in {DATE} och handläggs under ärendenummer {CASE}.",
+    "Betala senast {DATE}.",
+    "Mötet flyttades eftersom lokalen var upptagen.",
+    "Handläggningstiden är för närvarande cirka sex veckor.",
+    "Vi återkommer så snart vi har gått igenom underlagen.",
+    "Tack för din uppmärksamhet.",
+]
+CLOSINGS = [
+    "Med vänliga hälsningar, {NAME}",
+    "Mvh\n{NAME}\n{PHONE}",
+    "Hälsningar {NAME}",
+]
+SLOT = re.compile(r"\{(\w+)\}")
+ENTITY_SLOTS = {"NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"}
+LABELS = ["NAME", "PHONE", "ADDRESS", "NATIONAL_ID", "EMAIL"]
+
+BATCH_SIZE = 500  # Documents per task for a worker process
+
+
+def luhn_digit(digits):
+    """Check digit of a personnummer: Luhn over YYMMDDNNN, every other digit doubled from the first."""
+    total = 0
+    for i, char in enumerate(digits):
+        value = int(char) * (2 if i % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str((10 - total % 10) % 10)
+
+
+class Person:
+    """A generated person. All entities of a person belong together: the email is made from the name, etc."""
+
+    def __init__(self, rng):
+        self.female = rng.random() < 0.5
+        self.first = rng.choice(FIRST_NAMES_FEMALE if self.female else FIRST_NAMES_MALE)
+        self.last = rng.choice(LAST_NAMES)
+        if rng.random() < 0.1:
+            self.last += "-" + rng.choice(LAST_NAMES)
+        self.birth = (rng.randint(1930, 2006), rng.randint(1, 12), rng.randint(1, 28))
+        self.rng = rng
+        self.values = {}
+
+    def entity(self, label):
+        """Text for an entity of this person. The name is sometimes shortened, the rest is the same in every mention."""
+        if label == "NAME":
+            return self.name()
+        if label not in self.values:
+            self.values[label] = getattr(self, label.lower())()
+        return self.values[label]
+
+    def name(self):
+        if self.rng.random() < 0.1:
+            return self.first
+        return f"{self.first} {self.last}"
+
+    def national_id(self):
+        rng = self.rng
+        year, month, day = self.birth
+        # The third digit of the serial number is odd for men and even for women
+        serial = f"{rng.randint(0, 99):02d}{rng.randrange(0 if self.female else 1, 10, 2)}"
+        digits = f"{year % 100:02d}{month:02d}{day:02d}{serial}"
+        number = digits + luhn_digit(digits)
+        style = rng.random()
+        if style < 0.6:
+            return f"{number[:6]}-{number[6:]}"
+        if style < 0.85:
+            return f"{year // 100}{number[:6]}-{number[6:]}"
+        return number
+
+    def phone(self):
+        rng = self.rng
+        if rng.random() < 0.7:
+            rest = f"{rng.randint(0, 9)}{rng.randint(0, 9999999):07d}"
+            style = rng.random()
+            if style < 0.4:
+                return f"07{rest[0]} {rest[1:4]} {rest[4:6]} {rest[6:]}"
+            if style < 0.7:
+                return f"07{rest[0]}-{rest[1:4]} {rest[4:6]} {rest[6:]}"
+            if style < 0.85:
+                return f"07{rest}"
+            return f"+46 7{rest[0]} {rest[1:4]} {rest[4:6]} {rest[6:]}"
+        area = rng.choice(AREA_CODES)
+        length = 10 - len(area)
+        number = f"{rng.randint(0, 10 ** length - 1):0{length}d}"
+        if rng.random() < 0.5:
+            return f"{area}-{number[:-4]} {number[-4:-2]} {number[-2:]}"
+        return f"{area} {number}"
+
+    def address(self):
+        rng = self.rng
+        street = f"{rng.choice(STREETS)} {rng.randint(1, 120)}{rng.choice(['', '', '', 'A', 'B'])}"
+        if rng.random() < 0.2:
+            return street
+        city, prefixes = rng.choice(CITIES)
+        return f"{street}, {rng.choice(prefixes)} {rng.randint(0, 99):02d} {city}"
+
+    def email(self):
+        rng = self.rng
+        first, last = self.first.lower().translate(ASCII), self.last.lower().translate(ASCII)
+        style = rng.random()
+        if style < 0.5:
+            local = f"{first}.{last}"
+        elif style < 0.7:
+            local = f"{first[0]}.{last}"
+        else:
+            local = f"{first}{last}{rng.randint(1, 99)}"
+        return f"{local}@{rng.choice(EMAIL_DOMAINS)}"
+
+
+def fill(rng, slot, person):
+    """Text for a slot that is not an entity."""
+    if slot == "PRONOUN":
+        return "Hon" if person.female else "Han"
+    if slot == "PRONOUN_LOWER":
+        return "hon" if person.female else "han"
+    if slot == "ORG":
+        return rng.choice(ORGANISATIONS)
+    if slot == "DATE":
+        return f"{rng.randint(2019, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    if slot == "BIRTH_DATE":
+        return "{}-{:02d}-{:02d}".format(*person.birth)
+    if slot == "AMOUNT":
+        return f"{rng.randint(1, 99)} {rng.randint(0, 999):03d}"
+    if slot == "CASE":
+        return f"{rng.randint(1000, 9999)}-{rng.randint(10000, 99999)}"
+    raise ValueError(f"Unknown slot {{{slot}}}")
+
+
+def generate_document(index, seed=0, min_sentences=3, max_sentences=12):
+    """Document number index of the corpus with this seed, as a gold document dict."""
+    rng = random.Random(f"{seed}:{index}")
+    people = [Person(rng) for _ in range(rng.randint(1, 3))]
+    parts = []
+    entities = []
+    position = 0
+
+    sentences = [rng.choice(OPENINGS)] + [rng.choice(SENTENCES) for _ in range(rng.randint(min_sentences, max_sentences))]
+    if rng.random() < 0.5:
+        sentences.append(rng.choice(CLOSINGS))
+    for n, template in enumerate(sentences):
+        if n:
+            separator = "\n\n" if rng.random() < 0.15 else " "
+            parts.append(separator)
+            position += len(separator)
+        # Each sentence is about one person
+        person = rng.choice(people)
+        last = 0
+        for match in SLOT.finditer(template):
+            literal = template[last:match.start()]
+            parts.append(literal)
+            position += len(literal)
+            slot = match.group(1)
+            if slot in ENTITY_SLOTS:
+                value = person.entity(slot)
+                entities.append({"id": f"e{len(entities) + 1}", "label": slot, "start": position,
+                                 "end": position + len(value), "text": value})
+            else:
+                value = fill(rng, slot, person)
+            parts.append(value)
+            position += len(value)
+            last = match.end()
+        parts.append(template[last:])
+        position += len(template) - last
+
+    return {"id": f"syn-{index:07d}", "language": "sv", "text": "".join(parts), "gold_entities": entities}
+
+
+def generate_batch(task):
+    first, last, seed, min_sentences, max_sentences = task
+    return [generate_document(i, seed, min_sentences, max_sentences) for i in range(first, last)]
+
+
+def generate_documents(count, seed=0, start=0, workers=1, min_sentences=3, max_sentences=12, batch_size=BATCH_SIZE):
+    """Yields documents start..start + count - 1 in order, generated by workers processes."""
+    tasks = ((first, min(first + batch_size, start + count), seed, min_sentences, max_sentences)
+             for first in range(start, start + count, batch_size))
+    if workers <= 1:
+        for task in tasks:
+            yield from generate_batch(task)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        # imap keeps the order and only runs a few batches ahead of the writer
+        for batch in pool.imap(generate_batch, tasks):
+            yield from batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic Swedish gold documents")
+    parser.add_argument("output", help="Output file, .json (an array like data/gold-sv-200.json) or .jsonl")
+    parser.add_argument("--count", type=int, default=1000, help="Number of documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=int, default=0, help="Number of the first document, to extend a corpus")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-sentences", type=int, default=3)
+    parser.add_argument("--max-sentences", type=int, default=12)
+    args = parser.parse_args()
+
+    label_counts = {label: 0 for label in LABELS}
+    characters = 0
+    started = last_report = time.perf_counter()
+    with DocumentWriter(args.output) as writer:
+        for doc in generate_documents(args.count, args.seed, args.start, args.workers, args.min_sentences, args.max_sentences):
+            writer.write(doc)
+            characters += len(doc["text"])
+            for entity in doc["gold_entities"]:
+                label_counts[entity["label"]] += 1
+            now = time.perf_counter()
+            if now - last_report > 2:
+                last_report = now
+                print(f"{writer.count} / {args.count} documents ({writer.count / (now - started):.0f}/s)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"Saved {args.count} documents ({characters} characters, {sum(label_counts.values())} entities) to {args.output} in {elapsed:.1f}s")
+    print(", ".join(f"{label} {count}" for label, count in label_counts.items()))
+
+
+if __name__ == "__main__":
+    main()